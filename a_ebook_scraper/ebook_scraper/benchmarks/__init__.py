@@ -0,0 +1,4 @@
+# Benchmarks for the ebook_scraper project.
+#
+# Run them from the directory containing scrapy.cfg, e.g.:
+#     python -m benchmarks.bench_feeds
@@ -0,0 +1,143 @@
+'''
+Diffing full exports after a run vs. ChangeAlertPipeline during the crawl.
+
+Two synthetic runs of --books books are written as JSON lines exports, the
+second with --changed of the prices and stock statuses changed. The full-export
+diff loads both files into dicts of rows and compares them afterwards, the way
+a consumer of the snapshots does. ChangeAlertPipeline loads the first export
+into its packed BookStateIndex and compares the second run's items as they come
+through process_item(). Both report the time taken and, in a separate run
+under tracemalloc (which slows everything down), the memory held by the
+loaded state.
+
+    python -m benchmarks.bench_changes --books 200000 --changed 0.01
+'''
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.catalogue import book
+from ebook_scraper.changes import BookStateIndex
+from ebook_scraper.pipelines import ChangeAlertPipeline
+
+
+def make_rows(count, changed, seed=0):
+    # (previous run, this run): the same books, a fraction of them changed
+    randomness = random.Random(seed)
+    previous, current = [], []
+    for number in range(1, count + 1):
+        values = book(number)
+        row = {'title': values['title'], 'rating': values['rating'], 'price': round(values['price'], 2),
+               'stock_status': 'In stock' if values['in_stock'] else 'Not In Stock'}
+        previous.append(row)
+        if randomness.random() < changed:
+            row = dict(row, price=round(row['price'] * 0.9, 2),
+                       stock_status='Not In Stock' if row['stock_status'] == 'In stock' else 'In stock')
+        current.append(row)
+    return previous, current
+
+
+def write_jsonlines(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def load_export(path):
+    with open(path, encoding='utf-8') as f:
+        return {row['title']: row for row in map(json.loads, f)}
+
+
+def state_memory(load):
+    # Bytes still allocated by what load() returns
+    tracemalloc.start()
+    state = load()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del state
+    return memory
+
+
+def diff_exports(previous_path, current_path):
+    # The consumer's side today: both snapshots in memory, compared afterwards
+    start = time.perf_counter()
+    previous = load_export(previous_path)
+    current = load_export(current_path)
+    fields = ('price', 'rating', 'stock_status')
+    changes = [key for key, row in current.items()
+               if key not in previous or any(row[field] != previous[key][field] for field in fields)]
+    changes += [key for key in previous if key not in current]
+    seconds = time.perf_counter() - start
+    return len(changes), seconds, state_memory(lambda: (load_export(previous_path), load_export(current_path)))
+
+
+def alert_pipeline(previous_path, items, directory):
+    pipeline = ChangeAlertPipeline(os.path.join(directory, 'changes.jsonl'), [previous_path])
+    start = time.perf_counter()
+    pipeline.open_spider(None)
+    loaded = time.perf_counter()
+    for item in items:
+        pipeline.process_item(item, None)
+    pipeline.close_spider(None)
+    pipeline.spider_closed(None, 'finished')
+    done = time.perf_counter()
+    with open(os.path.join(directory, 'changes.jsonl'), encoding='utf-8') as f:
+        changes = sum(1 for _ in f)
+
+    def load_index():
+        index = BookStateIndex()
+        index.load(previous_path)
+        return index
+
+    return changes, done - start, loaded - start, (done - loaded) / len(items), state_memory(load_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=200000, help='number of books per run')
+    parser.add_argument('--changed', type=float, default=0.01, help='fraction of books that change')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    previous, current = make_rows(args.books, args.changed)
+    with tempfile.TemporaryDirectory() as directory:
+        previous_path = os.path.join(directory, 'previous.jsonl')
+        current_path = os.path.join(directory, 'current.jsonl')
+        write_jsonlines(previous_path, previous)
+        write_jsonlines(current_path, current)
+        export_bytes = os.path.getsize(current_path)
+
+        diff_changes, diff_seconds, diff_memory = diff_exports(previous_path, current_path)
+        changes, seconds, load_seconds, per_item, memory = alert_pipeline(previous_path, current, directory)
+        stream_bytes = os.path.getsize(os.path.join(directory, 'changes.jsonl'))
+
+    results = {
+        'books': args.books,
+        'export_mb': round(export_bytes / 1e6, 2),
+        'full_export_diff': {'changes': diff_changes, 'seconds': round(diff_seconds, 3),
+                             'state_mb': round(diff_memory / 1e6, 1)},
+        'change_alert_pipeline': {'changes': changes, 'seconds': round(seconds, 3),
+                                  'baseline_load_seconds': round(load_seconds, 3),
+                                  'process_item_us': round(per_item * 1e6, 2),
+                                  'state_mb': round(memory / 1e6, 1),
+                                  'stream_mb': round(stream_bytes / 1e6, 3)},
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('%d books, %.1f MB per export' % (args.books, results['export_mb']))
+    diff = results['full_export_diff']
+    print('full export diff:       %6d changes  %7.3fs  %7.1f MB state' % (
+        diff['changes'], diff['seconds'], diff['state_mb']))
+    alert = results['change_alert_pipeline']
+    print('ChangeAlertPipeline:    %6d changes  %7.3fs  %7.1f MB state  (baseline %.3fs, %.2f us/item, '
+          'stream %.3f MB)' % (alert['changes'], alert['seconds'], alert['state_mb'], alert['baseline_load_seconds'],
+                               alert['process_item_us'], alert['stream_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+'''
+End-to-end crawl throughput of the spiders, pipelines and feed formats.
+
+A local CatalogueServer (benchmarks/server.py) serves a synthetic catalogue of
+--books books, and every scenario crawls it in a fresh Python process. The
+results are written as JSON so runs can be compared over time:
+
+    python -m benchmarks.bench_crawl --books 10000 --output bench_crawl.json
+    python -m benchmarks.bench_crawl --only books_items,feed_csv
+
+Every result holds pages/sec, items/sec, the peak RSS of the crawl process and
+the time spent in each stage (startup, first response, crawl, shutdown).
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+START = time.perf_counter()
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NO_PIPELINES = {'ITEM_PIPELINES': {}}
+
+
+def scenarios():
+    # name -> (spider, settings)
+    return {
+        'books': ('books', NO_PIPELINES),
+        'books_xpath': ('books_xpath', NO_PIPELINES),
+        'books_items': ('books_items', NO_PIPELINES),
+        'books_items_fast': ('books_items', dict(NO_PIPELINES, EBOOK_ITEM_FAST_PATH=True)),
+        'books_items_fanout': ('books_items', dict(NO_PIPELINES, EBOOK_PAGINATION='fanout')),
+        'books_items_processes': ('books_items', dict(NO_PIPELINES, EBOOK_PAGINATION='fanout',
+                                                      EBOOK_PARSE_PROCESSES=os.cpu_count())),
+        'books_items_enrich': ('books_items', dict(NO_PIPELINES, EBOOK_ENRICH_DETAILS=True,
+                                                   DUPEFILTER_CLASS='ebook_scraper.dupefilters.BloomDupeFilter',
+                                                   JOBDIR='job')),
+        'pipeline_excel': ('books_items', {
+            'ITEM_PIPELINES': {'ebook_scraper.pipelines.ExcelAppendPipeline': 300},
+        }),
+        'pipeline_excel_threaded': ('books_items', {
+            'ITEM_PIPELINES': {'ebook_scraper.pipelines.ThreadedExcelAppendPipeline': 300},
+        }),
+        'pipeline_parquet': ('books_items', {
+            'ITEM_PIPELINES': {'ebook_scraper.pipelines.ColumnarExportPipeline': 310},
+            'COLUMNAR_FILE': 'ebooks.parquet',
+        }),
+        'export_single_pass': ('books_items', {
+            'ITEM_PIPELINES': {'ebook_scraper.pipelines.MultiFormatExportPipeline': 330},
+            'EXPORT_OUTPUTS': {'ebooks.json': {'format': 'json'}, 'ebooks.csv': {'format': 'csv'},
+                               'ebooks.xml': {'format': 'xml'}, 'ebooks.xlsx': {'format': 'xlsx'}},
+        }),
+        'feed_json': ('books_items', dict(NO_PIPELINES, FEEDS={'ebooks.json': {'format': 'json'}})),
+        'feed_jsonlines': ('books_items', dict(NO_PIPELINES, FEEDS={'ebooks.jsonl': {'format': 'jsonlines'}})),
+        'feed_csv': ('books_items', dict(NO_PIPELINES, FEEDS={'ebooks.csv': {'format': 'csv'}})),
+        'feed_xml': ('books_items', dict(NO_PIPELINES, FEEDS={'ebooks.xml': {'format': 'xml'}})),
+    }
+
+
+def spider_arguments(spider, base_url, books):
+    # Point the spiders at the local server instead of books.toscrape.com
+    from benchmarks.catalogue import page_count
+
+    if spider == 'books_items':
+        return {'start_url': base_url + 'catalogue/page-1.html'}
+    # books and books_xpath do not paginate, so they get every page as a start URL
+    return {'start_urls': [base_url + 'catalogue/page-%d.html' % page
+                           for page in range(1, page_count(books) + 1)]}
+
+
+def run_worker(scenario):
+    '''
+    Runs one crawl in this process and prints its measurements as JSON.
+    '''
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    settings.set('LOG_LEVEL', 'WARNING')
+    settings.setdict(scenario['settings'], priority='cmdline')
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(scenario['spider'])
+
+    marks = {}
+
+    def first(name):
+        return lambda **kwargs: marks.setdefault(name, time.perf_counter())
+
+    def last(name):
+        return lambda **kwargs: marks.__setitem__(name, time.perf_counter())
+
+    # Signal receivers are weakly referenced, so keep the handlers alive here
+    handlers = [
+        (first('opened'), signals.spider_opened),
+        (first('first_response'), signals.response_received),
+        (first('first_item'), signals.item_scraped),
+        (last('idle'), signals.spider_idle),
+        (last('closed'), signals.spider_closed),
+    ]
+    for handler, signal in handlers:
+        crawler.signals.connect(handler, signal=signal)
+
+    process.crawl(crawler, **spider_arguments(scenario['spider'], scenario['base_url'], scenario['books']))
+    process.start()
+
+    stats = crawler.stats.get_stats()
+    crawl_seconds = marks['idle'] - marks['opened']
+    pages = stats.get('response_received_count', 0)
+    items = stats.get('item_scraped_count', 0)
+    print(json.dumps({
+        'pages': pages,
+        'items': items,
+        'pages_per_sec': round(pages / crawl_seconds, 2),
+        'items_per_sec': round(items / crawl_seconds, 2),
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'stages': {
+            'startup': round(marks['opened'] - START, 4),
+            'first_response': round(marks.get('first_response', marks['opened']) - marks['opened'], 4),
+            'first_item': round(marks.get('first_item', marks['opened']) - marks['opened'], 4),
+            'crawl': round(crawl_seconds, 4),
+            'shutdown': round(marks['closed'] - marks['idle'], 4),
+        },
+        'errors': stats.get('log_count/ERROR', 0),
+        # Extra stats a caller asked for, e.g. ['adaptive_throttle/']
+        'stats': {key: value for key, value in stats.items()
+                  if key.startswith(tuple(scenario.get('stats', ())))},
+    }, default=str))
+
+
+def run_scenario(name, spider, settings, base_url, books, stats=()):
+    scenario = {'spider': spider, 'settings': settings, 'base_url': base_url, 'books': books,
+                'stats': list(stats)}
+    environment = dict(os.environ,
+                       PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_DIR, os.environ.get('PYTHONPATH')])),
+                       SCRAPY_SETTINGS_MODULE='ebook_scraper.settings')
+    # Each crawl runs in its own directory so its output files do not pile up
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_crawl', '--worker', json.dumps(scenario)],
+            cwd=directory, env=environment, capture_output=True, text=True,
+        )
+        wall = time.perf_counter() - started
+        output_bytes = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+
+    if completed.returncode != 0 or not completed.stdout.strip():
+        return {'name': name, 'spider': spider, 'error': completed.stderr.strip().splitlines()[-1:]}
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result.update(name=name, spider=spider, wall_seconds=round(wall, 4), output_bytes=output_bytes)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=1000, help='size of the synthetic catalogue')
+    parser.add_argument('--latency', type=float, default=0.0, help='server latency per page in seconds')
+    parser.add_argument('--only', help='comma separated scenario names (default: all)')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(json.loads(args.worker))
+        return
+
+    from benchmarks.server import CatalogueServer
+    import scrapy
+
+    selected = scenarios()
+    if args.only:
+        selected = {name: selected[name] for name in args.only.split(',')}
+
+    server = CatalogueServer(books=args.books, latency=args.latency).start()
+    results = []
+    for name, (spider, settings) in selected.items():
+        result = run_scenario(name, spider, settings, server.base_url, args.books)
+        print('%-20s %s' % (name, json.dumps(result)), file=sys.stderr)
+        results.append(result)
+    server.shutdown()
+
+    report = json.dumps({
+        'meta': {
+            'books': args.books,
+            'latency': args.latency,
+            'python': platform.python_version(),
+            'scrapy': scrapy.__version__,
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'results': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+'''
+Cost of the layout drift checks on healthy pages, and what they recover on drifted ones.
+
+"primary only" is the card walk of extractors.extract_book() without any
+check, "checked" is extract_books() as the spiders run it: every record is
+validated and the fallback chains run only for cards that failed. Both work on
+an lxml tree that is already built, which leaves out the parsing every
+callback pays for anyway, so the overhead is shown at its largest. The two are
+a few percent apart at most, less than timings of a shared machine wander, so
+the overhead is computed from what is added on their own: card_is_valid() for
+the 20 records of a page and DriftMiddleware.process_spider_output() around
+them, as a share of the extraction alone and of parsing plus extraction.
+
+The drifted pages are the same catalogue page with one change to the markup
+each; their rows show how many of the books came out the same as from the
+healthy page and what the drift counters say.
+
+    python -m benchmarks.bench_drift --rounds 2000
+'''
+import argparse
+import json
+import re
+import time
+
+import lxml.html
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from benchmarks.catalogue import render_page
+from ebook_scraper.extractors import PRODUCT_PODS, card_is_valid, extract_book, extract_books
+from ebook_scraper.resilience import DriftMiddleware
+
+DRIFTS = {
+    'rating class renamed': lambda html: html.replace('class="star-rating ', 'class="rating rating-'),
+    'rating in data attribute': lambda html: re.sub(r'class="star-rating (\w+)"',
+                                                    r'class="star-rating" data-rating="\1"', html),
+    'price class renamed': lambda html: html.replace('class="price_color"', 'class="price-now"'),
+    'title attribute dropped': lambda html: re.sub(r'<a ([^>]*) title="[^"]*"', r'<a \1', html),
+    'price text unreadable': lambda html: re.sub(r'price_color">[^<]*', 'price_color">N/A', html),
+}
+
+
+def primary_only(root):
+    return [extract_book(card) for card in PRODUCT_PODS(root)]
+
+
+def checked(root):
+    return extract_books(root, drift={})
+
+
+def time_per_page(extract, root, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        extract(root)
+    return (time.perf_counter() - start) / rounds
+
+
+def checks_per_page(books, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for book in books:
+            card_is_valid(book)
+    return (time.perf_counter() - start) / rounds
+
+
+def middleware_per_page(items, rounds):
+    # process_spider_output() around a callback's 20 items, on a page without drift
+    middleware = DriftMiddleware.from_crawler(get_crawler())
+    url = 'https://books.toscrape.com/catalogue/page-1.html'
+    response = HtmlResponse(url=url, body=b'', request=Request(url))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _ in middleware.process_spider_output(response, iter(items), None):
+            pass
+    wrapped = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _ in iter(items):
+            pass
+    return (wrapped - (time.perf_counter() - start)) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=2000, help='pages extracted per variant')
+    parser.add_argument('--repeats', type=int, default=7, help='timed runs per variant, the fastest counts')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    html = render_page(1)
+    root = lxml.html.fromstring(html)
+    healthy = primary_only(root)
+    # On a healthy page the checks must not change a single record
+    assert checked(root) == healthy
+
+    # Best of --repeats, taken in turns, so a stray pause or a slower stretch of
+    # the machine does not decide the overhead
+    primary = validated = checks = middleware = parse = float('inf')
+    for _ in range(args.repeats):
+        parse = min(parse, time_per_page(lxml.html.fromstring, html, args.rounds))
+        primary = min(primary, time_per_page(primary_only, root, args.rounds))
+        validated = min(validated, time_per_page(checked, root, args.rounds))
+        checks = min(checks, checks_per_page(healthy, args.rounds))
+        middleware = min(middleware, middleware_per_page(healthy, args.rounds))
+    results = {
+        'rounds': args.rounds,
+        'healthy': {
+            'primary_only_us': round(primary * 1e6, 2),
+            'checked_us': round(validated * 1e6, 2),
+            'checks_us': round(checks * 1e6, 2),
+            'middleware_us': round(middleware * 1e6, 2),
+            'overhead_percent': round((checks + middleware) / primary * 100, 2),
+            'parse_us': round(parse * 1e6, 2),
+            'overhead_with_parse_percent': round((checks + middleware) / (parse + primary) * 100, 2),
+        },
+        'drifted': [],
+    }
+    for name, change in DRIFTS.items():
+        drifted_root = lxml.html.fromstring(change(html))
+        drift = {}
+        books = extract_books(drifted_root, drift=drift)
+        unpatched = primary_only(drifted_root)
+        results['drifted'].append({
+            'drift': name,
+            'books_correct_primary_only': sum(book == good for book, good in zip(unpatched, healthy)),
+            'books_correct_checked': sum(book == good for book, good in zip(books, healthy)),
+            'books': len(healthy),
+            'counters': drift,
+            'checked_us': round(time_per_page(checked, drifted_root, args.rounds // 10 or 1) * 1e6, 2),
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    row = results['healthy']
+    print('healthy page: primary only %.1f us, checked %.1f us' % (row['primary_only_us'], row['checked_us']))
+    print('    card_is_valid() %.2f us + DriftMiddleware %.2f us = %.2f%% of the primary extraction, '
+          '%.2f%% with parsing the page (%.1f us)' % (row['checks_us'], row['middleware_us'], row['overhead_percent'],
+                                                     row['overhead_with_parse_percent'], row['parse_us']))
+    print('%-26s %14s %10s %10s  %s' % ('drifted page', 'primary only', 'checked', 'us/page', 'counters'))
+    for row in results['drifted']:
+        print('%-26s %11d/%d %7d/%d %10.1f  %s' % (
+            row['drift'], row['books_correct_primary_only'], row['books'], row['books_correct_checked'],
+            row['books'], row['checked_us'], json.dumps(row['counters'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+'''
+One MultiFormatExportPipeline pass against separate exporters per format.
+
+The separate path is what a run with FEEDS for json, csv and xml plus the
+ExcelAppendPipeline does: every exporter reads and serializes each item on its
+own. The single pass reads each item once into a tuple and formats that for
+all four outputs, optionally compressing the text outputs.
+
+    python -m benchmarks.bench_exports --items 200000
+'''
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from scrapy.exporters import CsvItemExporter, JsonItemExporter, XmlItemExporter
+
+from benchmarks.catalogue import book
+from ebook_scraper.exports import zstandard
+from ebook_scraper.items import EbookItem
+from ebook_scraper.pipelines import ExcelAppendPipeline, MultiFormatExportPipeline
+
+FORMATS = {'ebooks.json': 'json', 'ebooks.csv': 'csv', 'ebooks.xml': 'xml', 'ebooks.xlsx': 'xlsx'}
+
+
+class CountingItem(EbookItem):
+    # Counts every field read, to show how often each item is looked at
+    reads = 0
+
+    # get() and the exporters' ItemAdapter all end up here
+    def __getitem__(self, key):
+        CountingItem.reads += 1
+        return super().__getitem__(key)
+
+
+def make_items(count, item_class=EbookItem):
+    items = []
+    for number in range(1, count + 1):
+        values = book(number)
+        items.append(item_class(
+            title=values['title'],
+            rating=values['rating'],
+            price=round(values['price'], 2),
+            stock_status='In stock' if values['in_stock'] else 'Not In Stock',
+        ))
+    return items
+
+
+def write_separately(directory, items):
+    exporters = []
+    files = []
+    for name, exporter_class in (('ebooks.json', JsonItemExporter), ('ebooks.csv', CsvItemExporter),
+                                 ('ebooks.xml', XmlItemExporter)):
+        f = open(os.path.join(directory, name), 'wb')
+        exporter = exporter_class(f)
+        exporter.start_exporting()
+        exporters.append(exporter)
+        files.append(f)
+    excel = ExcelAppendPipeline(file_name=os.path.join(directory, 'ebooks.xlsx'), part_rows=len(items) + 1)
+    excel.open_spider(None)
+
+    for item in items:
+        for exporter in exporters:
+            exporter.export_item(item)
+        excel.process_item(item, None)
+
+    for exporter, f in zip(exporters, files):
+        exporter.finish_exporting()
+        f.close()
+    excel.close_spider(None)
+
+
+def write_single_pass(directory, items, compression=None):
+    outputs = {}
+    for name, file_format in FORMATS.items():
+        options = {'format': file_format}
+        if compression and file_format != 'xlsx':
+            name += '.gz' if compression == 'gzip' else '.zst'
+            options['compression'] = compression
+        outputs[os.path.join(directory, name)] = options
+    pipeline = MultiFormatExportPipeline(outputs)
+    pipeline.open_spider(None)
+    for item in items:
+        pipeline.process_item(item, None)
+    pipeline.close_spider(None)
+
+
+def measure(write, items):
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        write(directory, items)
+        seconds = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    return seconds, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=200000, help='number of items to write')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    runs = [
+        ('separate exporters', write_separately),
+        ('single pass', write_single_pass),
+        ('single pass gzip', lambda directory, items: write_single_pass(directory, items, 'gzip')),
+    ]
+    if zstandard is not None:
+        runs.append(('single pass zstd', lambda directory, items: write_single_pass(directory, items, 'zstd')))
+
+    items = make_items(args.items)
+    counted = make_items(1000, CountingItem)
+    results = []
+    for name, write in runs:
+        seconds, size = measure(write, items)
+        CountingItem.reads = 0
+        measure(write, counted)
+        results.append({'run': name, 'items': args.items, 'seconds': round(seconds, 3),
+                        'items_per_sec': round(args.items / seconds), 'bytes': size,
+                        'field_reads_per_item': CountingItem.reads / len(counted)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('%-20s %10s %12s %14s %12s' % ('run', 'seconds', 'items/sec', 'bytes', 'reads/item'))
+    for row in results:
+        print('%-20s %10.3f %12d %14d %12.1f' % (row['run'], row['seconds'], row['items_per_sec'],
+                                                row['bytes'], row['field_reads_per_item']))
+
+
+if __name__ == '__main__':
+    main()
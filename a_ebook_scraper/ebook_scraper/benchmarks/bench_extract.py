@@ -0,0 +1,84 @@
+'''
+Per-page parse time of the per-field selectors vs. the shared extractor.
+
+A third variant is the books_xpath spider, which keeps one XPath expression
+per field but compiles them once. All variants get a fresh HtmlResponse for every round, so the time includes
+building the lxml tree, just like a real callback.
+
+    python -m benchmarks.bench_extract --rounds 500
+'''
+import argparse
+import json
+import time
+
+from scrapy.http import HtmlResponse, Request
+
+from benchmarks.catalogue import render_page
+from ebook_scraper.extractors import extract_books_from_response
+from ebook_scraper.spiders.books_spider_xpath import BookSpider as XPathSpider
+
+
+def per_field_selectors(response):
+    # The loop the spiders used before ebook_scraper.extractors existed
+    books = []
+    for ebook in response.css('article.product_pod'):
+        title = ebook.css('h3>a::attr(title)').get()
+        rating = ebook.css('p.star-rating::attr(class)').get().split(' ')[1]
+        price = ebook.css('div.product_price>p.price_color::text').get()
+        check_stock = ebook.css('p.instock.availability>i::attr(class)').get()
+        if check_stock != "icon-ok":
+            stock_status = "Not In Stock"
+        else:
+            stock_status = ''.join(ebook.css('p.instock.availability::text').getall()).strip()
+        books.append({'title': title, 'rating': rating, 'price': price, 'stock_status': stock_status})
+    return books
+
+
+def compiled_xpath(response, spider=XPathSpider()):
+    # books_xpath's callback, without the url it adds to every book
+    return [dict(book, url=None) for book in spider.parse(response)]
+
+
+def time_per_page(extract, body, url, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        extract(HtmlResponse(url=url, body=body, encoding='utf-8', request=Request(url)))
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=500, help='pages parsed per variant')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    url = 'https://books.toscrape.com/catalogue/page-1.html'
+    body = render_page(1).encode('utf-8')
+
+    # The variants have to agree before their speed means anything
+    response = HtmlResponse(url=url, body=body, encoding='utf-8', request=Request(url))
+    assert per_field_selectors(response) == extract_books_from_response(response)
+    assert compiled_xpath(response) == [dict(book, url=None) for book in per_field_selectors(response)]
+
+    selectors = time_per_page(per_field_selectors, body, url, args.rounds)
+    extractor = time_per_page(extract_books_from_response, body, url, args.rounds)
+    xpath = time_per_page(compiled_xpath, body, url, args.rounds)
+    results = {
+        'rounds': args.rounds,
+        'per_field_selectors_ms': round(selectors * 1000, 3),
+        'extractor_ms': round(extractor * 1000, 3),
+        'compiled_xpath_ms': round(xpath * 1000, 3),
+        'speedup': round(selectors / extractor, 2),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('per-field selectors: %.3f ms/page' % results['per_field_selectors_ms'])
+    print('shared extractor:    %.3f ms/page' % results['extractor_ms'])
+    print('compiled XPath:      %.3f ms/page' % results['compiled_xpath_ms'])
+    print('speedup:             %.2fx' % results['speedup'])
+
+
+if __name__ == '__main__':
+    main()
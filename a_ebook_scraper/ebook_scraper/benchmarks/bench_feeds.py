@@ -0,0 +1,104 @@
+'''
+Compares write time and file size of the output formats we produce.
+
+--items distinct books of the synthetic catalogue (benchmarks/catalogue.py),
+shaped like the items in ebooks_using_items.json, are written through Scrapy's JSON/CSV/XML feed exporters, the
+ExcelAppendPipeline and the ColumnarExportPipeline (Parquet and Arrow IPC).
+
+    python -m benchmarks.bench_feeds --items 100000
+'''
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from scrapy.exporters import CsvItemExporter, JsonItemExporter, XmlItemExporter
+
+from benchmarks.catalogue import book
+from ebook_scraper.pipelines import HAS_PYARROW, ColumnarExportPipeline, ExcelAppendPipeline
+
+
+def load_items(count):
+    # Distinct rows: repeating a small sample mostly measures how well each
+    # format compresses repeated values
+    items = []
+    for number in range(1, count + 1):
+        values = book(number)
+        items.append({
+            'title': values['title'],
+            'rating': values['rating'],
+            'price': round(values['price'], 2),
+            'stock_status': 'In stock' if values['in_stock'] else 'Not In Stock',
+        })
+    return items
+
+
+def write_feed(exporter_class, path, items):
+    with open(path, 'wb') as f:
+        exporter = exporter_class(f)
+        exporter.start_exporting()
+        for item in items:
+            exporter.export_item(item)
+        exporter.finish_exporting()
+    return [path]
+
+
+def write_pipeline(pipeline, items):
+    pipeline.open_spider(None)
+    for item in items:
+        pipeline.process_item(item, None)
+    pipeline.close_spider(None)
+
+
+def write_excel(path, items):
+    pipeline = ExcelAppendPipeline(file_name=path, part_rows=len(items) + 1)
+    write_pipeline(pipeline, items)
+    return [pipeline.part_path(pipeline.part_number)]
+
+
+def write_columnar(path, items):
+    write_pipeline(ColumnarExportPipeline(file_name=path), items)
+    return [path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=100000, help='number of items to write')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    items = load_items(args.items)
+    writers = [
+        ('json', lambda path: write_feed(JsonItemExporter, path, items), 'ebooks.json'),
+        ('csv', lambda path: write_feed(CsvItemExporter, path, items), 'ebooks.csv'),
+        ('xml', lambda path: write_feed(XmlItemExporter, path, items), 'ebooks.xml'),
+        ('xlsx', lambda path: write_excel(path, items), 'ebooks.xlsx'),
+    ]
+    if HAS_PYARROW:
+        writers += [
+            ('parquet', lambda path: write_columnar(path, items), 'ebooks.parquet'),
+            ('arrow', lambda path: write_columnar(path, items), 'ebooks.arrow'),
+        ]
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, write, file_name in writers:
+            start = time.perf_counter()
+            paths = write(os.path.join(directory, file_name))
+            seconds = time.perf_counter() - start
+            size = sum(os.path.getsize(path) for path in paths)
+            results.append({'format': name, 'items': len(items),
+                            'seconds': round(seconds, 4), 'bytes': size})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('%-8s %10s %12s %14s' % ('format', 'seconds', 'items/sec', 'bytes'))
+    for row in results:
+        print('%-8s %10.3f %12.0f %14d' % (row['format'], row['seconds'],
+                                           row['items'] / row['seconds'], row['bytes']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''
+Items/sec of the ItemLoader path vs. the EbookRecord fast path.
+
+Both variants start from the raw records returned by the shared extractor,
+so only the item building and cleaning is measured.
+
+    python -m benchmarks.bench_items --items 200000
+'''
+import argparse
+import itertools
+import json
+import time
+
+from itemadapter import ItemAdapter
+
+from benchmarks.catalogue import render_page
+from ebook_scraper.extractors import extract_books_from_html
+from ebook_scraper.items import normalize_book
+from ebook_scraper.spiders.books_spider_items import BookSpider
+
+
+def items_per_second(make_item, records):
+    start = time.perf_counter()
+    for record in records:
+        make_item(record)
+    return len(records) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=200000, help='number of items to build')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    sample = extract_books_from_html(render_page(1), links=True)
+    records = list(itertools.islice(itertools.cycle(sample), args.items))
+    spider = BookSpider()
+
+    # The fast path has to produce exactly what the loader produces
+    for record in sample:
+        assert ItemAdapter(spider.load_item(record)).asdict() == ItemAdapter(normalize_book(record)).asdict()
+
+    loader = items_per_second(spider.load_item, records)
+    fast = items_per_second(normalize_book, records)
+    results = {
+        'items': len(records),
+        'item_loader_items_per_sec': round(loader),
+        'fast_path_items_per_sec': round(fast),
+        'speedup': round(fast / loader, 2),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('ItemLoader: %10.0f items/sec' % loader)
+    print('fast path:  %10.0f items/sec' % fast)
+    print('speedup:    %10.2fx' % results['speedup'])
+
+
+if __name__ == '__main__':
+    main()
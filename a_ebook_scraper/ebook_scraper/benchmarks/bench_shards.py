@@ -0,0 +1,83 @@
+'''
+Throughput of `scrapy shard` with 1, 2, 4, ... worker processes.
+
+Every worker is held to --concurrency requests at a time, the way a polite
+crawl is held to a few requests per worker (or per IP), and the server waits
+--latency seconds per page. What more workers gain depends on how much of that
+wait they can overlap and on how many CPUs the machine has for their parsing:
+with more workers than CPUs they share the same cores, so the speedups of such
+a run say nothing about how the crawl scales. The CPU count is printed with
+the results. The time includes starting the workers and merging their shards
+into one JSON lines file, and every run must merge exactly one item per book.
+
+    python -m benchmarks.bench_shards --books 10000 --workers 1,2,4
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_crawl import PROJECT_DIR
+from benchmarks.catalogue import page_count
+from benchmarks.server import CatalogueServer
+
+
+def run(workers, server, books, concurrency, enrich):
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'ebooks.jsonl')
+        command = [sys.executable, '-m', 'scrapy', 'shard', 'books_items', '-w', str(workers),
+                   '-o', output, '--dir', os.path.join(directory, 'shards'),
+                   '-a', 'start_url=%scatalogue/page-1.html' % server.base_url,
+                   '-s', 'ITEM_PIPELINES={}', '-s', 'LOG_LEVEL=WARNING',
+                   '-s', 'CONCURRENT_REQUESTS=%d' % concurrency,
+                   '-s', 'EBOOK_SHARD_CLAIM_SIZE=%d' % (2 * concurrency),
+                   '-s', 'EBOOK_ENRICH_DETAILS=%s' % enrich]
+        started = time.perf_counter()
+        completed = subprocess.run(command, cwd=PROJECT_DIR, capture_output=True, text=True)
+        seconds = time.perf_counter() - started
+        if completed.returncode != 0:
+            return {'workers': workers, 'error': completed.stdout.strip().splitlines()[-1:]}
+        with open(output, encoding='utf-8') as f:
+            items = sum(1 for _ in f)
+
+    pages = page_count(books) + (books if enrich else 0)
+    return {'workers': workers, 'seconds': round(seconds, 2), 'items': items,
+            'pages_per_sec': round(pages / seconds, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=10000, help='size of the synthetic catalogue')
+    parser.add_argument('--latency', type=float, default=0.1, help='server time per page in seconds')
+    parser.add_argument('--workers', default='1,2,4', help='comma separated worker counts')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight per worker')
+    parser.add_argument('--enrich', action='store_true', help='also fetch every detail page')
+    args = parser.parse_args()
+
+    server = CatalogueServer(books=args.books, latency=args.latency).start()
+    results = []
+    for workers in (int(value) for value in args.workers.split(',')):
+        result = run(workers, server, args.books, args.concurrency, args.enrich)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+    server.shutdown()
+
+    base = results[0].get('pages_per_sec')
+    print('%d CPUs, %d books' % (os.cpu_count(), args.books))
+    print('%-8s %10s %12s %8s %8s' % ('workers', 'seconds', 'pages/sec', 'speedup', 'items'))
+    for row in results:
+        if 'error' in row:
+            print('%-8d %s' % (row['workers'], row['error']))
+            continue
+        print('%-8d %10.2f %12.1f %7.2fx %8d' % (row['workers'], row['seconds'], row['pages_per_sec'],
+                                                 row['pages_per_sec'] / base, row['items']))
+    # A lost or doubled book is a bug in the queue or the merge, not a slow run
+    if any(row.get('items') != args.books for row in results):
+        sys.exit('Not every run merged exactly %d items' % args.books)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+Sustained write throughput of the SQLitePipeline against ExcelAppendPipeline.
+
+The items simulate repeated crawls of a catalogue of --books books: every
+round scrapes all of them again, and a few percent of them change their price
+between rounds. Throughput is reported for every --window items, so a
+slowdown as the database grows shows up instead of averaging out.
+
+    python -m benchmarks.bench_sqlite --items 1000000 --books 100000
+'''
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.catalogue import book
+from ebook_scraper.pipelines import ExcelAppendPipeline, SQLitePipeline
+
+
+def build_catalogue(books):
+    catalogue = []
+    for number in range(1, books + 1):
+        values = book(number)
+        catalogue.append({
+            'title': values['title'],
+            'rating': values['rating'],
+            'price': round(values['price'], 2),
+            'stock_status': 'In stock' if values['in_stock'] else 'Not In Stock',
+        })
+    return catalogue
+
+
+def generate_items(count, catalogue, change_rate):
+    # The same books over and over, like daily crawls of the same catalogue
+    catalogue = list(catalogue)
+    books = len(catalogue)
+    rng = random.Random(0)
+    for index in range(count):
+        item = catalogue[index % books]
+        if index >= books and rng.random() < change_rate:
+            item = catalogue[index % books] = dict(item, price=round(item['price'] * rng.uniform(0.8, 1.2), 2))
+        yield item
+
+
+def run(pipeline, items, window):
+    # Feeds the items through the pipeline and times every window of them
+    windows = []
+    start = time.perf_counter()
+    pipeline.open_spider(None)
+    window_start = start
+    for count, item in enumerate(items, 1):
+        pipeline.process_item(item, None)
+        if count % window == 0:
+            now = time.perf_counter()
+            windows.append(round(window / (now - window_start)))
+            window_start = now
+    pipeline.close_spider(None)
+    seconds = time.perf_counter() - start
+    return seconds, windows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=1000000, help='number of items to write')
+    parser.add_argument('--books', type=int, default=100000, help='number of distinct books')
+    parser.add_argument('--change-rate', type=float, default=0.05, help='share of books changing per round')
+    parser.add_argument('--batch-size', type=int, default=1000, help='SQLITE_BATCH_SIZE')
+    parser.add_argument('--window', type=int, default=100000, help='items per throughput sample')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        # Built up front, so the timings only include the sinks
+        catalogue = build_catalogue(args.books)
+        items = lambda: generate_items(args.items, catalogue, args.change_rate)
+
+        path = os.path.join(directory, 'ebooks.sqlite')
+        seconds, windows = run(SQLitePipeline(file_name=path, batch_size=args.batch_size), items(), args.window)
+        with sqlite3.connect(path) as connection:
+            books = connection.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+            history = connection.execute('SELECT COUNT(*) FROM price_history').fetchone()[0]
+        size = sum(os.path.getsize(os.path.join(directory, f))
+                   for f in os.listdir(directory) if f.startswith('ebooks.sqlite'))
+        results.append({'sink': 'sqlite', 'items': args.items, 'seconds': round(seconds, 3),
+                        'items_per_sec': round(args.items / seconds), 'window_items_per_sec': windows,
+                        'bytes': size, 'books': books, 'history_rows': history})
+
+        excel = ExcelAppendPipeline(file_name=os.path.join(directory, 'scraped_data.xlsx'))
+        seconds, windows = run(excel, items(), args.window)
+        size = sum(os.path.getsize(excel.part_path(number)) for number in range(1, excel.part_number + 1))
+        results.append({'sink': 'xlsx', 'items': args.items, 'seconds': round(seconds, 3),
+                         'items_per_sec': round(args.items / seconds), 'window_items_per_sec': windows,
+                         'bytes': size, 'parts': excel.part_number})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('%-8s %10s %12s %14s  %s' % ('sink', 'seconds', 'items/sec', 'bytes', 'items/sec per window'))
+    for row in results:
+        print('%-8s %10.3f %12d %14d  %s' % (row['sink'], row['seconds'], row['items_per_sec'],
+                                             row['bytes'], ' '.join(map(str, row['window_items_per_sec']))))
+    print('sqlite: %(books)d books, %(history_rows)d history rows' % results[0])
+
+
+if __name__ == '__main__':
+    main()
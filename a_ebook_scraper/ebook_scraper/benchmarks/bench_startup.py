@@ -0,0 +1,173 @@
+'''
+Time to first request and import time per module of a short `scrapy crawl`.
+
+Every run starts `python -X importtime -m scrapy crawl <spider>` in a fresh
+process, the way cron does, against a local CatalogueServer. The
+FirstRequestProbe extension notes when the first request (robots.txt with
+ROBOTSTXT_OBEY) reaches the downloader and closes the spider right away, so
+only the startup is measured: interpreter, imports, settings, reactor, spider
+loader, middlewares and pipelines. The runs are repeated with Scrapy's own
+SpiderLoader (every spider module imported), with settings.py as it is
+(LazySpiderLoader) and with the lean settings for scheduled crawls.
+
+    python -m benchmarks.bench_startup --spider books --runs 5 --budget 1.5
+
+With --budget the command exits with status 1 when the median time to first
+request of the configured settings goes over it (in seconds), so it can run in
+CI; --import-budget does the same for the import time of ebook_scraper itself.
+'''
+import json
+import time
+
+from scrapy import signals
+
+LEAN_MIDDLEWARES = {'scrapy.downloadermiddlewares.cookies.CookiesMiddleware': None}
+LEAN_EXTENSIONS = {'scrapy.extensions.telnet.TelnetConsole': None}
+
+
+class FirstRequestProbe:
+    # Enabled by the benchmark through EXTENSIONS, in the crawl process
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        probe = cls(crawler)
+        crawler.signals.connect(probe.request_reached_downloader, signal=signals.request_reached_downloader)
+        return probe
+
+    def request_reached_downloader(self, request, spider):
+        if self.crawler.stats.get_value('startup/first_request') is None:
+            self.crawler.stats.set_value('startup/first_request', time.time())
+            print(json.dumps({'first_request': time.time()}), flush=True)
+            self.crawler.engine.close_spider(spider, 'startup_measured')
+
+
+def parse_importtime(stderr):
+    '''
+    Cumulative import seconds per module from the output of python -X importtime.
+
+    Returns {module: seconds} for the top-level imports (the ones nothing else
+    imported first), which add up to the total import time.
+    '''
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented below the module that imported them
+        if not name.startswith('  '):
+            name = name.strip()
+            modules[name] = modules.get(name, 0.0) + int(cumulative) / 1e6
+    return modules
+
+
+def run(spider, base_url, settings):
+    import os
+    import subprocess
+    import sys
+    import tempfile
+
+    from benchmarks.bench_crawl import PROJECT_DIR
+
+    settings = dict(settings)
+    extensions = dict(settings.pop('EXTENSIONS', {}), **{'benchmarks.bench_startup.FirstRequestProbe': 0})
+    command = [sys.executable, '-X', 'importtime', '-m', 'scrapy', 'crawl', spider,
+               '-s', 'LOG_LEVEL=WARNING', '-s', 'EXTENSIONS=%s' % json.dumps(extensions)]
+    if spider == 'books_items':
+        command += ['-a', 'start_url=%scatalogue/page-1.html' % base_url]
+    # books and books_xpath keep their start_urls: the probe closes the spider
+    # as soon as the first request is handed to the downloader, before any
+    # DNS lookup or connection
+    for name, value in settings.items():
+        command += ['-s', '%s=%s' % (name, json.dumps(value) if isinstance(value, dict) else value)]
+    environment = dict(os.environ,
+                       PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_DIR, os.environ.get('PYTHONPATH')])),
+                       SCRAPY_SETTINGS_MODULE='ebook_scraper.settings')
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.time()
+        completed = subprocess.run(command, cwd=directory, env=environment, capture_output=True, text=True)
+    lines = [line for line in completed.stdout.splitlines() if line.startswith('{')]
+    if not lines:
+        raise RuntimeError('No request reached the downloader:\n%s' % completed.stderr[-2000:])
+    return json.loads(lines[-1])['first_request'] - started, parse_importtime(completed.stderr)
+
+
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def main():
+    import argparse
+    import sys
+
+    from benchmarks.server import CatalogueServer
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--spider', default='books', help='spider to start (default: books)')
+    parser.add_argument('--runs', type=int, default=5, help='runs per configuration')
+    parser.add_argument('--top', type=int, default=12, help='number of modules to list')
+    parser.add_argument('--budget', type=float, help='maximum median seconds to first request')
+    parser.add_argument('--import-budget', type=float, help='maximum median seconds to import ebook_scraper modules')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    configurations = {
+        'SpiderLoader': {'SPIDER_LOADER_CLASS': 'scrapy.spiderloader.SpiderLoader'},
+        # The project as configured (LazySpiderLoader)
+        'settings.py': {},
+        # The cookies middleware pulls in tldextract and the telnet console
+        # twisted.conch, neither of which a short unattended crawl of this site
+        # needs. Only removing them (None) skips the import, a disabled
+        # component is still imported before it raises NotConfigured
+        'lean': {'DOWNLOADER_MIDDLEWARES': LEAN_MIDDLEWARES, 'EXTENSIONS': LEAN_EXTENSIONS},
+    }
+    server = CatalogueServer(books=1000).start()
+    results = []
+    for name, settings in configurations.items():
+        seconds, imports = [], []
+        for _ in range(args.runs):
+            first_request, modules = run(args.spider, server.base_url, settings)
+            seconds.append(first_request)
+            imports.append(modules)
+        # The module times of the median run
+        modules = imports[seconds.index(median(seconds))]
+        own = median([sum(value for module, value in run_modules.items() if module.startswith('ebook_scraper'))
+                      for run_modules in imports])
+        results.append({
+            'configuration': name,
+            'first_request_seconds': round(median(seconds), 4),
+            'import_seconds': round(sum(modules.values()), 4),
+            'ebook_scraper_import_seconds': round(own, 4),
+            'slowest_imports': {module: round(value, 4) for module, value in
+                                sorted(modules.items(), key=lambda item: -item[1])[:args.top]},
+        })
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for row in results:
+            print('%s: %.3fs to first request, %.3fs importing (ebook_scraper %.3fs)' % (
+                row['configuration'], row['first_request_seconds'], row['import_seconds'],
+                row['ebook_scraper_import_seconds']))
+            for module, value in row['slowest_imports'].items():
+                print('    %-48s %8.1f ms' % (module, value * 1000))
+
+    # The budgets apply to the project as configured in settings.py
+    configured = next(row for row in results if row['configuration'] == 'settings.py')
+    over = []
+    if args.budget is not None and configured['first_request_seconds'] > args.budget:
+        over.append('time to first request %.3fs > %.3fs' % (configured['first_request_seconds'], args.budget))
+    if args.import_budget is not None and configured['ebook_scraper_import_seconds'] > args.import_budget:
+        over.append('ebook_scraper imports %.3fs > %.3fs' % (configured['ebook_scraper_import_seconds'],
+                                                              args.import_budget))
+    if over:
+        print('Over budget: ' + '; '.join(over), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
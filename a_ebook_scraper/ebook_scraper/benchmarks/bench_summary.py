@@ -0,0 +1,124 @@
+'''
+Catalogue aggregates per item in Python vs. per batch with NumPy.
+
+The per-item variant is what a consumer of the plain spiders does today: it
+parses '£51.77' and 'Three' in process_item() and adds each book to Python
+counters. CatalogueSummaryPipeline only collects the raw values in
+process_item() and converts and aggregates whole columns. The time spent in
+process_item() is what the crawl itself waits for; close_spider() runs once
+at the end.
+
+    python -m benchmarks.bench_summary --items 1000000
+'''
+import argparse
+import collections
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.catalogue import book
+from ebook_scraper.items import normalize_book, price_to_float, rating_to_int
+from ebook_scraper.pipelines import CatalogueSummaryPipeline
+
+
+class PerItemSummary:
+    # The same aggregates, converted and counted one item at a time
+    def __init__(self, file_name, bins=10):
+        self.file_name = file_name
+        self.bins = bins
+
+    def open_spider(self, spider):
+        self.prices = []
+        self.ratings = collections.Counter()
+        self.price_sums = collections.Counter()
+        self.in_stock = 0
+        self.items = 0
+
+    def process_item(self, item, spider):
+        price = price_to_float(item.get('price'))
+        rating = rating_to_int(item.get('rating'))
+        self.prices.append(price)
+        self.ratings[rating] += 1
+        self.price_sums[rating] += price
+        self.in_stock += item.get('stock_status') == 'In stock'
+        self.items += 1
+        return item
+
+    def close_spider(self, spider):
+        low, high = min(self.prices), max(self.prices)
+        width = (high - low) / self.bins or 1.0
+        counts = [0] * self.bins
+        for price in self.prices:
+            counts[min(self.bins - 1, int((price - low) / width))] += 1
+        deciles = statistics.quantiles(self.prices, n=10)
+        summary = {
+            'items': self.items,
+            'price': {'min': low, 'max': high, 'mean': statistics.fmean(self.prices),
+                      'median': statistics.median(self.prices), 'p10': deciles[0], 'p90': deciles[-1],
+                      'histogram': counts},
+            'rating': dict(self.ratings),
+            'mean_price_by_rating': {rating: self.price_sums[rating] / count for rating, count in self.ratings.items()},
+            'in_stock_ratio': self.in_stock / self.items,
+        }
+        with open(self.file_name, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, default=str)
+
+
+def make_items(count, records):
+    items = []
+    for number in range(1, count + 1):
+        values = book(number)
+        raw = {
+            'title': values['title'],
+            'rating': values['rating'],
+            'price': '£%.2f' % values['price'],
+            'stock_status': 'In stock' if values['in_stock'] else 'Not In Stock',
+        }
+        # records: cleaned EbookRecords as books_items yields them, otherwise the
+        # raw strings of the books and books_xpath spiders
+        items.append(normalize_book(raw) if records else raw)
+    return items
+
+
+def measure(pipeline, items):
+    pipeline.open_spider(None)
+    start = time.perf_counter()
+    for item in items:
+        pipeline.process_item(item, None)
+    per_item = time.perf_counter() - start
+    start = time.perf_counter()
+    pipeline.close_spider(None)
+    return per_item, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=1000000, help='number of items')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'summary.json')
+        for shape, records in (('raw strings', False), ('EbookRecord', True)):
+            items = make_items(args.items, records)
+            for name, pipeline in (('per item', PerItemSummary(path)),
+                                   ('numpy batches', CatalogueSummaryPipeline(path))):
+                process_seconds, close_seconds = measure(pipeline, items)
+                results.append({'items': shape, 'run': name, 'process_item_seconds': round(process_seconds, 3),
+                                'close_spider_seconds': round(close_seconds, 3),
+                                'total_seconds': round(process_seconds + close_seconds, 3)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('%-12s %-14s %14s %14s %10s' % ('items', 'run', 'process_item', 'close_spider', 'total'))
+    for row in results:
+        print('%-12s %-14s %14.3f %14.3f %10.3f' % (row['items'], row['run'], row['process_item_seconds'],
+                                                    row['close_spider_seconds'], row['total_seconds']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+'''
+Crawls a rate limited CatalogueServer with fixed and adaptive concurrency.
+
+The server serves at most --max-in-flight requests at a time and answers any
+request beyond that with 429 and a Retry-After header. A fixed concurrency
+that is too low leaves throughput on the table, one that is too high trips the
+limit, and requests that are still rejected after RETRY_TIMES retries lose
+their books. The adaptive run (ebook_scraper.throttle.AdaptiveThrottle) is not
+told the limit and is checked at the end:
+  - no books lost
+  - at most --max-429s requests rejected by the server
+  - pages/sec within --margin of the fastest fixed setting that lost no books
+The benchmark exits with status 1 when a check fails. Finding the limit costs
+the adaptive run about two seconds at the start (slow start, then a backoff
+and a Retry-After pause at each of the first two 429 bursts), so on a much
+smaller catalogue than the default it falls further behind.
+
+    python -m benchmarks.bench_throttle --books 20000 --max-in-flight 8
+'''
+import argparse
+import json
+import sys
+
+from benchmarks.bench_crawl import run_scenario
+from benchmarks.server import CatalogueServer
+
+FANOUT = {'ITEM_PIPELINES': {}, 'EBOOK_PAGINATION': 'fanout', 'CONCURRENT_REQUESTS': 64}
+
+
+def scenarios():
+    # name -> settings
+    fixed = {'fixed_%d' % concurrency: dict(FANOUT, CONCURRENT_REQUESTS_PER_DOMAIN=concurrency)
+             for concurrency in (2, 8, 32)}
+    return dict(fixed, **{
+        'autothrottle': dict(FANOUT, CONCURRENT_REQUESTS_PER_DOMAIN=32, AUTOTHROTTLE_ENABLED=True,
+                             AUTOTHROTTLE_START_DELAY=0.1),
+        'adaptive': dict(FANOUT, CONCURRENT_REQUESTS_PER_DOMAIN=32, ADAPTIVE_THROTTLE_ENABLED=True,
+                         EXTENSIONS={'ebook_scraper.throttle.AdaptiveThrottle': 500}),
+    })
+
+
+def check_adaptive(results, max_429s, margin):
+    # What the adaptive run got wrong, an empty list when it passed
+    adaptive = next((row for row in results if row['name'] == 'adaptive'), None)
+    fixed = [row for row in results if row['name'].startswith('fixed_') and 'error' not in row
+             and row['books_lost'] == 0]
+    if adaptive is None or not fixed:
+        print('Not checked: needs the adaptive run and a fixed run that lost no books')
+        return []
+    if 'error' in adaptive:
+        return ['crawl failed: %s' % adaptive['error']]
+
+    failures = []
+    if adaptive['books_lost']:
+        failures.append('%d books lost' % adaptive['books_lost'])
+    if adaptive['rejected_by_server'] > max_429s:
+        failures.append('%d 429s, more than %d' % (adaptive['rejected_by_server'], max_429s))
+    best = max(fixed, key=lambda row: row['pages_per_sec'])
+    if adaptive['pages_per_sec'] < (1 - margin) * best['pages_per_sec']:
+        failures.append('%.1f pages/sec, more than %d%% below %s (%.1f)' % (
+            adaptive['pages_per_sec'], margin * 100, best['name'], best['pages_per_sec']))
+    if not failures:
+        print('adaptive: no books lost, %d 429s (at most %d), %.0f%% of %s' % (
+            adaptive['rejected_by_server'], max_429s, adaptive['pages_per_sec'] / best['pages_per_sec'] * 100,
+            best['name']))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=20000, help='size of the synthetic catalogue')
+    parser.add_argument('--latency', type=float, default=0.05, help='server time per page in seconds')
+    parser.add_argument('--max-in-flight', type=int, default=8, help='requests the server serves at a time')
+    parser.add_argument('--only', help='comma separated scenario names (default: all)')
+    parser.add_argument('--max-429s', type=int, default=32, help='429s the adaptive run may cause')
+    parser.add_argument('--margin', type=float, default=0.25,
+                        help='how much slower than the best fixed setting the adaptive run may be')
+    args = parser.parse_args()
+
+    selected = scenarios()
+    if args.only:
+        selected = {name: selected[name] for name in args.only.split(',')}
+
+    results = []
+    for name, settings in selected.items():
+        # A fresh server per run, so one run's rejections do not leak into the next
+        server = CatalogueServer(books=args.books, latency=args.latency,
+                                 max_in_flight=args.max_in_flight).start()
+        result = run_scenario(name, 'books_items', settings, server.base_url, args.books,
+                              stats=['adaptive_throttle/', 'retry/', 'downloader/response_status_count/429'])
+        server.shutdown()
+        result['books_lost'] = args.books - result.get('items', 0)
+        result['rejected_by_server'] = server.rejected
+        print('%-14s %s' % (name, json.dumps(result)), file=sys.stderr)
+        results.append(result)
+
+    print('%-14s %10s %8s %10s %12s' % ('scenario', 'pages/sec', '429s', 'books lost', 'concurrency'))
+    for row in results:
+        stats = row.get('stats', {})
+        concurrency = [value for key, value in stats.items() if key.endswith('/concurrency')]
+        print('%-14s %10s %8d %10d %12s' % (
+            row['name'], row.get('pages_per_sec'), row['rejected_by_server'], row['books_lost'],
+            concurrency[0] if concurrency else '-',
+        ))
+
+    failures = check_adaptive(results, args.max_429s, args.margin)
+    if failures:
+        sys.exit('adaptive: ' + '; '.join(failures))
+
+
+if __name__ == '__main__':
+    main()
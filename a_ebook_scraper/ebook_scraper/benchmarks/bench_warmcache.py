@@ -0,0 +1,97 @@
+'''
+Cold vs. warm start of a small crawl with the warm cache of ebook_scraper.warmcache.
+
+Two back-to-back crawls of a small catalogue share one warm cache file: the
+first (cold) fetches robots.txt and resolves the host, the second (warm) gets
+both from the cache. Both are compared with Scrapy's own components. The
+server is reached as `localhost`, so the DNS lookup goes through the resolver,
+and answers every request, robots.txt included, after --latency seconds.
+
+A second part counts the TCP connections the server accepts when more
+requests are in flight per host (CONCURRENT_REQUESTS_PER_IP) than Scrapy's
+pool keeps idle connections for, with the default and the tuned download
+handler.
+
+    python -m benchmarks.bench_warmcache --books 200 --latency 0.05
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.bench_crawl import run_scenario
+
+WARM_CACHE = {
+    'WARM_CACHE_ENABLED': True,
+    'DOWNLOADER_MIDDLEWARES': {
+        'scrapy.downloadermiddlewares.robotstxt.RobotsTxtMiddleware': None,
+        'ebook_scraper.warmcache.CachedRobotsTxtMiddleware': 100,
+    },
+    'EXTENSIONS': {'ebook_scraper.warmcache.WarmCacheStats': 0},
+    'DNS_RESOLVER': 'ebook_scraper.warmcache.PersistentCachingResolver',
+    'DOWNLOAD_HANDLERS': {'http': 'ebook_scraper.warmcache.TunedHTTP11DownloadHandler',
+                          'https': 'ebook_scraper.warmcache.TunedHTTP11DownloadHandler'},
+}
+NO_PIPELINES = {'ITEM_PIPELINES': {}, 'ROBOTSTXT_OBEY': True}
+
+
+def crawl(server, name, settings, books):
+    # The connections the server accepted during this crawl
+    connections = server.connections
+    result = run_scenario(name, 'books_items', dict(NO_PIPELINES, **settings),
+                          server.base_url.replace('127.0.0.1', 'localhost'), books,
+                          stats=('warm_cache/', 'robotstxt/request_count'))
+    result['server_connections'] = server.connections - connections
+    print('%-16s %s' % (name, json.dumps(result)), file=sys.stderr)
+    return result
+
+
+def main():
+    from benchmarks.server import CatalogueServer
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=200, help='size of the synthetic catalogue')
+    parser.add_argument('--latency', type=float, default=0.05, help='server latency per request in seconds')
+    parser.add_argument('--pool-books', type=int, default=5000, help='catalogue size of the pool runs')
+    parser.add_argument('--per-ip', type=int, default=32, help='CONCURRENT_REQUESTS_PER_IP of the pool runs')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    server = CatalogueServer(books=args.books, latency=args.latency).start()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        warm_cache = dict(WARM_CACHE, WARM_CACHE_FILE=os.path.join(directory, 'warmcache.sqlite'))
+        results.append(crawl(server, 'scrapy', {}, args.books))
+        results.append(crawl(server, 'cold', warm_cache, args.books))
+        results.append(crawl(server, 'warm', warm_cache, args.books))
+    server.shutdown()
+
+    # Every listing page requested at once, more than the 8 idle connections
+    # per host Scrapy keeps by default
+    server = CatalogueServer(books=args.pool_books, latency=args.latency).start()
+    concurrent = {'EBOOK_PAGINATION': 'fanout', 'ROBOTSTXT_OBEY': False,
+                  'CONCURRENT_REQUESTS': args.per_ip, 'CONCURRENT_REQUESTS_PER_IP': args.per_ip}
+    results.append(crawl(server, 'pool scrapy', concurrent, args.pool_books))
+    results.append(crawl(server, 'pool tuned', dict(concurrent, DOWNLOAD_HANDLERS=WARM_CACHE['DOWNLOAD_HANDLERS'],
+                                                    WARM_CACHE_ENABLED=True,
+                                                    EXTENSIONS=WARM_CACHE['EXTENSIONS']), args.pool_books))
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('%-12s %12s %12s %10s %12s %14s' % ('run', 'first item', 'wall', 'pages', 'connections',
+                                              'seconds saved'))
+    for row in results:
+        if 'error' in row:
+            print('%-12s error: %s' % (row['name'], row['error']))
+            continue
+        stats = row['stats']
+        print('%-12s %11.3fs %11.3fs %10d %12d %13.3fs' % (
+            row['name'], row['stages']['first_item'], row['wall_seconds'],
+            row['pages'], row['server_connections'], stats.get('warm_cache/seconds_saved', 0)))
+
+
+if __name__ == '__main__':
+    main()
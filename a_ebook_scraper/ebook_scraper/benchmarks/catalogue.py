@@ -0,0 +1,197 @@
+'''
+Synthetic books.toscrape.com catalogue pages.
+
+The markup follows the real site (article.product_pod cards, the
+"Page X of N" pager and the li.next link, and for the detail pages the
+breadcrumb, description and "Product Information" table) so the spiders
+and extractors can be benchmarked without network access.
+'''
+import random
+
+RATING_WORDS = ['One', 'Two', 'Three', 'Four', 'Five']
+BOOKS_PER_PAGE = 20
+
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html lang="en-us" class="no-js">
+<head>
+    <title>All products | Books to Scrape - Sandbox</title>
+    <meta http-equiv="content-type" content="text/html; charset=UTF-8" />
+</head>
+<body id="default" class="default">
+<div class="container-fluid page">
+<div class="page_inner">
+<div class="row">
+<div class="col-sm-8 col-md-9">
+<div class="page-header action"><h1>All products</h1></div>
+<section>
+<div>
+<ol class="row">
+{cards}
+</ol>
+<div>
+<ul class="pager">
+{previous}
+<li class="current">
+    Page {page} of {pages}
+</li>
+{next}
+</ul>
+</div>
+</div>
+</section>
+</div>
+</div>
+</div>
+</div>
+</body>
+</html>
+'''
+
+CARD_TEMPLATE = '''<li class="col-xs-6 col-sm-4 col-md-3 col-lg-3">
+    <article class="product_pod">
+        <div class="image_container">
+            <a href="{slug}/index.html"><img src="../media/cache/{number}.jpg" alt="{title}" class="thumbnail"></a>
+        </div>
+        <p class="star-rating {rating}">
+            <i class="icon-star"></i>
+            <i class="icon-star"></i>
+            <i class="icon-star"></i>
+            <i class="icon-star"></i>
+            <i class="icon-star"></i>
+        </p>
+        <h3><a href="{slug}/index.html" title="{title}">{short_title}</a></h3>
+        <div class="product_price">
+            <p class="price_color">£{price:.2f}</p>
+            {availability}
+            <form>
+                <button type="submit" class="btn btn-primary btn-block" data-loading-text="Adding...">Add to basket</button>
+            </form>
+        </div>
+    </article>
+</li>'''
+
+IN_STOCK = '''<p class="instock availability">
+    <i class="icon-ok"></i>
+        In stock
+</p>'''
+
+OUT_OF_STOCK = '''<p class="outofstock availability">
+    <i class="icon-remove"></i>
+        Out of stock
+</p>'''
+
+
+DETAIL_TEMPLATE = '''<!DOCTYPE html>
+<html lang="en-us" class="no-js">
+<head>
+    <title>{title} | Books to Scrape - Sandbox</title>
+    <meta http-equiv="content-type" content="text/html; charset=UTF-8" />
+</head>
+<body id="default" class="default">
+<div class="container-fluid page">
+<div class="page_inner">
+<ul class="breadcrumb">
+    <li><a href="../../index.html">Home</a></li>
+    <li><a href="../category/books_1/index.html">Books</a></li>
+    <li><a href="../category/books/{category_slug}/index.html">{category}</a></li>
+    <li class="active">{title}</li>
+</ul>
+<article class="product_page">
+<div class="row">
+<div class="col-sm-6 product_main">
+    <h1>{title}</h1>
+    <p class="price_color">£{price:.2f}</p>
+    <p class="{availability_class} availability">
+        <i class="{availability_icon}"></i>
+        {availability}
+    </p>
+    <p class="star-rating {rating}"></p>
+</div>
+</div>
+<div id="product_description" class="sub-header">
+    <h2>Product Description</h2>
+</div>
+<p>{description}</p>
+<div class="sub-header">
+    <h2>Product Information</h2>
+</div>
+<table class="table table-striped">
+    <tr><th>UPC</th><td>{upc}</td></tr>
+    <tr><th>Product Type</th><td>Books</td></tr>
+    <tr><th>Price (excl. tax)</th><td>£{price:.2f}</td></tr>
+    <tr><th>Price (incl. tax)</th><td>£{price:.2f}</td></tr>
+    <tr><th>Tax</th><td>£0.00</td></tr>
+    <tr><th>Availability</th><td>{availability}</td></tr>
+    <tr><th>Number of reviews</th><td>0</td></tr>
+</table>
+</article>
+</div>
+</div>
+</body>
+</html>
+'''
+
+CATEGORIES = ['Poetry', 'Historical Fiction', 'Mystery', 'Science', 'Travel', 'Fantasy']
+
+
+def book(number):
+    # Every book is derived from its number, so all pages are reproducible
+    rng = random.Random(number)
+    title = 'Synthetic Book %d: %s' % (number, rng.choice(['A Novel', 'Poems', 'A Memoir', 'Stories']))
+    return {
+        'number': number,
+        'slug': 'synthetic-book_%d' % number,
+        'title': title,
+        'short_title': title[:25] + '...' if len(title) > 25 else title,
+        'rating': rng.choice(RATING_WORDS),
+        'price': rng.uniform(10, 60),
+        'in_stock': rng.random() > 0.1,
+    }
+
+
+def book_details(number):
+    # The detail page values, from a generator of their own so book() stays unchanged
+    values = book(number)
+    rng = random.Random(-number)
+    category = rng.choice(CATEGORIES)
+    stock_count = rng.randint(1, 22) if values['in_stock'] else 0
+    values.update(
+        upc='%016x' % rng.getrandbits(64),
+        category=category,
+        category_slug='%s_%d' % (category.lower().replace(' ', '-'), CATEGORIES.index(category) + 2),
+        description=' '.join(rng.choice(['A', 'story', 'about', 'books', 'and', 'the', 'people', 'who', 'read', 'them.'])
+                             for _ in range(rng.randint(50, 200))),
+        stock_count=stock_count,
+        availability='In stock (%d available)' % stock_count if stock_count else 'Out of stock',
+        availability_class='instock' if stock_count else 'outofstock',
+        availability_icon='icon-ok' if stock_count else 'icon-remove',
+    )
+    return values
+
+
+def render_detail(number):
+    # Renders catalogue/synthetic-book_<number>/index.html
+    return DETAIL_TEMPLATE.format(**book_details(number))
+
+
+def page_count(total_books, per_page=BOOKS_PER_PAGE):
+    return max(1, -(-total_books // per_page))
+
+
+def render_page(page, total_books=1000, per_page=BOOKS_PER_PAGE):
+    # Renders catalogue/page-<page>.html of a catalogue holding total_books books
+    pages = page_count(total_books, per_page)
+    first = (page - 1) * per_page + 1
+    last = min(page * per_page, total_books)
+    cards = []
+    for number in range(first, last + 1):
+        values = book(number)
+        values['availability'] = IN_STOCK if values['in_stock'] else OUT_OF_STOCK
+        cards.append(CARD_TEMPLATE.format(**values))
+    return PAGE_TEMPLATE.format(
+        cards='\n'.join(cards),
+        page=page,
+        pages=pages,
+        previous='<li class="previous"><a href="page-%d.html">previous</a></li>' % (page - 1) if page > 1 else '',
+        next='<li class="next"><a href="page-%d.html">next</a></li>' % (page + 1) if page < pages else '',
+    )
@@ -0,0 +1,135 @@
+'''
+A local stand-in for books.toscrape.com serving synthetic catalogue pages.
+
+Serves /catalogue/page-N.html (and / as page 1) for a catalogue of any size,
+the detail page of every book at /catalogue/synthetic-book_N/index.html, with
+ETag support and an optional artificial latency (robots.txt included, which
+answers 404 like the real site). With --max-in-flight it also plays a rate limited server:
+requests beyond that many at a time are answered with 429 and a Retry-After.
+
+    python -m benchmarks.server --books 100000 --port 8000
+'''
+import argparse
+import hashlib
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.catalogue import page_count, render_detail, render_page
+
+PAGE_PATH = re.compile(r'^/(?:catalogue/)?page-(\d+)\.html$')
+DETAIL_PATH = re.compile(r'^/catalogue/synthetic-book_(\d+)/index\.html$')
+
+
+class CatalogueHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the crawler can reuse its connections
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, Nagle's algorithm would delay the body
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Called once per connection, which keep-alive reuses for many requests
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        detail = DETAIL_PATH.match(path)
+        if detail:
+            number = int(detail.group(1))
+            render = render_detail if 1 <= number <= self.server.books else None
+        else:
+            if path in ('/', '/index.html', '/catalogue/'):
+                number = 1
+            else:
+                match = PAGE_PATH.match(path)
+                number = int(match.group(1)) if match else None
+            valid = number is not None and 1 <= number <= page_count(self.server.books)
+            render = (lambda page: render_page(page, self.server.books)) if valid else None
+
+        if render is None:
+            # robots.txt is 404 here, but it takes the same round trip as a page
+            if path == '/robots.txt' and self.server.latency:
+                time.sleep(self.server.latency)
+            self.send_body(404, b'Not Found', 'text/plain')
+            return
+
+        limit = self.server.in_flight
+        if limit is not None and not limit.acquire(blocking=False):
+            self.server.rejected += 1
+            self.send_response(429)
+            self.send_header('Retry-After', str(self.server.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            body = render(number).encode('utf-8')
+        finally:
+            if limit is not None:
+                limit.release()
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_body(304, b'', None, etag)
+            return
+        self.send_body(200, body, 'text/html; charset=utf-8', etag)
+
+    def send_body(self, status, body, content_type, etag=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # One log line per request would dominate the benchmark
+        pass
+
+
+class CatalogueServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, books=1000, port=0, latency=0.0, max_in_flight=0, retry_after=1,
+                 handler=CatalogueHandler):
+        super().__init__(('127.0.0.1', port), handler)
+        self.books = books
+        self.latency = latency
+        # Rate limiting: at most max_in_flight requests are served at a time
+        self.in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self.retry_after = retry_after
+        self.rejected = 0
+        self.connections = 0
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    def start(self):
+        # Serve from a background thread, e.g. while a benchmark runs the crawl
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=1000, help='size of the catalogue')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each page')
+    parser.add_argument('--max-in-flight', type=int, default=0, help='answer 429 above this many requests')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds of the 429s')
+    args = parser.parse_args()
+
+    server = CatalogueServer(books=args.books, port=args.port, latency=args.latency,
+                             max_in_flight=args.max_in_flight, retry_after=args.retry_after)
+    print('Serving %d books (%d pages) at %s' % (args.books, page_count(args.books), server.base_url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
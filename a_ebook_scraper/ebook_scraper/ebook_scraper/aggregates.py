@@ -0,0 +1,107 @@
+# Column-at-a-time conversion and catalogue aggregates with NumPy, used by
+# CatalogueSummaryPipeline (pipelines.py).
+#
+# The spiders yield prices and ratings in different shapes: books and
+# books_xpath pass on the raw '£51.77' and 'Three', EbookItem holds 51.77 and
+# 'Three'. Instead of converting every item as it goes by, the pipeline only
+# collects the raw values and converts a whole batch at once:
+#   - prices: a column of floats is taken as is in one call; strings are
+#     parsed one by one, an unreadable price becomes NaN like a missing one
+#   - ratings: one dict lookup per value in map(), straight into an int8 array
+# The aggregates (histogram, rating distribution, in-stock ratio, ...) are
+# then plain array operations.
+
+try:
+    import numpy
+except ImportError:  # numpy is only needed by CatalogueSummaryPipeline
+    numpy = None
+
+from ebook_scraper.items import RATINGS
+
+
+class _Ratings(dict):
+    # 'Three' and 3 both map to 3; anything else (None, a typo) to 0
+    def __missing__(self, key):
+        return 0
+
+
+_RATINGS = _Ratings(RATINGS)
+_RATINGS.update({value: value for value in RATINGS.values()})
+
+
+def _price(value):
+    # '£51.77', ' 51.77' or 51.77 as a float; NaN for None or anything unreadable
+    if value is None:
+        return numpy.nan
+    try:
+        return float(str(value).replace('£', ''))
+    except ValueError:
+        return numpy.nan
+
+
+def prices_to_array(values):
+    '''
+    Converts a list of prices ('£51.77', 51.77 or None) to float64, NaN where missing or unreadable.
+    '''
+    try:
+        # Floats (and None, which becomes NaN) need no parsing at all
+        return numpy.array(values, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        pass
+    return numpy.fromiter(map(_price, values), dtype=numpy.float64, count=len(values))
+
+
+def ratings_to_array(values):
+    # 'Three' or 3 -> 3, with 0 for a missing rating
+    return numpy.fromiter(map(_RATINGS.__getitem__, values), dtype=numpy.int8, count=len(values))
+
+
+def in_stock_to_array(values):
+    return numpy.array(values, dtype=object) == 'In stock'
+
+
+def summarize(prices, ratings, in_stock, categories=None, bins=10):
+    '''
+    The catalogue aggregates of whole columns, as a dict ready for json.dump().
+
+    bins is the number of equal-width price bins, or a list of bin edges.
+    '''
+    known = prices[~numpy.isnan(prices)]
+    summary = {'items': int(len(prices))}
+
+    if len(known):
+        counts, edges = numpy.histogram(known, bins=bins)
+        low, median, high = numpy.percentile(known, [10, 50, 90])
+        summary['price'] = {
+            'min': float(known.min()),
+            'max': float(known.max()),
+            'mean': round(float(known.mean()), 4),
+            'median': round(float(median), 4),
+            'p10': round(float(low), 4),
+            'p90': round(float(high), 4),
+            'histogram': {'edges': [round(float(edge), 2) for edge in edges], 'counts': counts.tolist()},
+        }
+
+    # Index 0 counts the books without a rating
+    distribution = numpy.bincount(ratings, minlength=6)
+    rated = ratings > 0
+    summary['rating'] = {
+        'distribution': {str(stars): int(distribution[stars]) for stars in range(1, 6)},
+        'unrated': int(distribution[0]),
+        'mean': round(float(ratings[rated].mean()), 4) if rated.any() else None,
+    }
+
+    # Mean price per star rating in one pass: price sums / book counts per rating
+    priced = rated & ~numpy.isnan(prices)
+    sums = numpy.bincount(ratings[priced], weights=prices[priced], minlength=6)
+    books = numpy.bincount(ratings[priced], minlength=6)
+    summary['mean_price_by_rating'] = {str(stars): round(float(sums[stars] / books[stars]), 4)
+                                       for stars in range(1, 6) if books[stars]}
+
+    summary['in_stock_ratio'] = round(float(in_stock.mean()), 4) if len(in_stock) else None
+
+    if categories is not None and len(categories):
+        names, counts = numpy.unique(categories[categories != None], return_counts=True)  # noqa: E711
+        order = numpy.argsort(-counts, kind='stable')
+        summary['categories'] = {str(names[i]): int(counts[i]) for i in order}
+    return summary
@@ -0,0 +1,157 @@
+# Price and availability changes as they are scraped (ChangeAlertPipeline, pipelines.py).
+#
+# What we follow from run to run is a book's price, rating and stock status,
+# not the whole catalogue. BookStateIndex keeps the last known values of every
+# book in memory, packed into one int per book, and is filled at the start of a
+# crawl from the previous run's output, read one line at a time. Every scraped
+# item is compared with its entry, and only books that were added, changed or
+# (after a finished crawl) disappeared are appended to a JSON lines stream,
+# one line per change, flushed right away so `tail -f` sees it during the crawl:
+#
+#   {"change": "changed", "key": "...", "title": "...", "price": 19.99, "rating": 4,
+#    "in_stock": true, "previous": {"price": 24.99}, "at": 1760000000.0}
+
+import csv
+import gzip
+import io
+import json
+
+from ebook_scraper.incremental import book_key
+from ebook_scraper.items import price_to_float, rating_to_int
+
+# The packed state of a book, lowest bits first:
+#   1 bit   seen in this crawl
+#   2 bits  stock: 0 unknown, 1 out of stock, 2 in stock
+#   3 bits  rating 0-5, 0 unknown
+#   rest    price in pence + 1, 0 unknown
+SEEN = 1
+STOCK_SHIFT = 1
+RATING_SHIFT = 3
+PRICE_SHIFT = 6
+
+# What BookStateIndex.update() returns for a book it did not know
+NEW = -1
+
+FIELDS = ('price', 'rating', 'in_stock')
+
+
+def item_key(item):
+    # The same key SQLitePipeline and IncrementalItemPipeline use: the UPC when
+    # the details were scraped, else the detail page URL, as titles repeat
+    return book_key(item)
+
+
+def pack_state(price, rating, stock_status):
+    '''
+    Packs a price ('£51.77' or 51.77), rating ('Three' or 3) and stock status into an int.
+    '''
+    price = price_to_float(price)
+    # CSV exports hold every value as text, the rating too when it was a number
+    rating = int(rating) if isinstance(rating, str) and rating.isdigit() else rating_to_int(rating)
+    state = 0 if price is None else (round(price * 100) + 1) << PRICE_SHIFT
+    if rating:
+        state |= rating << RATING_SHIFT
+    if stock_status is not None:
+        # "In stock" on the listings, "In stock (22 available)" on detail pages
+        state |= (2 if stock_status.startswith('In stock') else 1) << STOCK_SHIFT
+    return state
+
+
+def unpack_state(state):
+    # {'price': 51.77, 'rating': 3, 'in_stock': True}, None for unknown values
+    price = state >> PRICE_SHIFT
+    rating = (state >> RATING_SHIFT) & 7
+    stock = (state >> STOCK_SHIFT) & 3
+    return {
+        'price': (price - 1) / 100 if price else None,
+        'rating': rating or None,
+        'in_stock': stock == 2 if stock else None,
+    }
+
+
+def present(value):
+    # CSV exports write a missing value as an empty string; 0 is a real price
+    return None if value is None or value == '' else value
+
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def read_rows(path):
+    '''
+    Streams the rows of an earlier export: JSON lines, CSV or a JSON array with
+    one item per line (what Scrapy's feed exporter and exports.JsonWriter write),
+    optionally gzipped.
+    '''
+    name = path[:-3] if path.endswith('.gz') else path
+    with open_text(path) as f:
+        if name.endswith('.csv'):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            line = line.strip().rstrip(',')
+            if not line or line in ('[', ']'):
+                continue
+            # A crawl killed mid-write leaves at most one torn line at the end
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+class BookStateIndex:
+    '''
+    The last known state of every book, one packed int per key.
+    '''
+
+    def __init__(self):
+        self.states = {}
+
+    def __len__(self):
+        return len(self.states)
+
+    def load(self, path):
+        # Returns the number of rows read; later rows of the same book win
+        states = self.states
+        rows = 0
+        for row in read_rows(path):
+            key = item_key(row)
+            if key:
+                states[key] = pack_state(present(row.get('price')), present(row.get('rating')),
+                                         present(row.get('stock_status')))
+                rows += 1
+        return rows
+
+    def update(self, key, state):
+        '''
+        Stores the state of a book seen in this crawl.
+
+        Returns None when nothing changed, else the previous state (NEW for a new book).
+        '''
+        previous = self.states.get(key)
+        self.states[key] = state | SEEN
+        if previous is None:
+            return NEW
+        if (previous | SEEN) == (state | SEEN):
+            return None
+        return previous
+
+    def unseen(self):
+        # (key, state) of the books not seen in this crawl
+        return [(key, state) for key, state in self.states.items() if not state & SEEN]
+
+
+def change_record(change, key, title, state, previous=None, at=None):
+    record = {'change': change, 'key': key}
+    if title is not None:
+        record['title'] = title
+    record.update(unpack_state(state))
+    if previous:
+        old = unpack_state(previous)
+        record['previous'] = {field: old[field] for field in FIELDS if old[field] != record[field]}
+    if at is not None:
+        record['at'] = at
+    return record
@@ -0,0 +1,321 @@
+# Crash-safe checkpoints of a running crawl, and resuming from them.
+#
+# Every CHECKPOINT_INTERVAL seconds CheckpointMiddleware pauses the engine,
+# waits until the responses in flight have gone through the spider and the
+# item pipelines, and appends one record to <CHECKPOINT_DIR>/<spider>.journal:
+#   - the requests scheduled since the previous checkpoint,
+#   - the fingerprints of the requests whose responses were processed since then,
+#   - the output offset of every pipeline that supports it (e.g. the last
+#     saved part of ExcelAppendPipeline) and the spider's own state.
+# The journal is append-only and every record holds just what changed during
+# one interval, so a checkpoint costs the same at page 40 as at page 4000.
+# Each record is framed with its length and a CRC and synced to disk, so a
+# crash in the middle of a write only loses that last record.
+#
+# `scrapy resume <spider>` (ebook_scraper/commands/resume.py) replays the
+# journal: pipelines roll back to the last checkpoint (dropping rows written
+# after it), the pending requests become the start requests, and the finished
+# ones are marked as seen so they are not fetched again.
+
+import logging
+import os
+import pickle
+import struct
+import time
+import zlib
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.request import request_from_dict
+from twisted.internet import defer, task
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    '''
+    An append-only file of pickled records, each framed by length and CRC32.
+    '''
+
+    FRAME = struct.Struct('>II')
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def records(self):
+        # Every complete record, stopping at the first torn or damaged one
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            while True:
+                header = f.read(self.FRAME.size)
+                if len(header) < self.FRAME.size:
+                    return
+                length, crc = self.FRAME.unpack(header)
+                data = f.read(length)
+                if len(data) < length or zlib.crc32(data) != crc:
+                    logger.warning('Ignoring a damaged record at the end of %s', self.path)
+                    return
+                yield pickle.loads(data)
+
+    def open(self, records=()):
+        # Starts the file over with the given records (e.g. a compacted replay)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            for record in records:
+                f.write(self._frame(record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.file = open(self.path, 'ab')
+
+    def append(self, record):
+        # Returns the number of bytes written
+        frame = self._frame(record)
+        self.file.write(frame)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return len(frame)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _frame(self, record):
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        return self.FRAME.pack(len(data), zlib.crc32(data)) + data
+
+
+def replay(records):
+    '''
+    Folds journal records into the state at the last checkpoint.
+
+    Returns a dict with 'pending' (fingerprint -> request dict), 'done' (set of
+    fingerprints), and the latest 'pipelines', 'spider' and 'finished' values.
+    Requests dropped by the dupefilter are not in the journal at all (see
+    CheckpointMiddleware.request_dropped()).
+    '''
+    state = {'pending': {}, 'done': set(), 'pipelines': {}, 'spider': None, 'finished': False}
+    for record in records:
+        for event in record['events']:
+            if event[0] == 'scheduled':
+                state['pending'][event[1]] = event[2]
+            else:
+                state['pending'].pop(event[1], None)
+                state['done'].add(event[1])
+        state['pipelines'].update(record['pipelines'])
+        state['spider'] = record['spider']
+        state['finished'] = record['finished']
+    return state
+
+
+class CheckpointMiddleware:
+    '''
+    Writes periodic checkpoints of a crawl and resumes it from them.
+
+    Enabled with CHECKPOINT_ENABLED. With CHECKPOINT_RESUME (set by `scrapy
+    resume`), the start requests of the spider are replaced by the requests
+    that were still pending at the last checkpoint.
+
+    Pipelines take part by implementing checkpoint() (make everything so far
+    durable and return the offset, or a Deferred with it) and
+    restore_checkpoint(offset). Spiders with
+    state of their own implement checkpoint_state() and restore_checkpoint().
+    '''
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CHECKPOINT_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = settings.getfloat('CHECKPOINT_INTERVAL', 60.0)
+        self.directory = settings.get('CHECKPOINT_DIR', 'checkpoints')
+        self.resume = settings.getbool('CHECKPOINT_RESUME')
+        self.resumed_requests = None
+        # ('scheduled' / 'done', request) since the last checkpoint, in order
+        self.events = []
+        # The checkpoint in progress, and the timer it is waiting on for the engine to go idle
+        self.running = None
+        self.waiting = None
+        self.closed = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(s.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(s.response_received, signal=signals.response_received)
+        return s
+
+    def process_start_requests(self, start_requests, spider):
+        # On resume the pending requests take the place of the start requests
+        if self.resumed_requests is None:
+            yield from start_requests
+            return
+        for data in self.resumed_requests:
+            yield request_from_dict(data, spider=spider)
+        self.resumed_requests = None
+
+    def request_scheduled(self, request, spider):
+        self.events.append(('scheduled', request))
+
+    def request_dropped(self, request, spider):
+        # Filtered as a duplicate right after being scheduled. Only this request
+        # is taken back: the earlier one with the same fingerprint is still pending
+        for position in range(len(self.events) - 1, -1, -1):
+            if self.events[position][0] == 'scheduled' and self.events[position][1] is request:
+                del self.events[position]
+                return
+
+    def response_received(self, response, request, spider):
+        self.events.append(('done', request))
+
+    def spider_opened(self, spider):
+        return self.open(spider)
+
+    @defer.inlineCallbacks
+    def open(self, spider):
+        os.makedirs(self.directory, exist_ok=True)
+        self.journal = Journal(os.path.join(self.directory, '%s.journal' % spider.name))
+
+        records = list(self.journal.records()) if self.resume else []
+        if self.resume and not records:
+            logger.info('No checkpoint of %s found, starting from scratch', spider.name)
+        if records:
+            state = replay(records)
+            yield self.restore(state, spider)
+            # Compact: one record with the state so far, later checkpoints append to it
+            self.journal.open([{
+                'events': [('done', fingerprint) for fingerprint in state['done']] +
+                          [('scheduled', fingerprint, data) for fingerprint, data in state['pending'].items()],
+                'pipelines': state['pipelines'],
+                'spider': state['spider'],
+                'finished': state['finished'],
+            }])
+        else:
+            # The first record holds the offsets the pipelines start from
+            self.journal.open()
+            yield self.write(spider)
+
+        self.loop = task.LoopingCall(self.start_checkpoint, spider)
+        self.loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        self.closed = True
+        return self.close(spider, reason)
+
+    @defer.inlineCallbacks
+    def close(self, spider, reason):
+        if self.loop.running:
+            self.loop.stop()
+        # A checkpoint still waiting for the engine to go idle gives up, one
+        # that is writing is let finish before the journal is closed
+        if self.waiting is not None:
+            self.waiting.cancel()
+        if self.running is not None:
+            yield self.running
+        # The pipelines are closed (and their files saved) by now
+        yield self.write(spider, finished=reason == 'finished')
+        self.journal.close()
+
+    def start_checkpoint(self, spider):
+        self.running = self.checkpoint(spider)
+        return self.running
+
+    def closing(self):
+        # True from the moment the engine starts closing the spider: the only
+        # checkpoint left to write is the final one of spider_closed
+        engine = self.crawler.engine
+        return (self.closed or engine.slot is None or engine.slot.closing is not None
+                or engine.scraper.slot is None)
+
+    @defer.inlineCallbacks
+    def checkpoint(self, spider):
+        from twisted.internet import reactor
+
+        if self.closing():
+            return
+        engine = self.crawler.engine
+        started = time.monotonic()
+        # No new requests while the ones in flight are finished, so that every
+        # response is either fully processed or not started at the checkpoint
+        engine.pause()
+        try:
+            while engine.downloader.active or not engine.scraper.slot.is_idle():
+                self.waiting = task.deferLater(reactor, 0.05, lambda: None)
+                yield self.waiting
+                if self.closing():
+                    return
+            self.waiting = None
+            yield self.write(spider)
+        except defer.CancelledError:
+            # spider_closed does not wait for the engine to go idle
+            return
+        finally:
+            self.waiting = None
+            if not self.closing():
+                engine.unpause()
+                # unpause() only lifts the flag, the engine would otherwise wait
+                # for its next heartbeat before sending a request
+                engine.slot.nextcall.schedule()
+        self.stats.max_value('checkpoint/max_pause_seconds', round(time.monotonic() - started, 3), spider=spider)
+
+    @defer.inlineCallbacks
+    def write(self, spider, finished=False):
+        fingerprint = self.crawler.request_fingerprinter.fingerprint
+        events = []
+        for kind, request in self.events:
+            if kind == 'scheduled':
+                events.append((kind, fingerprint(request), request.to_dict(spider=spider)))
+            else:
+                events.append((kind, fingerprint(request)))
+        self.events = []
+
+        pipelines = {}
+        for pipeline in self.pipelines():
+            if hasattr(pipeline, 'checkpoint'):
+                pipelines[type(pipeline).__name__] = yield defer.maybeDeferred(pipeline.checkpoint)
+
+        state = spider.checkpoint_state() if hasattr(spider, 'checkpoint_state') else None
+        size = self.journal.append({'events': events, 'pipelines': pipelines,
+                                    'spider': state, 'finished': finished})
+        self.stats.inc_value('checkpoint/count', spider=spider)
+        self.stats.inc_value('checkpoint/bytes', size, spider=spider)
+
+    @defer.inlineCallbacks
+    def restore(self, state, spider):
+        if state['finished']:
+            logger.info('The last crawl of %s finished, there is nothing to resume', spider.name)
+            self.resumed_requests = []
+            return
+
+        for pipeline in self.pipelines():
+            name = type(pipeline).__name__
+            if hasattr(pipeline, 'restore_checkpoint'):
+                yield defer.maybeDeferred(pipeline.restore_checkpoint, state['pipelines'].get(name))
+            else:
+                logger.warning('%s does not support checkpoints, items after the last '
+                               'checkpoint may be written to it twice', name)
+        if state['spider'] is not None and hasattr(spider, 'restore_checkpoint'):
+            spider.restore_checkpoint(state['spider'])
+
+        # Finished requests count as seen, so they are filtered if yielded again
+        dupefilter = self.crawler.engine.slot.scheduler.df
+        for fingerprint in state['done']:
+            if hasattr(dupefilter, 'bloom'):
+                dupefilter.bloom.add(fingerprint)
+            elif hasattr(dupefilter, 'fingerprints'):
+                dupefilter.fingerprints.add(fingerprint.hex())
+
+        self.resumed_requests = list(state['pending'].values())
+        self.stats.set_value('checkpoint/resumed_requests', len(self.resumed_requests), spider=spider)
+        logger.info('Resuming %s with %d pending requests (%d finished)',
+                    spider.name, len(self.resumed_requests), len(state['done']))
+
+    def pipelines(self):
+        return self.crawler.engine.scraper.itemproc.middlewares
@@ -0,0 +1 @@
+# Custom scrapy commands of this project (enabled by COMMANDS_MODULE in settings.py)
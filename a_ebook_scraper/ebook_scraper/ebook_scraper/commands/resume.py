@@ -0,0 +1,27 @@
+from scrapy.commands.crawl import Command as CrawlCommand
+
+
+class Command(CrawlCommand):
+    '''
+    scrapy resume <spider>: continue a crawl from its last checkpoint.
+
+    Takes the same options as `scrapy crawl`. The crawl continues with the
+    requests that were pending at the last checkpoint written by
+    ebook_scraper.checkpoint.CheckpointMiddleware, and the pipelines drop what
+    they wrote after it.
+    '''
+
+    def syntax(self):
+        return "[options] <spider>"
+
+    def short_desc(self):
+        return "Resume a crawl from its last checkpoint"
+
+    def process_options(self, args, opts):
+        super().process_options(args, opts)
+        self.settings.set('CHECKPOINT_ENABLED', True, priority='cmdline')
+        self.settings.set('CHECKPOINT_RESUME', True, priority='cmdline')
+        # Make sure the middleware runs even if settings.py does not enable it
+        middlewares = self.settings.getdict('SPIDER_MIDDLEWARES')
+        middlewares.setdefault('ebook_scraper.checkpoint.CheckpointMiddleware', 100)
+        self.settings.set('SPIDER_MIDDLEWARES', middlewares, priority='cmdline')
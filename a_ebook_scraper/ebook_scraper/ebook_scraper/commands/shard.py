@@ -0,0 +1,150 @@
+import os
+import subprocess
+import sys
+import time
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.utils.conf import arglist_to_dict
+from scrapy.utils.misc import load_object
+
+from ebook_scraper.shards import SHARD_FILE, merge_shards
+
+# Output formats by file extension, for -o FILE without :FORMAT
+EXTENSIONS = {'.json': 'json', '.jsonl': 'jsonlines', '.jl': 'jsonlines', '.csv': 'csv',
+              '.xml': 'xml', '.xlsx': 'xlsx'}
+COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+
+def parse_output(value):
+    # FILE[:FORMAT] -> (path, {'format': ..., 'compression': ...})
+    path, _, file_format = value.rpartition(':') if ':' in value else (value, None, None)
+    options = {}
+    base, extension = os.path.splitext(path)
+    if extension in COMPRESSIONS:
+        options['compression'] = COMPRESSIONS[extension]
+        base, extension = os.path.splitext(base)
+    options['format'] = file_format or EXTENSIONS.get(extension)
+    if options['format'] is None:
+        raise UsageError('Unknown output format of %s, use -o FILE:FORMAT' % path, print_help=False)
+    return path, options
+
+
+class Command(ScrapyCommand):
+    '''
+    scrapy shard <spider> -w N -o FILE: crawl with N worker processes.
+
+    The workers are ordinary `scrapy crawl` processes that share one work queue
+    (ebook_scraper/workqueue.py, EBOOK_SHARD_QUEUE). The queue starts with the
+    first catalogue page; that page queues all the others, and in enrichment
+    mode every page queues its detail pages, so the work spreads over all
+    workers. Each worker runs in <dir>/worker-<n>/ and writes its items to its
+    own shard there (shards.SHARD_FILE, plus whatever the item pipelines write).
+    When all workers are done the shards are merged into the -o outputs.
+    '''
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <spider>"
+
+    def short_desc(self):
+        return "Run a spider in several worker processes and merge their output"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                            help="number of worker processes (default: one per CPU)")
+        parser.add_argument("-o", "--output", metavar="FILE", action="append", default=[],
+                            help="merged output file (may be repeated), FILE:FORMAT to set the format")
+        parser.add_argument("-a", dest="spargs", action="append", default=[], metavar="NAME=VALUE",
+                            help="set spider argument (may be repeated)")
+        parser.add_argument("--dir", default="shards",
+                            help="directory of the work queue and the worker shards (default: shards)")
+
+    def process_options(self, args, opts):
+        super().process_options(args, opts)
+        try:
+            opts.spargs = arglist_to_dict(opts.spargs)
+        except ValueError:
+            raise UsageError("Invalid -a value, use -a NAME=VALUE", print_help=False)
+        if opts.workers < 1:
+            raise UsageError("--workers must be at least 1", print_help=False)
+
+    def run(self, args, opts):
+        if len(args) != 1:
+            raise UsageError()
+        if not opts.output:
+            raise UsageError("Give the merged output file with -o FILE", print_help=False)
+        spider_name = args[0]
+        outputs = dict(parse_output(value) for value in opts.output)
+        try:
+            spider_class = self.crawler_process.spider_loader.load(spider_name)
+        except KeyError:
+            raise UsageError("Unknown spider: %s" % spider_name, print_help=False)
+        # Only a spider that takes its pages from the work queue can be a worker
+        # (books_items); any other would crawl the whole catalogue in every process
+        if not hasattr(spider_class, 'claim_requests'):
+            raise UsageError("Spider %s cannot be sharded, it does not take its pages from the work "
+                             "queue (try books_items)" % spider_name, print_help=False)
+        if 'start_url' not in opts.spargs and not hasattr(spider_class, 'start_url'):
+            raise UsageError("Spider %s has no start_url, give one with -a start_url=URL" % spider_name,
+                             print_help=False)
+        directory = os.path.abspath(opts.dir)
+        os.makedirs(directory, exist_ok=True)
+
+        # A fresh queue with only the first page in it
+        settings = self.settings.copy()
+        queue = settings.get('EBOOK_SHARD_QUEUE') or os.path.join(directory, 'queue.sqlite')
+        if '://' not in queue:
+            # The workers run in other directories
+            queue = os.path.abspath(queue)
+        settings.set('EBOOK_SHARD_QUEUE', queue, priority='cmdline')
+        queue_class = load_object(settings.get('EBOOK_SHARD_QUEUE_CLASS', 'ebook_scraper.workqueue.SQLiteWorkQueue'))
+        work_queue = queue_class.from_settings(settings)
+        work_queue.purge()
+        start_url = opts.spargs.get('start_url', spider_class.start_url)
+        work_queue.put([{'url': start_url, 'kind': 'page', 'page': 1}])
+
+        started = time.perf_counter()
+        workers = [self.start_worker(spider_name, number, queue, directory, opts)
+                   for number in range(opts.workers)]
+        failed = [number for number, (process, log) in enumerate(workers) if process.wait() != 0]
+        for process, log in workers:
+            log.close()
+        crawl_seconds = time.perf_counter() - started
+
+        counts = work_queue.counts()
+        work_queue.close()
+        shards = [os.path.join(directory, 'worker-%d' % number, SHARD_FILE) for number in range(opts.workers)]
+        shards = [path for path in shards if os.path.exists(path)]
+        written, duplicates = merge_shards(shards, outputs, settings.getlist('EXPORT_FIELDS') or None)
+
+        print('Crawled %d tasks with %d workers in %.1fs (%d failed), merged %d items '
+              '(%d duplicates dropped) into %s' % (
+                  counts['done'], opts.workers, crawl_seconds, counts['failed'], written, duplicates,
+                  ', '.join(outputs)))
+        if failed:
+            print('Workers %s exited with an error, see %s/worker-<n>/crawl.log' % (failed, directory))
+            self.exitcode = 1
+
+    def start_worker(self, spider_name, number, queue, directory, opts):
+        workdir = os.path.join(directory, 'worker-%d' % number)
+        os.makedirs(workdir, exist_ok=True)
+        command = [sys.executable, '-m', 'scrapy', 'crawl', spider_name,
+                   '-s', 'EBOOK_SHARD_QUEUE=%s' % queue,
+                   '-s', 'EBOOK_SHARD_WORKER=%d' % number]
+        for name, value in opts.spargs.items():
+            command += ['-a', '%s=%s' % (name, value)]
+        for value in opts.set:
+            if not value.startswith('EBOOK_SHARD_QUEUE='):
+                command += ['-s', value]
+
+        # The worker runs in its own directory, so every file the pipelines write
+        # is a shard of its own; the project is found through the environment
+        project_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        environment = dict(os.environ,
+                           PYTHONPATH=os.pathsep.join(filter(None, [project_dir, os.environ.get('PYTHONPATH')])))
+        log = open(os.path.join(workdir, 'crawl.log'), 'w')
+        process = subprocess.Popen(command, cwd=workdir, env=environment, stdout=log, stderr=subprocess.STDOUT)
+        return process, log
@@ -0,0 +1,101 @@
+# A request duplicates filter that remembers fingerprints in a Bloom filter.
+#
+# Scrapy's RFPDupeFilter keeps every request fingerprint as a 40 character hex
+# string in a Python set, roughly 100 bytes per request. A Bloom filter sized for
+# the expected number of requests needs about 3.6 bytes per request at a one in
+# a million false positive rate, and its size is fixed up front, so it does not
+# grow with the crawl. The price is that a false positive drops a request that
+# was never seen, which at that rate means a handful of books in millions.
+#
+# Enable with DUPEFILTER_CLASS = "ebook_scraper.dupefilters.BloomDupeFilter".
+# With a JOBDIR the filter is saved to <JOBDIR>/requests.bloom when the crawl
+# closes and loaded again when it resumes.
+
+import math
+import os
+
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+
+
+class BloomFilter:
+    '''
+    A fixed size bit array with k bit positions per key.
+
+    The keys are request fingerprints, which are already uniformly distributed
+    SHA1 digests, so the positions are derived from the digest itself (double
+    hashing) instead of hashing every key k more times.
+    '''
+
+    def __init__(self, capacity, error_rate):
+        # Optimal number of bits and hash positions for capacity keys
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key):
+        first = int.from_bytes(key[:8], 'little')
+        second = int.from_bytes(key[8:16], 'little') | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        # Adds key and tells whether it was (probably) there already
+        seen = True
+        array = self.array
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not array[byte] & (1 << bit):
+                seen = False
+                array[byte] |= 1 << bit
+        return seen
+
+    def load(self, path):
+        # Only a file written for the same size can be reused
+        if os.path.exists(path) and os.path.getsize(path) == len(self.array):
+            with open(path, 'rb') as f:
+                f.readinto(self.array)
+            return True
+        return False
+
+    def save(self, path):
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(self.array)
+        os.replace(temporary, path)
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    '''
+    RFPDupeFilter with the set of hex fingerprints replaced by a BloomFilter.
+
+    DUPEFILTER_BLOOM_CAPACITY is the number of requests the crawl is expected
+    to make and DUPEFILTER_BLOOM_ERROR_RATE the accepted chance of dropping a
+    new request once that many have been seen.
+    '''
+
+    def __init__(self, path=None, debug=False, *, fingerprinter=None,
+                 capacity=1000000, error_rate=0.000001):
+        # The parent must not open requests.seen, the fingerprints go into the filter
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.path = os.path.join(path, 'requests.bloom') if path else None
+        if self.path and not self.bloom.load(self.path):
+            self.logger.info('Starting a new Bloom filter at %s', self.path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            job_dir(settings),
+            settings.getbool('DUPEFILTER_DEBUG'),
+            fingerprinter=crawler.request_fingerprinter,
+            capacity=settings.getint('DUPEFILTER_BLOOM_CAPACITY', 1000000),
+            error_rate=settings.getfloat('DUPEFILTER_BLOOM_ERROR_RATE', 0.000001),
+        )
+
+    def request_seen(self, request):
+        return self.bloom.add(self.fingerprinter.fingerprint(request))
+
+    def close(self, reason):
+        if self.path:
+            self.bloom.save(self.path)
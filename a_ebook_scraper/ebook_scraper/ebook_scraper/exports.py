@@ -0,0 +1,159 @@
+# Output formats of MultiFormatExportPipeline (pipelines.py).
+#
+# Scrapy's feed exporters each wrap every item in an ItemAdapter, look up and
+# serialize every field on their own, so writing the same items as JSON, CSV
+# and XML does that work three times. Here the pipeline turns each item into a
+# plain tuple once (normalize_row), and every writer only formats that tuple.
+# Writers collect their output in memory and hand it to the file (optionally
+# through gzip or zstd) in chunks of EXPORT_BUFFER_SIZE bytes.
+
+import csv
+import gzip
+import io
+import json
+from xml.sax.saxutils import escape
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+BASE_FIELDS = ('title', 'rating', 'price', 'stock_status', 'url')
+DETAIL_FIELDS = ('upc', 'description', 'category', 'stock_count')
+
+
+def normalize_row(item, fields):
+    # The one place an item is read: a tuple of its values in field order
+    get = item.get
+    return tuple([get(field) for field in fields])
+
+
+def open_output(path, compression=None, level=None):
+    # A binary file, compressed on the fly when asked for
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=level or 6)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compression of %s needs the zstandard package' % path)
+        return zstandard.ZstdCompressor(level=level or 3).stream_writer(open(path, 'wb'))
+    return open(path, 'wb')
+
+
+class RowWriter:
+    '''
+    Base class of the text formats: buffers text and writes it out in chunks.
+    '''
+
+    def __init__(self, path, fields, compression=None, level=None, buffer_size=1024 * 1024):
+        self.file = open_output(path, compression, level)
+        self.fields = fields
+        self.buffer_size = buffer_size
+        self.chunks = []
+        self.buffered = 0
+
+    def write_text(self, text):
+        self.chunks.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.file.write(''.join(self.chunks).encode('utf-8'))
+            self.chunks = []
+            self.buffered = 0
+
+    def start(self):
+        pass
+
+    def write(self, row):
+        raise NotImplementedError
+
+    def finish(self):
+        self.flush()
+        self.file.close()
+
+
+class JsonLinesWriter(RowWriter):
+    def start(self):
+        self.encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def write(self, row):
+        self.write_text(self.encode(dict(zip(self.fields, row))) + '\n')
+
+
+class JsonWriter(JsonLinesWriter):
+    # One JSON array, laid out like Scrapy's JsonItemExporter (one item per line)
+    def start(self):
+        super().start()
+        self.separator = '\n'
+        self.write_text('[')
+
+    def write(self, row):
+        self.write_text(self.separator + self.encode(dict(zip(self.fields, row))))
+        self.separator = ',\n'
+
+    def finish(self):
+        self.write_text('\n]')
+        super().finish()
+
+
+class CsvWriter(RowWriter):
+    def start(self):
+        # csv.writer formats into a StringIO that is emptied after every row
+        self.text = io.StringIO()
+        self.writer = csv.writer(self.text, lineterminator='\r\n')
+        self.writer.writerow(self.fields)
+        self._take()
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self._take()
+
+    def _take(self):
+        self.write_text(self.text.getvalue())
+        self.text.seek(0)
+        self.text.truncate()
+
+
+class XmlWriter(RowWriter):
+    def start(self):
+        self.write_text('<?xml version="1.0" encoding="utf-8"?>\n<items>\n')
+        self.template = '<item>%s</item>\n' % ''.join('<%s>%%s</%s>' % (field, field) for field in self.fields)
+
+    def write(self, row):
+        self.write_text(self.template % tuple(['' if value is None else escape(str(value)) for value in row]))
+
+    def finish(self):
+        self.write_text('</items>\n')
+        super().finish()
+
+
+class XlsxWriter:
+    # Write-only workbook like ExcelAppendPipeline; xlsx is compressed already
+    def __init__(self, path, fields, compression=None, level=None, buffer_size=None):
+        self.path = path
+        self.fields = fields
+
+    def start(self):
+        # Imported here, so exports without an xlsx output never load openpyxl
+        import openpyxl
+
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title='Scraped Data')
+        self.sheet.append([field.replace('_', ' ').title() for field in self.fields])
+
+    def write(self, row):
+        self.sheet.append(row)
+
+    def finish(self):
+        self.workbook.save(self.path)
+
+
+WRITERS = {
+    'json': JsonWriter,
+    'jsonlines': JsonLinesWriter,
+    'csv': CsvWriter,
+    'xml': XmlWriter,
+    'xlsx': XlsxWriter,
+}
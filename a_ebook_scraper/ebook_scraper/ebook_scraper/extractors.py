@@ -0,0 +1,310 @@
+# Shared extraction of the book cards found on books.toscrape.com catalogue pages.
+#
+# The spiders used to run 5-6 separate css()/xpath() queries per
+# article.product_pod, and parsel translates and evaluates each of them against
+# the card again. Here the card lookup is compiled once at import time and every
+# card is read in a single walk over its <h3> and <p> elements.
+#
+# When the markup changes, the walk comes back with a missing or malformed
+# title, rating or price (or a detail page without UPC or category). Only then
+# are the fallback chains below tried, one selector after the other, and what
+# happened is counted in a `drift` dict ({'rating/recovered': 3, ...}) that
+# DriftMiddleware (resilience.py) turns into stats and quarantined pages.
+
+import re
+
+import lxml.html
+from lxml import etree
+
+# Compiled once: every article whose class list contains "product_pod"
+PRODUCT_PODS = etree.XPath(
+    '//article[contains(concat(" ", normalize-space(@class), " "), " product_pod ")]'
+)
+
+# The pager at the bottom of each catalogue page reads "Page 1 of 50"
+CURRENT_PAGE = etree.XPath('//ul[contains(@class, "pager")]/li[contains(@class, "current")]')
+PAGE_OF = re.compile(r'Page\s+(\d+)\s+of\s+(\d+)')
+
+# Book detail pages (catalogue/<slug>/index.html): the "Product Information"
+# table, the paragraph after the "Product Description" header and the breadcrumb
+# (Home > Books > <category> > <title>)
+PRODUCT_INFORMATION = etree.XPath('//table[contains(@class, "table-striped")]//tr')
+DESCRIPTION = etree.XPath('//div[@id="product_description"]/following-sibling::p[1]')
+CATEGORY = etree.XPath('//ul[contains(@class, "breadcrumb")]/li[3]/a')
+AVAILABLE = re.compile(r'\((\d+)\s+available\)')
+
+# The keys of items.RATINGS; this module stays free of Scrapy imports so the
+# parse pool's worker processes start quickly
+RATING_WORDS = ('One', 'Two', 'Three', 'Four', 'Five')
+VALID_RATINGS = frozenset(RATING_WORDS)
+# A pound price anywhere in a text
+PRICE_IN_TEXT = re.compile(r'£\s*(\d+(?:\.\d+)?)')
+WORD = re.compile(r'[A-Za-z]+|\d+')
+
+
+def _texts(values):
+    # XPath results (a list of strings or one string) as stripped, non-empty strings
+    if isinstance(values, str):
+        values = [values]
+    return [text for text in (str(value).strip() for value in values) if text]
+
+
+def first_text(values):
+    texts = _texts(values)
+    return texts[0] if texts else None
+
+
+def rating_word(values):
+    # 'Three' from 'star-rating Three', 'rating-three', '3', ...
+    for text in _texts(values):
+        for word in WORD.findall(text):
+            if word.isdigit():
+                if 1 <= int(word) <= 5:
+                    return RATING_WORDS[int(word) - 1]
+            elif word.capitalize() in RATING_WORDS:
+                return word.capitalize()
+    return None
+
+
+def price_text(values):
+    # '£51.77' from the first text holding a pound price
+    for text in _texts(values):
+        match = PRICE_IN_TEXT.search(text)
+        if match:
+            return '£' + match.group(1)
+    return None
+
+
+# Per field: how to read a value out of what the selectors return, and the
+# selectors to try in order once the primary extraction failed. Relative to the
+# product_pod <article> for book cards, to the page for detail pages
+CARD_FALLBACKS = {
+    'title': (first_text, [
+        etree.XPath('.//h3//a/@title'),
+        etree.XPath('.//a[@title]/@title'),
+        etree.XPath('.//img/@alt'),
+        # The visible link text, shortened with '...' for long titles
+        etree.XPath('.//h3//text()'),
+    ]),
+    'rating': (rating_word, [
+        etree.XPath('.//*[contains(@class, "star-rating")]/@class'),
+        etree.XPath('.//*[contains(@class, "rating")]/@class'),
+        etree.XPath('.//*[@data-rating]/@data-rating'),
+        etree.XPath('.//*[contains(@class, "rating")]//text()'),
+    ]),
+    'price': (price_text, [
+        etree.XPath('.//*[contains(@class, "price_color")]//text()'),
+        etree.XPath('.//*[contains(@class, "price")]//text()'),
+        etree.XPath('.//text()'),
+    ]),
+}
+DETAIL_FALLBACKS = {
+    'upc': (first_text, [
+        etree.XPath('//th[normalize-space() = "UPC"]/following-sibling::td[1]//text()'),
+        etree.XPath('//*[normalize-space() = "UPC"]/following-sibling::*[1]//text()'),
+    ]),
+    'category': (first_text, [
+        etree.XPath('//*[contains(@class, "breadcrumb")]/li[last() - 1]//text()'),
+    ]),
+}
+
+
+def count(drift, key):
+    if drift is not None:
+        drift[key] = drift.get(key, 0) + 1
+
+
+def repair(node, record, fields, fallbacks, drift=None):
+    '''
+    Fills the given fields of record from their fallback chains.
+
+    Counts '<field>/recovered' or, when no selector found a value either,
+    '<field>/missing' in drift. A field that stays missing is set to None, so a
+    malformed value never reaches the item processors.
+    '''
+    for field in fields:
+        parse, selectors = fallbacks[field]
+        value = None
+        for selector in selectors:
+            value = parse(selector(node))
+            if value is not None:
+                break
+        record[field] = value
+        count(drift, field + ('/missing' if value is None else '/recovered'))
+    return record
+
+
+def valid_price(price):
+    # What the spiders yield as price ('£51.77'), checked with string methods
+    # because a regular expression costs more here than the whole rest of the check
+    return price is not None and price.strip().lstrip('£').replace('.', '', 1).isdigit()
+
+
+def card_is_valid(book):
+    # The only check a healthy card pays for
+    return bool(book['title']) and book['rating'] in VALID_RATINGS and valid_price(book['price'])
+
+
+def broken_card_fields(book):
+    # The card fields the primary extraction did not get right
+    fields = []
+    if not book['title']:
+        fields.append('title')
+    if book['rating'] not in VALID_RATINGS:
+        fields.append('rating')
+    if not valid_price(book['price']):
+        fields.append('price')
+    return fields
+
+
+def _text(element):
+    # Same as the ::text / text() selectors: only the element's own text nodes
+    return (element.text or '') + ''.join(child.tail or '' for child in element)
+
+
+def extract_book(card, links=False):
+    '''
+    Reads title, rating, price and stock status from one product_pod <article>.
+
+    The values are returned exactly as the spiders used to yield them, e.g.
+    {'title': 'A Light in the Attic', 'rating': 'Three', 'price': '£51.77',
+     'stock_status': 'In stock'}.
+    With links=True the record also holds the (relative) 'url' of the book's
+    detail page, taken from the same h3>a link as the title: the key of the
+    book from run to run (ebook_scraper.incremental.book_key).
+    '''
+    title = rating = price = url = None
+    stock_status = 'Not In Stock'
+    seen_stock = False
+
+    for element in card.iter('h3', 'p'):
+        if element.tag == 'h3':
+            if title is None:
+                for link in element.iterchildren('a'):
+                    title = link.get('title')
+                    url = link.get('href')
+                    break
+            continue
+
+        classes = (element.get('class') or '').split()
+        if 'star-rating' in classes:
+            if rating is None and len(classes) > 1:
+                rating = classes[1]
+        elif 'price_color' in classes:
+            if price is None and 'product_price' in (element.getparent().get('class') or '').split():
+                price = _text(element)
+        elif 'instock' in classes and 'availability' in classes and not seen_stock:
+            seen_stock = True
+            # The <i class="icon-ok"> marker tells us the book is in stock
+            for icon in element.iterchildren('i'):
+                if icon.get('class') == 'icon-ok':
+                    stock_status = _text(element).strip()
+                break
+
+    book = {
+        'title': title,
+        'rating': rating,
+        'price': price,
+        'stock_status': stock_status,
+    }
+    if links:
+        book['url'] = url
+    return book
+
+
+def extract_books(root, links=False, drift=None):
+    '''
+    Returns the records of every book card below an lxml root element.
+
+    Cards the primary extraction got wrong go through the fallback chains,
+    counted in drift; a page without any card counts as 'no_books'.
+    '''
+    books = []
+    for card in PRODUCT_PODS(root):
+        book = extract_book(card, links)
+        if not card_is_valid(book):
+            book = repair(card, book, broken_card_fields(book), CARD_FALLBACKS, drift)
+        books.append(book)
+    if not books:
+        count(drift, 'no_books')
+    return books
+
+
+def note_drift(response, drift):
+    # Hands the counts of a page to DriftMiddleware through the request's meta
+    if drift and response.request is not None:
+        counts = response.meta.setdefault('drift', {})
+        for key, value in drift.items():
+            counts[key] = counts.get(key, 0) + value
+
+
+def extract_books_from_response(response, links=False):
+    # response.selector.root is the lxml tree parsel has already built
+    drift = {}
+    books = extract_books(response.selector.root, links, drift)
+    note_drift(response, drift)
+    return books
+
+
+def extract_books_from_html(html, links=False, drift=None):
+    # For raw page bodies (str or bytes) that do not come wrapped in a Response
+    return extract_books(lxml.html.fromstring(html), links, drift)
+
+
+def extract_books_and_drift(html, links=False):
+    # What the parse pool's workers run: the records and the drift counts of a page
+    drift = {}
+    return extract_books_from_html(html, links, drift), drift
+
+
+def extract_page_count(response):
+    # Total number of catalogue pages from the pager, or None if there is no pager
+    for current in CURRENT_PAGE(response.selector.root):
+        match = PAGE_OF.search(current.text_content())
+        if match:
+            return int(match.group(2))
+    return None
+
+
+def extract_book_details(response):
+    '''
+    Reads UPC, description, category and stock count from a book detail page.
+
+    e.g. {'upc': 'a897fe39b1053632', 'description': "It's hard to imagine ...",
+    'category': 'Poetry', 'stock_count': '22'}. Missing values are None.
+    '''
+    drift = {}
+    details = extract_details(response.selector.root, drift)
+    note_drift(response, drift)
+    return details
+
+
+def extract_details(root, drift=None):
+    # extract_book_details() for an lxml root element
+    information = {}
+    for row in PRODUCT_INFORMATION(root):
+        header = row.find('th')
+        value = row.find('td')
+        if header is not None and value is not None:
+            information[_text(header).strip()] = _text(value).strip()
+
+    description = None
+    for paragraph in DESCRIPTION(root):
+        description = paragraph.text_content()
+
+    category = None
+    for link in CATEGORY(root):
+        category = _text(link)
+
+    # "In stock (22 available)"
+    match = AVAILABLE.search(information.get('Availability', ''))
+    details = {
+        'upc': information.get('UPC'),
+        'description': description,
+        'category': category,
+        'stock_count': match.group(1) if match else None,
+    }
+    broken = [field for field in DETAIL_FALLBACKS if not details[field]]
+    if broken:
+        repair(root, details, broken, DETAIL_FALLBACKS, drift)
+    return details
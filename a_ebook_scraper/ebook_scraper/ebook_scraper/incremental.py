@@ -0,0 +1,146 @@
+# On-disk index that lets repeated crawls skip what has not changed since the last run.
+#
+# It is a small SQLite database with two tables:
+#   pages: page URL -> ETag / Last-Modified / content hash (+ the compressed body)
+#   books: book key -> fingerprint of the last seen price, rating and stock status
+#
+# IncrementalDownloaderMiddleware (middlewares.py) uses the pages table for
+# conditional requests, IncrementalItemPipeline (pipelines.py) the books table
+# to drop items that are the same as in the previous run. Both share a single
+# connection through crawl_index(), so they never lock each other out.
+#
+# Most books of a re-run are unchanged, and Scrapy logs every dropped item as a
+# WARNING. With LOG_FORMATTER = "ebook_scraper.incremental.IncrementalLogFormatter"
+# those drops are logged at DEBUG instead; they are still counted in the stats.
+
+import hashlib
+import logging
+import sqlite3
+import zlib
+
+from scrapy import signals
+from scrapy.exceptions import DropItem
+from scrapy.logformatter import LogFormatter
+
+from ebook_scraper.items import price_to_float, rating_to_int
+
+
+def content_hash(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def book_key(item):
+    # The UPC when the details were scraped. The listing cards carry no id, but
+    # every book has a detail page of its own, while two books may share a
+    # title; the title is only left for items from before the URL was kept
+    return item.get('upc') or item.get('url') or item.get('title')
+
+
+def book_fingerprint(item):
+    # Normalised, so '£51.77' from the plain spiders matches 51.77 from EbookItem
+    return '%s|%s|%s' % (price_to_float(item.get('price')),
+                         rating_to_int(item.get('rating')),
+                         item.get('stock_status'))
+
+
+def crawl_index(crawler):
+    # The CrawlIndex of a crawler, opened by the first component asking for it
+    index = getattr(crawler, 'crawl_index', None)
+    if index is None:
+        index = crawler.crawl_index = CrawlIndex(
+            crawler.settings.get('INCREMENTAL_INDEX', 'crawl_index.sqlite')
+        )
+        # spider_closed fires after all pipelines have been closed
+        crawler.signals.connect(index.close, signal=signals.spider_closed)
+    return index
+
+
+class UnchangedItem(DropItem):
+    '''
+    Raised by IncrementalItemPipeline for a book that is the same as in the previous run.
+    '''
+
+
+class IncrementalLogFormatter(LogFormatter):
+    # Unchanged books are the normal case of a re-run, not worth a warning each
+    def dropped(self, item, exception, response, spider):
+        entry = super().dropped(item, exception, response, spider)
+        if isinstance(exception, UnchangedItem):
+            entry['level'] = logging.DEBUG
+        return entry
+
+
+class CrawlIndex:
+    # Commit the pages table to disk after this many changed pages
+    COMMIT_EVERY = 100
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, body BLOB)'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS books (key TEXT PRIMARY KEY, fingerprint TEXT)'
+        )
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def page(self, url):
+        # (etag, last_modified, content_hash) of a page, or None if never seen
+        return self.connection.execute(
+            'SELECT etag, last_modified, content_hash FROM pages WHERE url = ?', (url,)
+        ).fetchone()
+
+    def page_body(self, url):
+        row = self.connection.execute('SELECT body FROM pages WHERE url = ?', (url,)).fetchone()
+        return zlib.decompress(row[0]) if row and row[0] is not None else None
+
+    def save_page(self, url, etag, last_modified, digest, body, known=None):
+        '''
+        Stores what a download of a page returned.
+
+        known is what page(url) returned before the download. An unchanged body
+        is not compressed and stored again, only new validators are written.
+        '''
+        if known is not None and known[2] == digest:
+            if (etag, last_modified) == tuple(known[:2]):
+                return
+            self.connection.execute(
+                'UPDATE pages SET etag = ?, last_modified = ? WHERE url = ?', (etag, last_modified, url)
+            )
+        else:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO pages (url, etag, last_modified, content_hash, body) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (url, etag, last_modified, digest, zlib.compress(body)),
+            )
+        # A page lost in a crash is only downloaded in full once more
+        self.uncommitted += 1
+        if self.uncommitted >= self.COMMIT_EVERY:
+            self.commit()
+
+    def book_changed(self, key, fingerprint):
+        '''
+        Records the fingerprint of a book and tells whether it is new or changed.
+
+        Returns 'new', 'changed' or None when the book is the same as last time.
+        '''
+        row = self.connection.execute(
+            'SELECT fingerprint FROM books WHERE key = ?', (key,)
+        ).fetchone()
+        if row is not None and row[0] == fingerprint:
+            return None
+        self.connection.execute(
+            'INSERT OR REPLACE INTO books (key, fingerprint) VALUES (?, ?)', (key, fingerprint)
+        )
+        return 'new' if row is None else 'changed'
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self, **kwargs):
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,129 @@
+# Building blocks for the hot-path instrumentation of EbookScraperSpiderMiddleware
+# (middlewares.py): latency histograms and an opt-in sampling profiler.
+
+import collections
+import random
+import sys
+import threading
+import time
+
+
+class Histogram:
+    '''
+    Keeps a bounded, uniformly random sample of the recorded values.
+
+    Percentiles are computed from the sample (reservoir sampling), so memory
+    stays constant no matter how many values are recorded.
+    '''
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.samples = []
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.size:
+                self.samples[slot] = value
+
+    def percentiles(self, points=(50, 95, 99)):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {}
+        return {p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+
+    def summary(self, scale=1.0, digits=3):
+        # count, mean and p50/p95/p99 of the values, multiplied by scale (e.g. 1000 for ms)
+        if not self.count:
+            return {'count': 0}
+        result = {'count': self.count, 'mean': round(self.total / self.count * scale, digits)}
+        for point, value in self.percentiles().items():
+            result['p%d' % point] = round(value * scale, digits)
+        return result
+
+
+class SamplingProfiler:
+    '''
+    Samples the stack of one thread at a fixed interval from a background thread.
+
+    Counts how often each function is on top of the stack (self time) and
+    anywhere on it (total time). This is cheap enough to leave on under load,
+    unlike cProfile, which slows every single function call.
+    '''
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.own = collections.Counter()
+        self.total = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.own[self._label(frame)] += 1
+            seen = set()
+            while frame is not None:
+                label = self._label(frame)
+                if label not in seen:
+                    seen.add(label)
+                    self.total[label] += 1
+                frame = frame.f_back
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return '%s:%d(%s)' % (code.co_filename, code.co_firstlineno, code.co_name)
+
+    def report(self, top=25):
+        # The functions with most self time, with their share of all samples
+        samples = self.samples or 1
+        return [
+            {'function': label,
+             'self_pct': round(100.0 * count / samples, 2),
+             'total_pct': round(100.0 * self.total[label] / samples, 2)}
+            for label, count in self.own.most_common(top)
+        ]
+
+
+def timed(function, histogram):
+    '''
+    Wraps function so every call records its duration in histogram.
+
+    When the function returns a Deferred (e.g. an asynchronous pipeline), the
+    time until the Deferred fires is recorded instead.
+    '''
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            # e.g. DropItem, which still took time to decide
+            histogram.record(time.perf_counter() - start)
+            raise
+        if hasattr(result, 'addBoth'):
+            def done(value):
+                histogram.record(time.perf_counter() - start)
+                return value
+            return result.addBoth(done)
+        histogram.record(time.perf_counter() - start)
+        return result
+    return wrapper
@@ -13,6 +13,8 @@
 #     stock_status = Field()  # To store the stock availability
 
 # items.py
+from dataclasses import dataclass
+
 import scrapy
 from itemloaders.processors import MapCompose
 
@@ -23,7 +25,7 @@ class EbookItem(scrapy.Item):
         # output_processor = TakeFirst()
     )
     rating = scrapy.Field(
-        input_processor=MapCompose(lambda x: x.split(' ')[1]),  # Extract rating from class attribute
+        input_processor=MapCompose(lambda x: x.split(' ')[-1]),  # Extract rating from class attribute (or take the bare word)
         # output_processor = TakeFirst()
     )
     price = scrapy.Field(
@@ -34,4 +36,104 @@ class EbookItem(scrapy.Item):
     stock_status = scrapy.Field(
         input_processor = MapCompose(lambda x: ''.join(x).strip()),
         # output_processor = TakeFirst()
-    )
\ No newline at end of file
+    )
+    # The book's detail page. Titles are not unique, so this is what tells two
+    # books apart from run to run (see ebook_scraper.incremental.book_key)
+    url = scrapy.Field()
+
+
+class EbookDetailItem(EbookItem):
+    # The listing fields plus the book's detail page, yielded by the books_items
+    # spider with EBOOK_ENRICH_DETAILS (see ebook_scraper.extractors.extract_book_details).
+    # A class of its own, so the exports of listing crawls keep their four columns
+    upc = scrapy.Field(
+        input_processor=MapCompose(lambda x: x.strip()),
+    )
+    description = scrapy.Field(
+        input_processor=MapCompose(lambda x: x.strip()),
+    )
+    category = scrapy.Field(
+        input_processor=MapCompose(lambda x: x.strip()),
+    )
+    stock_count = scrapy.Field(
+        input_processor=MapCompose(lambda x: int(x)),  # '22' from "In stock (22 available)"
+    )
+
+
+@dataclass(slots=True)
+class EbookRecord:
+    '''
+    A compact alternative to EbookItem for spiders that skip the ItemLoader.
+
+    It holds the same fields with the same cleaned-up values, but as a slotted
+    dataclass it needs no per-item loader, processor chain or field dict. The
+    feed exporters understand dataclass items, and get() keeps it usable by the
+    pipelines that read items like dictionaries.
+    '''
+    title: str = None
+    rating: str = None
+    price: float = None
+    stock_status: str = None
+    url: str = None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+@dataclass(slots=True)
+class EbookDetailRecord(EbookRecord):
+    '''
+    EbookRecord with the detail page fields, the fast path's EbookDetailItem.
+    '''
+    upc: str = None
+    description: str = None
+    category: str = None
+    stock_count: int = None
+
+
+# Removes the currency symbol in one C-level call instead of replace() + strip()
+_PRICE_SYMBOLS = str.maketrans('', '', '£')
+
+
+def normalize_book(book):
+    '''
+    Cleans one raw record from ebook_scraper.extractors into an EbookRecord.
+
+    Does the same as the input processors of EbookItem: strips the title, takes
+    the rating word from the class attribute and turns '£51.77' into 51.77.
+    Records merged with their detail page become an EbookDetailRecord.
+    '''
+    title = book['title']
+    rating = book['rating']
+    price = book['price']
+    stock_status = book['stock_status']
+    values = (
+        title.strip() if title is not None else None,
+        rating.rpartition(' ')[2] if rating is not None else None,
+        float(price.translate(_PRICE_SYMBOLS)) if price is not None else None,
+        stock_status.strip() if stock_status is not None else None,
+        book.get('url'),
+    )
+    if 'upc' not in book:
+        return EbookRecord(*values)
+    stock_count = book['stock_count']
+    return EbookDetailRecord(*values, book['upc'], book['description'], book['category'],
+                             int(stock_count) if stock_count is not None else None)
+
+
+# Star ratings are spelled out in the markup (e.g. class="star-rating Three")
+RATINGS = {'One': 1, 'Two': 2, 'Three': 3, 'Four': 4, 'Five': 5}
+
+
+def price_to_float(value):
+    # The plain spiders yield '£51.77' while EbookItem already holds 51.77
+    if value is None or isinstance(value, float):
+        return value
+    return float(str(value).replace('£', '').strip())
+
+
+def rating_to_int(value):
+    # Accepts the word ('Three') as well as an already converted number
+    if value is None or isinstance(value, int):
+        return value
+    return RATINGS.get(value)
@@ -3,22 +3,67 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import collections
+import json
+import threading
+import time
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.extensions.feedexport import FeedExporter
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from twisted.internet import task
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from ebook_scraper.incremental import content_hash, crawl_index
+from ebook_scraper.instrumentation import Histogram, SamplingProfiler, timed
+from ebook_scraper.responsecache import PackCache
+
 
 class EbookScraperSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    '''
+    Instruments the hot path of a crawl so its bottleneck can be found.
+
+    Records, as latency histograms (count, mean, p50/p95/p99 in ms):
+      - the time spent inside each spider callback,
+      - the number of items every response produced,
+      - the process_item() latency of every enabled item pipeline,
+      - the time the feed exports spend writing each item,
+    and samples the depth of the scheduler, downloader and scraper queues every
+    INSTRUMENTATION_INTERVAL seconds. Everything ends up in the crawl stats
+    under instrumentation/*. With INSTRUMENTATION_DUMP_FILE set, a snapshot is
+    also appended as one JSON line per interval. INSTRUMENTATION_PROFILE turns
+    on a sampling profiler for the reactor thread.
+    '''
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = crawler.settings.getfloat('INSTRUMENTATION_INTERVAL', 5.0)
+        self.dump_file = crawler.settings.get('INSTRUMENTATION_DUMP_FILE')
+        self.profile = crawler.settings.getbool('INSTRUMENTATION_PROFILE')
+        self.profile_interval = crawler.settings.getfloat('INSTRUMENTATION_PROFILE_INTERVAL', 0.005)
+
+        self.callbacks = collections.defaultdict(Histogram)
+        self.items_per_response = Histogram()
+        self.pipelines = collections.defaultdict(Histogram)
+        self.exports = Histogram()
+        self.queues = collections.defaultdict(Histogram)
+        self.profiler = None
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        if not crawler.settings.getbool('INSTRUMENTATION_ENABLED'):
+            raise NotConfigured
+        s = cls(crawler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        s.time_feed_exports()
         return s
 
     def process_spider_input(self, response, spider):
@@ -30,18 +75,58 @@ class EbookScraperSpiderMiddleware:
 
     def process_spider_output(self, response, result, spider):
         # Called with the results returned from the Spider, after
-        # it has processed the response.
+        # it has processed the response. The callback is a generator,
+        # so its time is the time spent waiting for each next result.
+        callback = response.request.callback if response.request else None
+        histogram = self.callbacks[getattr(callback, '__name__', 'parse')]
+        elapsed = 0.0
+        items = 0
+
+        results = iter(result)
+        while True:
+            start = time.perf_counter()
+            try:
+                i = next(results)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            if is_item(i):
+                items += 1
+            yield i
+
+        histogram.record(elapsed)
+        self.items_per_response.record(items)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # The same for asynchronous callbacks (e.g. parse_in_pool of books_items),
+        # where the time also includes waiting for the worker processes
+        callback = response.request.callback if response.request else None
+        histogram = self.callbacks[getattr(callback, '__name__', 'parse')]
+        elapsed = 0.0
+        items = 0
 
-        # Must return an iterable of Request, or item objects.
-        for i in result:
+        results = result.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                i = await results.__anext__()
+            except StopAsyncIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            if is_item(i):
+                items += 1
             yield i
 
+        histogram.record(elapsed)
+        self.items_per_response.record(items)
+
     def process_spider_exception(self, response, exception, spider):
         # Called when a spider or process_spider_input() method
         # (from other spider middleware) raises an exception.
-
-        # Should return either None or an iterable of Request or item objects.
-        pass
+        self.stats.inc_value('instrumentation/callback_exceptions', spider=spider)
+        return None
 
     def process_start_requests(self, start_requests, spider):
         # Called with the start requests of the spider, and works
@@ -52,52 +137,249 @@ class EbookScraperSpiderMiddleware:
         for r in start_requests:
             yield r
 
+    def time_feed_exports(self):
+        # FeedExporter writes items from its item_scraped signal handler, so that
+        # handler is swapped for a timed one (the wrapper is kept alive on self,
+        # signal receivers are only weakly referenced)
+        self.feed_handlers = []
+        for extension in self.crawler.extensions.middlewares:
+            if not isinstance(extension, FeedExporter):
+                continue
+            handler = timed(extension.item_scraped, self.exports)
+
+            def item_scraped(item, spider, handler=handler):
+                return handler(item, spider)
+
+            self.crawler.signals.disconnect(extension.item_scraped, signal=signals.item_scraped)
+            self.crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+            self.feed_handlers.append(item_scraped)
+
+    def time_pipelines(self):
+        # The item pipeline manager keeps the (wrapped) process_item() methods of
+        # all enabled pipelines in a deque, in the same order as its list of
+        # pipelines. Each of them is replaced by a timed wrapper.
+        itemproc = self.crawler.engine.scraper.itemproc
+        pipelines = [pipe for pipe in itemproc.middlewares if hasattr(pipe, 'process_item')]
+        methods = itemproc.methods['process_item']
+        for position, (pipe, method) in enumerate(zip(pipelines, methods)):
+            methods[position] = timed(method, self.pipelines[type(pipe).__name__])
+
+    def sample_queues(self):
+        engine = self.crawler.engine
+        depths = {
+            'scheduler': len(engine.slot.scheduler) if engine.slot else 0,
+            'downloader_active': len(engine.downloader.active),
+            'scraper_queue': len(engine.scraper.slot.queue) if engine.scraper.slot else 0,
+            'scraper_active': len(engine.scraper.slot.active) if engine.scraper.slot else 0,
+            'items_in_pipelines': engine.scraper.slot.itemproc_size if engine.scraper.slot else 0,
+        }
+        for name, depth in depths.items():
+            self.queues[name].record(depth)
+        if self.dump_file:
+            self.dump(depths)
+
+    def summaries(self):
+        summary = {
+            'callback': {name: h.summary(1000) for name, h in self.callbacks.items()},
+            'items_per_response': self.items_per_response.summary(),
+            'pipeline': {name: h.summary(1000) for name, h in self.pipelines.items()},
+            'queue_depth': {name: h.summary() for name, h in self.queues.items()},
+        }
+        if self.feed_handlers:
+            summary['feed_export'] = self.exports.summary(1000)
+        return summary
+
+    def dump(self, depths):
+        with open(self.dump_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'time': time.time(), 'queues': depths, 'histograms': self.summaries()}) + '\n')
+
     def spider_opened(self, spider):
+        self.time_pipelines()
+        self.sampler = task.LoopingCall(self.sample_queues)
+        self.sampler.start(self.interval, now=False)
+        if self.profile:
+            self.profiler = SamplingProfiler(threading.get_ident(), self.profile_interval)
+            self.profiler.start()
         spider.logger.info("Spider opened: %s" % spider.name)
 
+    def spider_closed(self, spider):
+        if self.sampler.running:
+            self.sampler.stop()
+        for kind, values in self.summaries().items():
+            if kind in ('items_per_response', 'feed_export'):
+                self.stats.set_value('instrumentation/%s' % kind, values, spider=spider)
+                continue
+            for name, summary in values.items():
+                self.stats.set_value('instrumentation/%s/%s' % (kind, name), summary, spider=spider)
+
+        if self.profiler is not None:
+            self.profiler.stop()
+            report = self.profiler.report()
+            self.stats.set_value('instrumentation/profile_samples', self.profiler.samples, spider=spider)
+            self.stats.set_value('instrumentation/profile_top', report[:10], spider=spider)
+            if self.dump_file:
+                with open(self.dump_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'time': time.time(), 'profile': report}) + '\n')
+
 
 class EbookScraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    '''
+    Serves repeated requests from a compressed on-disk response cache.
+
+    Downloaded responses are stored in a PackCache (one append-only pack file
+    plus an index, see responsecache.py) under RESPONSE_CACHE_DIR. A request whose
+    response is cached is answered from disk without touching the network, so
+    re-runs and parse experiments during development replay at disk speed and
+    the project can be crawled offline. Entries expire after
+    RESPONSE_CACHE_MAX_AGE seconds (0 = never) and the least recently used ones
+    are evicted once the cache holds more than RESPONSE_CACHE_MAX_BYTES.
+
+    Hits, misses, the hit ratio and the bytes that did not have to be downloaded
+    are recorded under responsecache/* in the crawl stats.
+    '''
+
+    def __init__(self, settings, stats, fingerprinter):
+        self.settings = settings
+        self.stats = stats
+        self.fingerprinter = fingerprinter
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        if not crawler.settings.getbool('RESPONSE_CACHE_ENABLED'):
+            raise NotConfigured
+        s = cls(crawler.settings, crawler.stats, crawler.request_fingerprinter)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
     def process_request(self, request, spider):
         # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
-        return None
+        # middleware. Returning a Response skips the download.
+        if request.meta.get('dont_cache'):
+            return None
 
-    def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
+        cached = self.cache.get(self.fingerprinter.fingerprint(request).hex())
+        if cached is None:
+            self.stats.inc_value('responsecache/miss', spider=spider)
+            return None
 
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
-        return response
+        self.stats.inc_value('responsecache/hit', spider=spider)
+        self.stats.inc_value('responsecache/bytes_saved', len(cached['body']), spider=spider)
+        headers = Headers(cached['headers'])
+        response_class = responsetypes.from_args(headers=headers, url=cached['url'], body=cached['body'])
+        return response_class(
+            url=cached['url'],
+            status=cached['status'],
+            headers=headers,
+            body=cached['body'],
+            flags=['cached'],
+            request=request,
+        )
 
-    def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+    def process_response(self, request, response, spider):
+        # Called with the response returned from the downloader (or from
+        # process_request() above, which is flagged as 'cached').
+        if 'cached' in response.flags or request.meta.get('dont_cache'):
+            return response
+        if response.status not in self.cache_statuses:
+            return response
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+        stored = self.cache.put(self.fingerprinter.fingerprint(request).hex(), {
+            'url': response.url,
+            'status': response.status,
+            'headers': dict(response.headers),
+            'body': response.body,
+        })
+        self.stats.inc_value('responsecache/stored', spider=spider)
+        self.stats.inc_value('responsecache/stored_bytes', stored, spider=spider)
+        return response
 
     def spider_opened(self, spider):
+        self.cache = PackCache(
+            self.settings.get('RESPONSE_CACHE_DIR') or data_path('responsecache', createdir=True),
+            max_bytes=self.settings.getint('RESPONSE_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+            max_age=self.settings.getint('RESPONSE_CACHE_MAX_AGE', 0),
+            codec=self.settings.get('RESPONSE_CACHE_CODEC', 'gzip'),
+        )
+        self.cache_statuses = {int(status) for status in self.settings.getlist('RESPONSE_CACHE_STATUSES', [200])}
         spider.logger.info("Spider opened: %s" % spider.name)
+
+    def spider_closed(self, spider):
+        self.cache.close()
+        hits = self.stats.get_value('responsecache/hit', 0, spider=spider)
+        misses = self.stats.get_value('responsecache/miss', 0, spider=spider)
+        if hits + misses:
+            self.stats.set_value('responsecache/hit_ratio', round(hits / (hits + misses), 4), spider=spider)
+
+
+class IncrementalDownloaderMiddleware:
+    '''
+    Sends conditional requests and flags pages that did not change since the last run.
+
+    The ETag, Last-Modified header and content hash of every downloaded page are
+    kept in the CrawlIndex at INCREMENTAL_INDEX. The next run sends them back as
+    If-None-Match / If-Modified-Since. A 304 answer is turned into a normal 200
+    response with the body stored last time, so callbacks can still follow the
+    pagination, and response.meta['page_unchanged'] is set. The same flag is set
+    when a full download hashes to the stored content. Spiders skip extracting
+    books from flagged pages.
+    '''
+
+    def __init__(self, index, stats):
+        self.index = index
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('INCREMENTAL_ENABLED'):
+            raise NotConfigured
+        return cls(crawl_index(crawler), crawler.stats)
+
+    def process_request(self, request, spider):
+        known = self.index.page(request.url)
+        if known is not None and not request.meta.get('incremental_refetch'):
+            etag, last_modified, _ = known
+            if etag:
+                request.headers.setdefault('If-None-Match', etag)
+            if last_modified:
+                request.headers.setdefault('If-Modified-Since', last_modified)
+        return None
+
+    def process_response(self, request, response, spider):
+        if response.status == 304:
+            body = self.index.page_body(request.url)
+            if body is None:
+                # Nothing to replay (e.g. the index was pruned), fetch it again in full
+                refetch = request.replace(dont_filter=True)
+                refetch.headers.pop('If-None-Match', None)
+                refetch.headers.pop('If-Modified-Since', None)
+                refetch.meta['incremental_refetch'] = True
+                return refetch
+            self.stats.inc_value('incremental/pages_not_modified', spider=spider)
+            self.stats.inc_value('incremental/bytes_not_downloaded', len(body), spider=spider)
+            request.meta['page_unchanged'] = True
+            return response.replace(status=200, body=body, flags=response.flags + ['not_modified'])
+
+        if response.status != 200:
+            return response
+
+        digest = content_hash(response.body)
+        known = self.index.page(request.url)
+        if known is not None and known[2] == digest:
+            self.stats.inc_value('incremental/pages_unchanged', spider=spider)
+            request.meta['page_unchanged'] = True
+        else:
+            self.stats.inc_value('incremental/pages_changed', spider=spider)
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        self.index.save_page(
+            request.url,
+            etag.decode('latin-1') if etag else None,
+            last_modified.decode('latin-1') if last_modified else None,
+            digest,
+            response.body,
+            known,
+        )
+        return response
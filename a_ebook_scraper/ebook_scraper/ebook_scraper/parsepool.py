@@ -0,0 +1,42 @@
+# Process pool that runs the book extraction off the reactor thread.
+#
+# The project runs on the asyncio reactor, so a spider callback can await the
+# pool directly. Only the page text goes to a worker and only plain records
+# (lists of dicts) come back, which keeps the pickling cost small.
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from ebook_scraper.extractors import extract_books_and_drift
+
+
+class ParsePool:
+    '''
+    Extracts books from page bodies in worker processes.
+
+    At most max_in_flight pages are handed to the workers at a time. Callbacks
+    waiting for a free slot keep their response in Scrapy's scraper slot, and
+    once that holds more than SCRAPER_SLOT_MAX_ACTIVE_SIZE bytes the engine stops
+    taking new requests from the scheduler, which is the backpressure that keeps
+    downloads from running far ahead of parsing.
+    '''
+
+    def __init__(self, processes, max_in_flight=None):
+        # "spawn" instead of fork: forking a process that runs a reactor and
+        # threads can leave locks in the children in a broken state
+        self.executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+        self.max_in_flight = max_in_flight or 2 * processes
+        self.window = None
+
+    async def extract(self, html, links=False):
+        # (records, drift counts) of a page, see extractors.extract_books_and_drift()
+        # The semaphore has to be created inside the running event loop
+        if self.window is None:
+            self.window = asyncio.Semaphore(self.max_in_flight)
+        async with self.window:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, extract_books_and_drift, html, links)
+
+    def close(self, **kwargs):
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -54,34 +54,627 @@
 #         self.workbook.save('scraped_ebook_data.xlsx')
 
 # pipelines.py
-import openpyxl
+import glob
+import importlib.util
+import json
+import logging
 import os
+import sqlite3
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from ebook_scraper import changes
+from ebook_scraper.exports import BASE_FIELDS, DETAIL_FIELDS, WRITERS, normalize_row
+from ebook_scraper.incremental import UnchangedItem, book_fingerprint, book_key, crawl_index
+from ebook_scraper.items import price_to_float, rating_to_int
+from ebook_scraper.writerthread import WriterThreadPipeline
+
+# openpyxl, pyarrow and numpy each take tens to hundreds of milliseconds to
+# import, which a short scheduled crawl would pay before its first request even
+# with the pipeline that needs them turned off. So they are imported inside the
+# pipelines that use them, once those are enabled; find_spec() only looks for
+# the package without importing it
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+
+logger = logging.getLogger(__name__)
+
 
 class ExcelAppendPipeline:
-    def open_spider(self, spider):
-        # Check if the Excel file exists
-        file_exists = os.path.exists('scraped_data.xlsx')
+    '''
+    Streams scraped items into numbered Excel part files.
 
-        if file_exists:
-            # Load the existing workbook if it exists
-            self.workbook = openpyxl.load_workbook('scraped_data.xlsx')
-            self.sheet = self.workbook.active
-        else:
-            # Create a new workbook and set active sheet if it doesn't exist
-            self.workbook = openpyxl.Workbook()
-            self.sheet = self.workbook.active
-            self.sheet.title = 'Scraped Data'
-            # Write header row if file doesn't exist
-            self.sheet.append(['Title', 'Rating', 'Price', 'Stock Status'])
+    Earlier versions loaded the whole of scraped_data.xlsx on every run and only
+    saved it back in close_spider, so start-up time and memory grew with the
+    history and a crash lost the entire run. Now every run writes new part files
+    (scraped_data_00001.xlsx, scraped_data_00002.xlsx, ...) through openpyxl's
+    write-only mode, which serialises each appended row straight to a temporary
+    file on disk. Old parts are never opened again, and once a part reaches
+    EXCEL_PART_ROWS rows it is saved and a fresh one is started, so a crash can
+    lose at most the part that was being written.
+    '''
+
+    HEADER = ['Title', 'Rating', 'Price', 'Stock Status']
+
+    def __init__(self, file_name='scraped_data.xlsx', part_rows=50000):
+        # The base name of the output, e.g. 'scraped_data' + '.xlsx'
+        self.base_name, self.extension = os.path.splitext(file_name)
+        # Number of data rows written to a part before rolling over to a new one
+        self.part_rows = part_rows
+        self.workbook = None
+        self.sheet = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            file_name=crawler.settings.get('EXCEL_FILE', 'scraped_data.xlsx'),
+            part_rows=crawler.settings.getint('EXCEL_PART_ROWS', 50000),
+        )
+
+    def open_spider(self, spider):
+        # Only the file names of the existing parts are looked at, never their contents
+        self.part_number = self._last_part_number()
+        self.rows_in_part = 0
 
     def process_item(self, item, spider):
+        # Start a new part lazily, so runs without items leave no empty files behind
+        if self.sheet is None:
+            self._open_part()
+
         # Append item data (title, rating, price, stock_status) to the sheet
         self.sheet.append([item.get('title'),
                            item.get('rating'),
                            item.get('price'),
                            item.get('stock_status')])
+        self.rows_in_part += 1
+
+        # Roll over to the next part file once this one is full
+        if self.rows_in_part >= self.part_rows:
+            self._close_part()
+        return item
+
+    def close_spider(self, spider):
+        # Save whatever is left in the current part when the spider is closed
+        if self.sheet is not None:
+            self._close_part()
+
+    def checkpoint(self):
+        # Called by CheckpointMiddleware: save the rows so far and return the last saved part
+        if self.sheet is not None:
+            self._close_part()
+        return self.part_number
+
+    def restore_checkpoint(self, part_number):
+        # Parts saved after the checkpoint hold rows that the resumed crawl writes again
+        if part_number is None:
+            return
+        for number in range(part_number + 1, self.part_number + 1):
+            if os.path.exists(self.part_path(number)):
+                os.remove(self.part_path(number))
+        self.part_number = part_number
+
+    def part_path(self, number):
+        return '%s_%05d%s' % (self.base_name, number, self.extension)
+
+    def _last_part_number(self):
+        numbers = [0]
+        for path in glob.glob(glob.escape(self.base_name) + '_*' + self.extension):
+            suffix = path[len(self.base_name) + 1:-len(self.extension)]
+            if suffix.isdigit():
+                numbers.append(int(suffix))
+        return max(numbers)
+
+    def _open_part(self):
+        import openpyxl
+
+        self.part_number += 1
+        self.rows_in_part = 0
+        # A write-only workbook keeps no rows in memory once they are appended
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title='Scraped Data')
+        self.sheet.append(self.HEADER)
+
+    def _close_part(self):
+        self.workbook.save(self.part_path(self.part_number))
+        self.workbook = None
+        self.sheet = None
+
+
+class ColumnarExportPipeline:
+    '''
+    Writes scraped items to a typed, columnar Parquet or Arrow IPC file.
+
+    Items are buffered column by column and converted once to their final types
+    (float price, small-int rating, dictionary-encoded stock status), so readers
+    no longer have to parse strings like '£51.77' or 'Three' on every query.
+    Each COLUMNAR_ROW_GROUP_SIZE items are flushed as one row group / record
+    batch. The format follows the file extension: '.parquet' for Parquet, and
+    '.arrow' for an uncompressed Arrow IPC file that can be memory-mapped.
+    '''
+
+    COLUMNS = ('title', 'rating', 'price', 'stock_status')
+
+    def __init__(self, file_name='ebooks.parquet', row_group_size=10000):
+        import pyarrow
+
+        self.file_name = file_name
+        self.row_group_size = row_group_size
+        self.schema = pyarrow.schema([
+            ('title', pyarrow.string()),
+            ('rating', pyarrow.int8()),
+            ('price', pyarrow.float64()),
+            ('stock_status', pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+        ])
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not HAS_PYARROW:
+            raise NotConfigured('ColumnarExportPipeline requires pyarrow')
+        return cls(
+            file_name=crawler.settings.get('COLUMNAR_FILE', 'ebooks.parquet'),
+            row_group_size=crawler.settings.getint('COLUMNAR_ROW_GROUP_SIZE', 10000),
+        )
+
+    def open_spider(self, spider):
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        self.columns = {name: [] for name in self.COLUMNS}
+        if self.file_name.endswith('.arrow'):
+            self.writer = pyarrow.ipc.new_file(self.file_name, self.schema)
+        else:
+            self.writer = pyarrow.parquet.ParquetWriter(self.file_name, self.schema)
+
+    def process_item(self, item, spider):
+        columns = self.columns
+        columns['title'].append(item.get('title'))
+        columns['rating'].append(rating_to_int(item.get('rating')))
+        columns['price'].append(price_to_float(item.get('price')))
+        columns['stock_status'].append(item.get('stock_status'))
+
+        if len(columns['title']) >= self.row_group_size:
+            self._flush()
+        return item
+
+    def close_spider(self, spider):
+        self._flush()
+        self.writer.close()
+
+    def _flush(self):
+        import pyarrow
+
+        if not self.columns['title']:
+            return
+        batch = pyarrow.record_batch(
+            [pyarrow.array(self.columns[name], type=field.type)
+             for name, field in zip(self.COLUMNS, self.schema)],
+            schema=self.schema,
+        )
+        self.writer.write_batch(batch)
+        self.columns = {name: [] for name in self.COLUMNS}
+
+
+class SQLitePipeline:
+    '''
+    Keeps one row per book in a SQLite database plus its price/stock history.
+
+    Items are buffered and written SQLITE_BATCH_SIZE at a time in a single
+    transaction, with the same prepared upsert statement for every row. Books
+    are keyed by their UPC when the detail page was scraped (EBOOK_ENRICH_DETAILS)
+    and by the URL of their detail page otherwise (incremental.book_key). The history table gets a row when a book is
+    first seen and whenever its price, stock status or stock count changes;
+    triggers in the database take care of that, so an unchanged book costs a
+    single UPDATE of its last_seen time.
+
+        SELECT seen_at, price FROM price_history WHERE key = ? ORDER BY seen_at
+    '''
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS books ('
+        'key TEXT PRIMARY KEY, title TEXT, rating INTEGER, price REAL, stock_status TEXT, '
+        'upc TEXT, category TEXT, stock_count INTEGER, first_seen REAL, last_seen REAL)',
+        'CREATE TABLE IF NOT EXISTS price_history ('
+        'key TEXT, seen_at REAL, price REAL, stock_status TEXT, stock_count INTEGER)',
+        'CREATE INDEX IF NOT EXISTS price_history_key ON price_history (key, seen_at)',
+        'CREATE TRIGGER IF NOT EXISTS book_added AFTER INSERT ON books BEGIN '
+        'INSERT INTO price_history VALUES (NEW.key, NEW.last_seen, NEW.price, NEW.stock_status, NEW.stock_count); '
+        'END',
+        'CREATE TRIGGER IF NOT EXISTS book_changed AFTER UPDATE ON books '
+        'WHEN OLD.price IS NOT NEW.price OR OLD.stock_status IS NOT NEW.stock_status '
+        'OR OLD.stock_count IS NOT NEW.stock_count BEGIN '
+        'INSERT INTO price_history VALUES (NEW.key, NEW.last_seen, NEW.price, NEW.stock_status, NEW.stock_count); '
+        'END',
+    ]
+
+    # Detail fields are only overwritten when the item has them, so a listing-only
+    # crawl does not erase what an enrichment crawl found before
+    UPSERT = (
+        'INSERT INTO books (key, title, rating, price, stock_status, upc, category, stock_count, '
+        'first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (key) DO UPDATE SET title = excluded.title, rating = excluded.rating, '
+        'price = excluded.price, stock_status = excluded.stock_status, '
+        'upc = COALESCE(excluded.upc, upc), category = COALESCE(excluded.category, category), '
+        'stock_count = COALESCE(excluded.stock_count, stock_count), last_seen = excluded.last_seen'
+    )
+
+    def __init__(self, file_name='ebooks.sqlite', batch_size=1000):
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.connection = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            file_name=crawler.settings.get('SQLITE_FILE', 'ebooks.sqlite'),
+            batch_size=crawler.settings.getint('SQLITE_BATCH_SIZE', 1000),
+        )
+
+    def open_spider(self, spider):
+        self.connection = sqlite3.connect(self.file_name)
+        # WAL lets readers query the database while the crawl writes to it, and
+        # with it synchronous=NORMAL only syncs at checkpoints, not every commit
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in self.SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+        self.rows = []
+
+    def process_item(self, item, spider):
+        upc = item.get('upc')
+        now = time.time()
+        self.rows.append((
+            book_key(item),
+            item.get('title'),
+            rating_to_int(item.get('rating')),
+            price_to_float(item.get('price')),
+            item.get('stock_status'),
+            upc,
+            item.get('category'),
+            item.get('stock_count'),
+            now,
+            now,
+        ))
+        if len(self.rows) >= self.batch_size:
+            self._flush()
+        return item
+
+    def close_spider(self, spider):
+        self._flush()
+        self.connection.close()
+
+    def checkpoint(self):
+        # Writing a row again is harmless (the upsert and the triggers see no
+        # change), so there is no offset to keep, only the buffer to write out
+        if self.rows:
+            self._flush()
+
+    def restore_checkpoint(self, offset):
+        pass
+
+    def _flush(self):
+        if not self.rows:
+            return
+        # "with" wraps the whole batch in one transaction
+        with self.connection:
+            self.connection.executemany(self.UPSERT, self.rows)
+        self.rows = []
+
+
+class MultiFormatExportPipeline:
+    '''
+    Writes every item to any number of files and formats in a single pass.
+
+    EXPORT_OUTPUTS is laid out like Scrapy's FEEDS, e.g.
+        {"ebooks.json": {"format": "json"},
+         "ebooks.csv.gz": {"format": "csv", "compression": "gzip"},
+         "ebooks.xlsx": {"format": "xlsx"}}
+    with the formats json, jsonlines, csv, xml and xlsx, and the compressions
+    gzip and zstd (with an optional "compression_level"). Each item is read
+    into a tuple of EXPORT_FIELDS once, and all outputs are written from that.
+    '''
+
+    def __init__(self, outputs, fields=BASE_FIELDS, buffer_size=1024 * 1024):
+        for path, options in outputs.items():
+            if options.get('format') not in WRITERS:
+                raise ValueError('Unknown export format %r for %s' % (options.get('format'), path))
+        self.outputs = outputs
+        self.fields = tuple(fields)
+        self.buffer_size = buffer_size
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        outputs = settings.getdict('EXPORT_OUTPUTS')
+        if not outputs:
+            raise NotConfigured('MultiFormatExportPipeline needs EXPORT_OUTPUTS')
+        fields = settings.getlist('EXPORT_FIELDS')
+        if not fields:
+            # The detail page fields only exist in enrichment mode
+            fields = BASE_FIELDS + DETAIL_FIELDS if settings.getbool('EBOOK_ENRICH_DETAILS') else BASE_FIELDS
+        return cls(outputs, fields, settings.getint('EXPORT_BUFFER_SIZE', 1024 * 1024))
+
+    def open_spider(self, spider):
+        self.writers = []
+        for path, options in self.outputs.items():
+            writer = WRITERS[options['format']](
+                path, self.fields,
+                compression=options.get('compression'),
+                level=options.get('compression_level'),
+                buffer_size=self.buffer_size,
+            )
+            writer.start()
+            self.writers.append(writer)
+
+    def process_item(self, item, spider):
+        row = normalize_row(item, self.fields)
+        for writer in self.writers:
+            writer.write(row)
+        return item
+
+    def close_spider(self, spider):
+        for writer in self.writers:
+            writer.finish()
+
+
+class CatalogueSummaryPipeline:
+    '''
+    Writes catalogue aggregates (price histogram, rating distribution, in-stock
+    ratio, mean price per rating, books per category) to SUMMARY_FILE at the end.
+
+    process_item() only collects the raw price, rating, stock status and
+    category, whatever shape the spider yields them in ('£51.77' or 51.77,
+    'Three' or 3). Every SUMMARY_BATCH_SIZE items the collected values are
+    converted to NumPy arrays in bulk (see aggregates.py), and close_spider()
+    computes the aggregates on the whole columns. With SUMMARY_COLUMNS_FILE the
+    typed price, rating and in_stock columns are also saved as a .npz file.
+    '''
+
+    def __init__(self, file_name='catalogue_summary.json', batch_size=50000, bins=10, columns_file=None):
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.bins = bins
+        self.columns_file = columns_file
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not HAS_NUMPY:
+            raise NotConfigured('CatalogueSummaryPipeline requires numpy')
+        settings = crawler.settings
+        # A number of equal-width bins, or a list of bin edges
+        bins = settings.get('SUMMARY_PRICE_BINS', 10)
+        bins = [float(edge) for edge in bins] if isinstance(bins, (list, tuple)) else int(bins)
+        return cls(
+            file_name=settings.get('SUMMARY_FILE', 'catalogue_summary.json'),
+            batch_size=settings.getint('SUMMARY_BATCH_SIZE', 50000),
+            bins=bins,
+            columns_file=settings.get('SUMMARY_COLUMNS_FILE'),
+        )
+
+    def open_spider(self, spider):
+        self._new_batch()
+        self.chunks = {'price': [], 'rating': [], 'in_stock': [], 'category': []}
+
+    def process_item(self, item, spider):
+        # Appends only: the conversion happens per batch, off the per-item path
+        self.prices.append(item.get('price'))
+        self.ratings.append(item.get('rating'))
+        self.stock.append(item.get('stock_status'))
+        self.categories.append(item.get('category'))
+        if len(self.prices) >= self.batch_size:
+            self._convert()
+        return item
+
+    def close_spider(self, spider):
+        import numpy
+
+        from ebook_scraper import aggregates
+
+        self._convert()
+        columns = {name: numpy.concatenate(chunks) if chunks else numpy.array([])
+                   for name, chunks in self.chunks.items()}
+        summary = aggregates.summarize(
+            columns['price'], columns['rating'].astype(numpy.int8), columns['in_stock'].astype(bool),
+            # Only the enrichment mode scrapes categories
+            columns['category'] if (columns['category'] != None).any() else None,  # noqa: E711
+            bins=self.bins,
+        )
+        with open(self.file_name, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        if self.columns_file:
+            numpy.savez(self.columns_file, price=columns['price'], rating=columns['rating'],
+                        in_stock=columns['in_stock'])
+
+    def _convert(self):
+        import numpy
+
+        from ebook_scraper import aggregates
+
+        if not self.prices:
+            return
+        try:
+            converted = {
+                'price': aggregates.prices_to_array(self.prices),
+                'rating': aggregates.ratings_to_array(self.ratings),
+                'in_stock': aggregates.in_stock_to_array(self.stock),
+                'category': numpy.array(self.categories, dtype=object),
+            }
+        except Exception:
+            # Left out of the summary rather than failing every item from here on
+            logger.exception('Could not convert a batch of %d items for the catalogue summary',
+                             len(self.prices))
+        else:
+            for name, column in converted.items():
+                self.chunks[name].append(column)
+        finally:
+            self._new_batch()
+
+    def _new_batch(self):
+        self.prices = []
+        self.ratings = []
+        self.stock = []
+        self.categories = []
+
+
+class ChangeAlertPipeline:
+    '''
+    Appends only the books whose price, rating or stock status changed to CHANGES_FILE.
+
+    The last known state of every book is loaded from CHANGES_BASELINE, the
+    previous run's output (JSON lines, CSV or JSON, optionally .gz), into a
+    BookStateIndex (see changes.py). Pipelines open before the feed exports, so
+    the baseline can be the very file this crawl's FEEDS overwrites. Each
+    change is one JSON line, written and flushed as soon as the item comes
+    through; books missing from a finished crawl are reported as removed at
+    the end (CHANGES_REPORT_REMOVED). Items are passed on unchanged.
+
+    An incremental crawl (INCREMENTAL_ENABLED) yields nothing for pages that
+    have not changed and drops unchanged books, so a missing book proves
+    nothing there and the removed report is left out.
+    '''
+
+    def __init__(self, file_name='changes.jsonl', baselines=(), report_removed=True, stats=None):
+        self.file_name = file_name
+        self.baselines = baselines
+        self.report_removed = report_removed
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(
+            file_name=settings.get('CHANGES_FILE', 'changes.jsonl'),
+            baselines=settings.getlist('CHANGES_BASELINE'),
+            report_removed=(settings.getbool('CHANGES_REPORT_REMOVED', True)
+                            and not settings.getbool('INCREMENTAL_ENABLED')),
+            stats=crawler.stats,
+        )
+        # The finish reason is only known once the spider has closed, after the pipelines
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.index = changes.BookStateIndex()
+        for path in self.baselines:
+            if os.path.exists(path):
+                self.index.load(path)
+        if self.stats is not None:
+            self.stats.set_value('changes/baseline_books', len(self.index), spider=spider)
+        self.file = open(self.file_name, 'a', encoding='utf-8')
+        self.encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def process_item(self, item, spider):
+        key = changes.item_key(item)
+        state = changes.pack_state(item.get('price'), item.get('rating'), item.get('stock_status'))
+        previous = self.index.update(key, state)
+        if previous is None:
+            change = 'unchanged'
+        elif previous == changes.NEW:
+            change = 'added'
+            self._emit(changes.change_record(change, key, item.get('title'), state, at=time.time()))
+        else:
+            change = 'changed'
+            self._emit(changes.change_record(change, key, item.get('title'), state, previous, at=time.time()))
+        if self.stats is not None:
+            self.stats.inc_value('changes/%s' % change, spider=spider)
+        return item
+
+    def close_spider(self, spider):
+        self.file.flush()
+
+    def spider_closed(self, spider, reason):
+        # Only a crawl that went through the whole catalogue can tell what is gone
+        if self.report_removed and reason == 'finished':
+            removed = self.index.unseen()
+            now = time.time()
+            for key, state in removed:
+                self._emit(changes.change_record('removed', key, None, state, at=now), flush=False)
+            if self.stats is not None:
+                self.stats.set_value('changes/removed', len(removed), spider=spider)
+        self.file.close()
+
+    def _emit(self, record, flush=True):
+        self.file.write(self.encode(record) + '\n')
+        # Consumers follow the file while the crawl runs
+        if flush:
+            self.file.flush()
+
+
+# The same sinks on a writer thread of their own (see writerthread.py), for
+# crawls where appending rows or saving files would hold up the reactor
+class ThreadedExcelAppendPipeline(WriterThreadPipeline):
+    sink_class = ExcelAppendPipeline
+
+    def checkpoint(self):
+        # A Deferred, fired once the parts with every item so far are saved
+        return self.call_sink('checkpoint')
+
+    def restore_checkpoint(self, part_number):
+        return self.call_sink('restore_checkpoint', part_number)
+
+
+class ThreadedColumnarExportPipeline(WriterThreadPipeline):
+    sink_class = ColumnarExportPipeline
+
+
+class ThreadedSQLitePipeline(WriterThreadPipeline):
+    sink_class = SQLitePipeline
+
+    def checkpoint(self):
+        return self.call_sink('checkpoint')
+
+    def restore_checkpoint(self, offset):
+        return self.call_sink('restore_checkpoint', offset)
+
+
+class ThreadedMultiFormatExportPipeline(WriterThreadPipeline):
+    sink_class = MultiFormatExportPipeline
+
+
+class IncrementalItemPipeline:
+    '''
+    Lets only new or changed books through when INCREMENTAL_ENABLED is set.
+
+    The last seen price, rating and stock status of every book are kept in the
+    CrawlIndex at INCREMENTAL_INDEX. Books that look the same as in the previous
+    run are dropped, so the pipelines after this one (e.g. ExcelAppendPipeline)
+    no longer fill up with duplicates. Set LOG_FORMATTER to
+    ebook_scraper.incremental.IncrementalLogFormatter to log those drops at
+    DEBUG instead of one WARNING per book.
+    '''
+
+    # Write the book index to disk every this many new or changed books
+    COMMIT_EVERY = 500
+
+    def __init__(self, index, stats):
+        self.index = index
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('INCREMENTAL_ENABLED'):
+            raise NotConfigured
+        return cls(crawl_index(crawler), crawler.stats)
+
+    def open_spider(self, spider):
+        self.pending = 0
+
+    def process_item(self, item, spider):
+        key = book_key(item)
+        change = self.index.book_changed(key, book_fingerprint(item))
+        if change is None:
+            self.stats.inc_value('incremental/items_unchanged', spider=spider)
+            raise UnchangedItem('Unchanged since the last run: %s' % key)
+
+        self.stats.inc_value('incremental/items_%s' % change, spider=spider)
+        self.pending += 1
+        if self.pending >= self.COMMIT_EVERY:
+            self.index.commit()
+            self.pending = 0
         return item
 
     def close_spider(self, spider):
-        # Save the workbook when the spider is closed
-        self.workbook.save('scraped_data.xlsx')
+        self.index.commit()
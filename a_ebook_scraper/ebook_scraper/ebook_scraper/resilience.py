@@ -0,0 +1,117 @@
+# Noticing when books.toscrape.com changes its markup, without slowing down healthy pages.
+#
+# The extractors (extractors.py) check every record they read and only fall
+# back to their per-field selector chains when the primary extraction failed,
+# counting what happened in the request's meta ('drift'). DriftMiddleware, a
+# spider middleware, picks those counts up once the callback is done:
+#   - every count goes into the stats as drift/<field>/recovered,
+#     drift/<field>/missing or drift/no_books, so a crawl that silently lost
+#     its ratings shows up in the stats dump instead of in the data
+#   - pages where a field could not be recovered at all, that had no books, or
+#     whose callback raised an error typical of changed markup (IndexError,
+#     AttributeError, ...) are saved to DRIFT_QUARANTINE_DIR with the reason,
+#     so the download is not lost: once the selectors are fixed,
+#     reparse_quarantine() extracts them again offline
+#
+# Enabled with SPIDER_MIDDLEWARES = {"ebook_scraper.resilience.DriftMiddleware": 450}.
+
+import hashlib
+import json
+import os
+import time
+
+import lxml.html
+from scrapy.exceptions import NotConfigured
+
+from ebook_scraper.extractors import PRODUCT_PODS, extract_books, extract_details
+
+# Callback errors that usually mean a selector no longer matches
+DRIFT_ERRORS = (IndexError, AttributeError, KeyError, TypeError, ValueError)
+
+INDEX_FILE = 'index.jsonl'
+
+
+class DriftMiddleware:
+    '''
+    Drift counters in the stats and a quarantine of the pages that failed.
+    '''
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DRIFT_ENABLED', True):
+            raise NotConfigured
+        self.stats = crawler.stats
+        self.directory = settings.get('DRIFT_QUARANTINE_DIR', 'quarantine')
+        # A site-wide redesign would otherwise save every page of the crawl
+        self.max_pages = settings.getint('DRIFT_QUARANTINE_MAX_PAGES', 1000)
+        self.quarantined = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_spider_output(self, response, result, spider):
+        yield from result
+        self.page_done(response, spider)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # The same for asynchronous callbacks (parse_in_pool of books_items)
+        async for output in result:
+            yield output
+        self.page_done(response, spider)
+
+    def process_spider_exception(self, response, exception, spider):
+        # Saved for later, but still logged as an error by Scrapy as usual
+        if isinstance(exception, DRIFT_ERRORS):
+            self.stats.inc_value('drift/callback_errors', spider=spider)
+            self.quarantine(response, ['%s: %s' % (type(exception).__name__, exception)], spider)
+        return None
+
+    def page_done(self, response, spider):
+        drift = response.meta.get('drift') if response.request is not None else None
+        if not drift:
+            return
+        for key, value in drift.items():
+            self.stats.inc_value('drift/' + key, value, spider=spider)
+        reasons = [key for key in drift if key.endswith('/missing') or key == 'no_books']
+        if reasons:
+            self.quarantine(response, reasons, spider)
+
+    def quarantine(self, response, reasons, spider):
+        if self.quarantined >= self.max_pages:
+            self.stats.inc_value('drift/quarantine_skipped', spider=spider)
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        name = hashlib.sha1(response.url.encode('utf-8')).hexdigest()[:16] + '.html'
+        with open(os.path.join(self.directory, name), 'wb') as f:
+            f.write(response.body)
+        with open(os.path.join(self.directory, INDEX_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'url': response.url, 'status': response.status, 'file': name,
+                                'reasons': reasons, 'at': time.time()}) + '\n')
+        self.quarantined += 1
+        self.stats.inc_value('drift/pages_quarantined', spider=spider)
+
+
+def reparse_quarantine(directory='quarantine'):
+    '''
+    Extracts the quarantined pages again with the current extractors.
+
+    Yields (entry, records, drift) per page, entry being its line of the index
+    ({'url': ..., 'reasons': [...], ...}). Catalogue pages give a list of book
+    records, detail pages a dict of detail fields.
+    '''
+    with open(os.path.join(directory, INDEX_FILE), encoding='utf-8') as f:
+        entries = {}
+        # A page quarantined twice keeps its last entry, like its file
+        for line in f:
+            entry = json.loads(line)
+            entries[entry['file']] = entry
+    for name, entry in entries.items():
+        with open(os.path.join(directory, name), 'rb') as f:
+            root = lxml.html.fromstring(f.read())
+        drift = {}
+        if PRODUCT_PODS(root) or 'no_books' in entry['reasons']:
+            records = extract_books(root, drift=drift)
+        else:
+            records = extract_details(root, drift)
+        yield entry, records, drift
@@ -0,0 +1,178 @@
+# Compressed on-disk storage for downloaded responses, used by
+# EbookScraperDownloaderMiddleware (middlewares.py).
+#
+# All responses live in one append-only pack file (responses.pack). A SQLite
+# index (index.sqlite) maps each request fingerprint to the offset and length
+# of its compressed entry, together with the times it was stored and last used.
+# Entries older than max_age are dropped when they are looked up, and once the
+# live entries take up more than max_bytes the least recently used ones are
+# evicted. Evicted entries leave holes in the pack file, which is compacted when
+# the cache is closed and more than half of it is dead space.
+#
+# Compaction writes the live entries to a second pack file and switches to it
+# in the same SQLite transaction that stores their new offsets, so the index
+# always points into the pack file its offsets belong to. A crash before that
+# commit leaves the old pack in use and a half written new one, which is
+# deleted the next time the cache is opened; after it, the old pack is.
+
+import os
+import pickle
+import sqlite3
+import time
+import zlib
+
+# The pack files alternate between these two names, one compaction at a time
+PACK_FILES = ('responses.pack', 'responses.compact.pack')
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib (gzip's deflate) is always available
+    zstandard = None
+
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return zlib.compress(data)
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class PackCache:
+    # Commit the index to disk after this many writes
+    COMMIT_EVERY = 100
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, max_age=0, codec='gzip'):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.codec = 'zstd' if codec == 'zstd' and zstandard is not None else 'gzip'
+
+        self.index = sqlite3.connect(os.path.join(directory, 'index.sqlite'))
+        self.index.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'fingerprint TEXT PRIMARY KEY, offset INTEGER, length INTEGER, codec TEXT, '
+            'raw_size INTEGER, stored_at REAL, last_used REAL)'
+        )
+        self.index.execute('CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used)')
+        # The pack file the offsets point into
+        self.index.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.index.commit()
+        row = self.index.execute("SELECT value FROM meta WHERE key = 'pack'").fetchone()
+        self.pack_path = os.path.join(directory, row[0] if row else PACK_FILES[0])
+        for name in PACK_FILES:
+            path = os.path.join(directory, name)
+            if path != self.pack_path and os.path.exists(path):
+                # Left behind by a compaction that did not get to its commit, or
+                # the pack it replaced
+                os.remove(path)
+        self.live_bytes = self.index.execute(
+            'SELECT COALESCE(SUM(length), 0) FROM entries'
+        ).fetchone()[0]
+        self.pack = open(self.pack_path, 'ab')
+        self.reader = open(self.pack_path, 'rb')
+        self.uncommitted = 0
+
+    def get(self, fingerprint):
+        '''
+        Returns the stored response data (url, status, headers, body) or None.
+        '''
+        row = self.index.execute(
+            'SELECT offset, length, codec, stored_at FROM entries WHERE fingerprint = ?',
+            (fingerprint,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        offset, length, codec, stored_at = row
+        now = time.time()
+        if self.max_age and now - stored_at > self.max_age:
+            self._delete(fingerprint, length)
+            return None
+
+        try:
+            data = pickle.loads(decompress(os.pread(self.reader.fileno(), length, offset), codec))
+        except Exception:
+            # A damaged entry (e.g. after a crash during compaction) is just a miss
+            self._delete(fingerprint, length)
+            return None
+        self.index.execute('UPDATE entries SET last_used = ? WHERE fingerprint = ?', (now, fingerprint))
+        self._written()
+        return data
+
+    def put(self, fingerprint, data):
+        # Returns the number of compressed bytes appended to the pack file
+        raw = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        blob = compress(raw, self.codec)
+        offset = self.pack.tell()
+        self.pack.write(blob)
+        self.pack.flush()
+
+        old = self.index.execute(
+            'SELECT length FROM entries WHERE fingerprint = ?', (fingerprint,)
+        ).fetchone()
+        if old is not None:
+            self.live_bytes -= old[0]
+        now = time.time()
+        self.index.execute(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (fingerprint, offset, len(blob), self.codec, len(raw), now, now),
+        )
+        self.live_bytes += len(blob)
+        self._evict()
+        self._written()
+        return len(blob)
+
+    def close(self):
+        self.index.commit()
+        self.pack.close()
+        self.reader.close()
+        if os.path.getsize(self.pack_path) > 2 * self.live_bytes:
+            self._compact()
+        self.index.close()
+
+    def _delete(self, fingerprint, length):
+        self.index.execute('DELETE FROM entries WHERE fingerprint = ?', (fingerprint,))
+        self.live_bytes -= length
+
+    def _evict(self):
+        # Drop the least recently used entries until we are below max_bytes again
+        while self.max_bytes and self.live_bytes > self.max_bytes:
+            row = self.index.execute(
+                'SELECT fingerprint, length FROM entries ORDER BY last_used LIMIT 1'
+            ).fetchone()
+            if row is None:
+                break
+            self._delete(*row)
+
+    def _written(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.COMMIT_EVERY:
+            self.index.commit()
+            self.uncommitted = 0
+
+    def _compact(self):
+        # Copy the live entries into the other pack file, then switch the index
+        # to it: the new offsets and the new file name are one commit
+        name = PACK_FILES[1] if os.path.basename(self.pack_path) == PACK_FILES[0] else PACK_FILES[0]
+        compacted_path = os.path.join(self.directory, name)
+        rows = self.index.execute('SELECT fingerprint, offset, length FROM entries ORDER BY offset').fetchall()
+        with open(self.pack_path, 'rb') as source, open(compacted_path, 'wb') as target:
+            for fingerprint, offset, length in rows:
+                source.seek(offset)
+                self.index.execute(
+                    'UPDATE entries SET offset = ? WHERE fingerprint = ?', (target.tell(), fingerprint)
+                )
+                target.write(source.read(length))
+            # On disk before the index points at it
+            target.flush()
+            os.fsync(target.fileno())
+        self.index.execute("INSERT OR REPLACE INTO meta VALUES ('pack', ?)", (name,))
+        self.index.commit()
+        os.remove(self.pack_path)
+        self.pack_path = compacted_path
@@ -11,6 +11,12 @@ BOT_NAME = "ebook_scraper"
 
 SPIDER_MODULES = ["ebook_scraper.spiders"]
 NEWSPIDER_MODULE = "ebook_scraper.spiders"
+# Import only the module of the spider that is run, not every module in
+# SPIDER_MODULES (`scrapy list` still loads them all)
+SPIDER_LOADER_CLASS = "ebook_scraper.spiderloader.LazySpiderLoader"
+
+# Project commands, e.g. `scrapy resume books_items`
+COMMANDS_MODULE = "ebook_scraper.commands"
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -36,6 +42,13 @@ ROBOTSTXT_OBEY = True
 # Disable Telnet Console (enabled by default)
 #TELNETCONSOLE_ENABLED = False
 
+# Short scheduled crawls start faster without both: the cookies middleware
+# imports tldextract and the telnet console twisted.conch. Disabling them as
+# above still imports them, removing them skips that:
+#   DOWNLOADER_MIDDLEWARES: "scrapy.downloadermiddlewares.cookies.CookiesMiddleware": None
+#   EXTENSIONS: "scrapy.extensions.telnet.TelnetConsole": None
+# Measure with `python -m benchmarks.bench_startup --budget 1.5` (exits with 1 when over)
+
 # Override the default request headers:
 #DEFAULT_REQUEST_HEADERS = {
 #    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
@@ -48,12 +61,74 @@ ROBOTSTXT_OBEY = True
 #    "ebook_scraper.middlewares.EbookScraperSpiderMiddleware": 543,
 #}
 
+# Hot-path instrumentation of EbookScraperSpiderMiddleware (enable it above):
+# callback, pipeline and feed export latency histograms plus queue depths in the stats
+#INSTRUMENTATION_ENABLED = True
+#INSTRUMENTATION_INTERVAL = 5.0  # seconds between queue depth samples / dumps
+#INSTRUMENTATION_DUMP_FILE = "instrumentation.jsonl"
+#INSTRUMENTATION_PROFILE = True  # sample the reactor thread's stack
+#INSTRUMENTATION_PROFILE_INTERVAL = 0.005
+
+# Layout drift (ebook_scraper.resilience): the extractors fall back to other
+# selectors for a title, rating, price, UPC or category the usual ones no longer
+# find. Enable "ebook_scraper.resilience.DriftMiddleware": 450 above to get
+# drift/... counters in the stats and to save pages that still failed (or whose
+# callback raised) for reparse_quarantine() once the selectors are fixed
+#DRIFT_QUARANTINE_DIR = "quarantine"
+#DRIFT_QUARANTINE_MAX_PAGES = 1000
+
+# Crash-safe checkpoints (ebook_scraper.checkpoint), enable the middleware above
+# with "ebook_scraper.checkpoint.CheckpointMiddleware": 100. Every interval the
+# crawl pauses until the responses in flight are processed, saves the pending
+# requests and the pipeline offsets, and `scrapy resume books_items` continues
+# from the last checkpoint. ExcelAppendPipeline (and ThreadedExcelAppendPipeline)
+# starts a new part file at every checkpoint, so a crash loses no saved rows
+#CHECKPOINT_ENABLED = True
+#CHECKPOINT_INTERVAL = 60.0  # seconds
+#CHECKPOINT_DIR = "checkpoints"
+
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #DOWNLOADER_MIDDLEWARES = {
 #    "ebook_scraper.middlewares.EbookScraperDownloaderMiddleware": 543,
 #}
 
+# Compressed response cache of EbookScraperDownloaderMiddleware (enable it above).
+# Cached pages are served from disk without a download, so re-runs can replay offline
+#RESPONSE_CACHE_ENABLED = True
+#RESPONSE_CACHE_DIR = ".scrapy/responsecache"
+#RESPONSE_CACHE_MAX_BYTES = 536870912  # evict least recently used entries above 512 MB
+#RESPONSE_CACHE_MAX_AGE = 0  # seconds, 0 = never expire
+#RESPONSE_CACHE_CODEC = "gzip"  # or "zstd" if the zstandard package is installed
+#RESPONSE_CACHE_STATUSES = [200]
+
+# Incremental crawling: conditional requests for known pages and only new or
+# changed books are passed on. Needs both components below to be enabled:
+#   DOWNLOADER_MIDDLEWARES: "ebook_scraper.middlewares.IncrementalDownloaderMiddleware": 543
+#   ITEM_PIPELINES: "ebook_scraper.pipelines.IncrementalItemPipeline": 200
+#INCREMENTAL_ENABLED = True
+#INCREMENTAL_INDEX = "crawl_index.sqlite"
+# Unchanged books are dropped quietly (DEBUG) instead of with a WARNING each
+#LOG_FORMATTER = "ebook_scraper.incremental.IncrementalLogFormatter"
+
+# Warm start for frequent small crawls (ebook_scraper.warmcache): robots.txt and
+# DNS answers are kept between runs, idle connections are kept for as many
+# requests as can be in flight per host, and warm_cache/... stats report the
+# hits, misses, connections opened/reused and the seconds the cache saved.
+# Needs the components below (CachedRobotsTxtMiddleware replaces Scrapy's):
+#   DOWNLOADER_MIDDLEWARES: "scrapy.downloadermiddlewares.robotstxt.RobotsTxtMiddleware": None,
+#                           "ebook_scraper.warmcache.CachedRobotsTxtMiddleware": 100
+#   EXTENSIONS: "ebook_scraper.warmcache.WarmCacheStats": 0
+#   DNS_RESOLVER = "ebook_scraper.warmcache.PersistentCachingResolver"
+#   DOWNLOAD_HANDLERS = {"http": "ebook_scraper.warmcache.TunedHTTP11DownloadHandler",
+#                        "https": "ebook_scraper.warmcache.TunedHTTP11DownloadHandler"}
+# Measure with `python -m benchmarks.bench_warmcache`
+#WARM_CACHE_ENABLED = True
+#WARM_CACHE_FILE = ".scrapy/warmcache.sqlite"
+#WARM_CACHE_ROBOTS_TTL = 86400  # seconds
+#WARM_CACHE_DNS_TTL = 300  # seconds
+#HTTP_KEEPALIVE_TIMEOUT = 240  # seconds an idle connection is kept open
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 #EXTENSIONS = {
@@ -66,6 +141,105 @@ ITEM_PIPELINES = {
     'ebook_scraper.pipelines.ExcelAppendPipeline': 300,
 }
 
+# ExcelAppendPipeline writes numbered part files (scraped_data_00001.xlsx, ...)
+# and starts a new part once the current one holds EXCEL_PART_ROWS rows
+EXCEL_FILE = "scraped_data.xlsx"
+EXCEL_PART_ROWS = 50000
+
+# Let the books_items spider yield slotted EbookRecord objects instead of
+# building every EbookItem through an ItemLoader
+#EBOOK_ITEM_FAST_PATH = True
+
+# How the books_items spider walks the catalogue: "next" follows the next-page
+# link one page at a time, "fanout" reads "Page 1 of N" from the first page and
+# requests all pages at once (bounded by CONCURRENT_REQUESTS_PER_DOMAIN). Items
+# still come out in page order; a page that fails is skipped, and pages held back
+# behind one that never arrived are let go when the crawl goes idle
+# (fanout/pages_missing in the stats)
+#EBOOK_PAGINATION = "fanout"
+
+# Extract books in worker processes instead of on the reactor thread (books_items
+# spider), with at most EBOOK_PARSE_MAX_IN_FLIGHT pages handed out at a time
+#EBOOK_PARSE_PROCESSES = 4
+#EBOOK_PARSE_MAX_IN_FLIGHT = 8
+
+# Enrichment mode of the books_items spider: follow every book to its detail page
+# and add UPC, description, category and stock count to the item. That is 20
+# requests per catalogue page, so remember the seen requests in a fixed size
+# Bloom filter instead of a set of strings, and with a JOBDIR keep the pending
+# requests in Scrapy's on-disk queues (this also makes the crawl resumable).
+# A book whose detail page fails is kept with empty detail fields and counted
+# as enrich/detail_failed in the stats
+#EBOOK_ENRICH_DETAILS = True
+#DUPEFILTER_CLASS = "ebook_scraper.dupefilters.BloomDupeFilter"
+#DUPEFILTER_BLOOM_CAPACITY = 1000000  # expected number of requests
+#DUPEFILTER_BLOOM_ERROR_RATE = 0.000001  # chance of dropping a new request
+#JOBDIR = "crawls/books_items"
+
+# Sharded crawls: `scrapy shard books_items -w 4 -o ebooks.csv` runs 4 worker
+# processes that take pages (and detail pages) from one shared work queue, each
+# writing its own shard under shards/worker-<n>/, and merges the shards at the
+# end. The queue is a SQLite file by default; a broker-backed queue with the
+# same methods (see ebook_scraper/workqueue.py) can take its place
+#EBOOK_SHARD_QUEUE_CLASS = "ebook_scraper.workqueue.SQLiteWorkQueue"
+#EBOOK_SHARD_CLAIM_SIZE = 32  # tasks leased per worker at a time
+#EBOOK_SHARD_LEASE_SECONDS = 60.0  # after this an unacked task goes to another worker
+#EBOOK_SHARD_MAX_ATTEMPTS = 3  # failed downloads before a task is given up
+#EBOOK_SHARD_POLL_INTERVAL = 0.2  # seconds between polls of an idle worker
+
+# Typed Parquet ('.parquet') or memory-mappable Arrow IPC ('.arrow') export,
+# enable with "ebook_scraper.pipelines.ColumnarExportPipeline": 310 (needs pyarrow)
+#COLUMNAR_FILE = "ebooks.parquet"
+#COLUMNAR_ROW_GROUP_SIZE = 10000
+
+# Queryable SQLite database with one row per book and its price/stock history,
+# enable with "ebook_scraper.pipelines.SQLitePipeline": 320
+#SQLITE_FILE = "ebooks.sqlite"
+#SQLITE_BATCH_SIZE = 1000  # items per transaction
+
+# All output files in one pass: "ebook_scraper.pipelines.MultiFormatExportPipeline": 330
+# reads each item once and writes it to every output below (json, jsonlines, csv,
+# xml or xlsx, each optionally compressed with gzip or zstd)
+#EXPORT_OUTPUTS = {
+#    "ebooks_using_items.json": {"format": "json"},
+#    "ebooks_using_items.csv": {"format": "csv"},
+#    "ebooks_using_items.xml.gz": {"format": "xml", "compression": "gzip"},
+#    "scraped_data.xlsx": {"format": "xlsx"},
+#}
+#EXPORT_FIELDS = ["title", "rating", "price", "stock_status", "url"]
+#EXPORT_BUFFER_SIZE = 1048576  # bytes collected before each write
+
+# Catalogue aggregates (price histogram, rating distribution, in-stock ratio,
+# mean price per rating, books per category) written at the end of the crawl,
+# enable with "ebook_scraper.pipelines.CatalogueSummaryPipeline": 340 (needs
+# numpy). Prices and ratings are converted per batch of SUMMARY_BATCH_SIZE items
+#SUMMARY_FILE = "catalogue_summary.json"
+#SUMMARY_BATCH_SIZE = 50000
+#SUMMARY_PRICE_BINS = 10  # number of bins, or a list of bin edges like [0, 20, 40, 60]
+#SUMMARY_COLUMNS_FILE = "ebooks_columns.npz"  # also save the typed columns
+
+# Price/rating/stock changes only, as a JSON lines stream that grows while the
+# crawl runs: "ebook_scraper.pipelines.ChangeAlertPipeline": 350. The last known
+# state of every book comes from the previous run's output (JSON lines, CSV or
+# JSON, optionally .gz), which may be the file FEEDS is about to overwrite.
+# Leave CHANGES_REPORT_REMOVED off for sharded crawls, every worker only sees
+# part of the catalogue. With INCREMENTAL_ENABLED removed books are never
+# reported (unchanged pages and books yield no items), and the output of such a
+# crawl only holds what changed: list the last full export first and the
+# incremental outputs since then after it (later rows win), e.g.
+# ["full.jsonl", "incremental-1.jsonl", "incremental-2.jsonl"]
+#CHANGES_FILE = "changes.jsonl"
+#CHANGES_BASELINE = ["ebooks.jsonl"]
+#CHANGES_REPORT_REMOVED = True  # books a finished crawl did not find
+
+# Every output pipeline above also comes as Threaded<Name> (e.g.
+# "ebook_scraper.pipelines.ThreadedExcelAppendPipeline": 300), which runs it on
+# a writer thread so it no longer blocks crawling. Items are handed over in
+# batches through a bounded queue; when it is full, item processing waits
+#WRITER_THREAD_BATCH_SIZE = 500
+#WRITER_THREAD_QUEUE_SIZE = 8  # batches
+#WRITER_THREAD_FLUSH_INTERVAL = 1.0  # seconds before a partial batch is handed over
+
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -80,6 +254,19 @@ ITEM_PIPELINES = {
 # Enable showing throttling stats for every response received:
 #AUTOTHROTTLE_DEBUG = False
 
+# Or let ebook_scraper.throttle.AdaptiveThrottle find the per-domain concurrency
+# on its own (AIMD on latency percentiles, 429/5xx and Retry-After), enable with
+# EXTENSIONS = {"ebook_scraper.throttle.AdaptiveThrottle": 500} and raise
+# CONCURRENT_REQUESTS, which still caps the total
+#ADAPTIVE_THROTTLE_ENABLED = True
+#ADAPTIVE_THROTTLE_START_CONCURRENCY = 2
+#ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 64
+#ADAPTIVE_THROTTLE_BACKOFF = 0.5  # factor applied on a 429 or 5xx
+#ADAPTIVE_THROTTLE_LATENCY_TOLERANCE = 2.0  # p90 latency over its average that counts as congestion
+#ADAPTIVE_THROTTLE_LATENCY_FLOOR = 0.05  # seconds, below this latency is never congestion
+#ADAPTIVE_THROTTLE_PROBE_INTERVAL = 30.0  # seconds to stay below a rejected concurrency
+#ADAPTIVE_THROTTLE_MAX_PAUSE = 60.0  # longest Retry-After to honour
+
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 #HTTPCACHE_ENABLED = True
@@ -0,0 +1,106 @@
+# Merging the output shards of a sharded crawl (`scrapy shard`, commands/shard.py).
+#
+# Every worker writes the items it scraped to its own JSON lines file, so the
+# workers never share an output file. Afterwards merge_shards() streams the
+# shards one line at a time into the final outputs, written by the same
+# writers as MultiFormatExportPipeline (exports.py). A task whose worker died
+# after writing some of its items is fetched again by another worker, so the
+# same book can be in two shards; only its first copy is kept. Copies are
+# recognised by the page they were scraped from, not by their values: two
+# different books may well share a title.
+
+import json
+
+from itemadapter import ItemAdapter
+
+from ebook_scraper.exports import BASE_FIELDS, DETAIL_FIELDS, WRITERS
+
+# The shard of a worker, in its own directory
+SHARD_FILE = 'items.jsonl'
+
+
+def read_shard(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            # A worker killed mid-write leaves at most one torn line at the end
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+class ShardWriter:
+    '''
+    Writes the items of one worker to its shard, each with the 'source' it came from.
+
+    The source is the detail page of the book, or the listing page and the
+    book's position on it: the same for both copies of a book when its task
+    was fetched twice, and different for any two books.
+    '''
+
+    def __init__(self, path=SHARD_FILE):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, item, response):
+        row = ItemAdapter(item).asdict()
+        if 'listing' in response.meta:
+            row['source'] = response.url
+        else:
+            position = response.meta.get('shard_position', 0)
+            response.meta['shard_position'] = position + 1
+            row['source'] = '%s#%d' % (response.url, position)
+        self.file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def flush(self):
+        # Before a task is acked: its rows must outlive the worker process
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def book_key(row):
+    # The UPC when the details were scraped, which is also what SQLitePipeline uses
+    return row.get('upc') or row['source']
+
+
+def merge_shards(paths, outputs, fields=None):
+    '''
+    Writes the rows of all shards to outputs ({path: {'format': ..., 'compression': ...}}).
+
+    Returns the number of rows written and the number of duplicates dropped.
+    '''
+    if fields is None:
+        # The detail fields only when the crawl was enriched
+        fields = BASE_FIELDS
+        for path in paths:
+            row = next(read_shard(path), None)
+            if row is not None:
+                fields = BASE_FIELDS + DETAIL_FIELDS if 'upc' in row else BASE_FIELDS
+                break
+    fields = tuple(fields)
+
+    writers = []
+    for path, options in outputs.items():
+        writer = WRITERS[options['format']](path, fields, compression=options.get('compression'))
+        writer.start()
+        writers.append(writer)
+
+    seen = set()
+    written = duplicates = 0
+    try:
+        for path in paths:
+            for row in read_shard(path):
+                key = book_key(row)
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                values = tuple([row.get(field) for field in fields])
+                for writer in writers:
+                    writer.write(values)
+                written += 1
+    finally:
+        for writer in writers:
+            writer.finish()
+    return written, duplicates
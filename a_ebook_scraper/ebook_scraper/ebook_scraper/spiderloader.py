@@ -0,0 +1,85 @@
+# A spider loader that only imports the spider it is asked for.
+#
+# Scrapy's SpiderLoader imports every module in SPIDER_MODULES when a command
+# starts, so `scrapy crawl books` also pays for the imports of books_items
+# (ItemLoader, the parse pool, ...) and books_xpath. LazySpiderLoader reads the
+# spider names from the source files instead (the `name = "..."` line of each
+# class) and imports the one module that defines the requested spider.
+# Anything it cannot answer from that index (a name set in some other way,
+# `scrapy list`, finding a spider by URL) falls back to loading everything,
+# exactly like the default loader.
+#
+# Enabled with SPIDER_LOADER_CLASS = "ebook_scraper.spiderloader.LazySpiderLoader".
+
+import importlib
+import pkgutil
+import re
+from collections import defaultdict
+
+from scrapy.spiderloader import SpiderLoader
+
+# A class attribute like `    name = "books_items"` (commented-out lines do not match)
+NAME = re.compile(r'''^[ \t]+name\s*=\s*['"]([^'"]+)['"]''', re.MULTILINE)
+
+
+def index_spider_modules(packages):
+    '''
+    Maps the spider names found in the source files to their module names.
+    '''
+    index = {}
+    for package_name in packages:
+        package = importlib.import_module(package_name)
+        modules = [(package_name, getattr(package, '__file__', None))]
+        for info in pkgutil.walk_packages(getattr(package, '__path__', []), package_name + '.'):
+            spec = info.module_finder.find_spec(info.name)
+            modules.append((info.name, spec.origin if spec else None))
+        for module_name, path in modules:
+            if not path or not path.endswith('.py'):
+                continue
+            with open(path, encoding='utf-8') as f:
+                for name in NAME.findall(f.read()):
+                    index.setdefault(name, module_name)
+    return index
+
+
+class LazySpiderLoader(SpiderLoader):
+    '''
+    SpiderLoader that imports spider modules on demand.
+    '''
+
+    def __init__(self, settings):
+        self.spider_modules = settings.getlist('SPIDER_MODULES')
+        self.warn_only = settings.getbool('SPIDER_LOADER_WARN_ONLY')
+        self._spiders = {}
+        self._found = defaultdict(list)
+        self._loaded_all = False
+        try:
+            self.index = index_spider_modules(self.spider_modules)
+        except (ImportError, OSError):
+            # Let the default loader report (or warn about) the broken module
+            self.index = {}
+            self._load_everything()
+
+    def load(self, spider_name):
+        if spider_name not in self._spiders and spider_name in self.index:
+            self._load_spiders(importlib.import_module(self.index[spider_name]))
+        if spider_name not in self._spiders:
+            self._load_everything()
+        return super().load(spider_name)
+
+    def find_by_request(self, request):
+        self._load_everything()
+        return super().find_by_request(request)
+
+    def list(self):
+        self._load_everything()
+        return super().list()
+
+    def _load_everything(self):
+        if self._loaded_all:
+            return
+        self._loaded_all = True
+        # Start over so modules imported on demand are not counted twice
+        self._spiders = {}
+        self._found = defaultdict(list)
+        self._load_all_spiders()
@@ -1,6 +1,15 @@
 # METHOD - 1
+import os
+
 import scrapy
-from ebook_scraper.items import EbookItem
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.misc import load_object
+from ebook_scraper.items import EbookDetailItem, EbookItem, normalize_book
+from ebook_scraper.extractors import (extract_book_details, extract_books_from_response, extract_page_count,
+                                      note_drift)
+from ebook_scraper.parsepool import ParsePool
+from ebook_scraper.shards import ShardWriter
 from scrapy.loader import ItemLoader
 from itemloaders.processors import TakeFirst
 
@@ -14,43 +23,138 @@ class BookSpider(scrapy.Spider):
         Multiple Parameters: If you need to send POST requests or manipulate the initial requests (e.g., adding headers or parameters), you can do this inside start_requests().
     '''
         
+    # The first page of the catalogue (can be changed with -a start_url=...)
+    start_url = "https://books.toscrape.com/catalogue/page-1.html"
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+
+        # EBOOK_PARSE_PROCESSES > 0: extract the books in that many worker processes
+        processes = crawler.settings.getint('EBOOK_PARSE_PROCESSES')
+        if processes:
+            spider.parse_pool = ParsePool(processes, crawler.settings.getint('EBOOK_PARSE_MAX_IN_FLIGHT'))
+            crawler.signals.connect(spider.parse_pool.close, signal=signals.spider_closed)
+
+        # Fan-out pages held back behind a page that never arrived are let go once the crawl is idle
+        crawler.signals.connect(spider.fanout_idle, signal=signals.spider_idle)
+
+        # EBOOK_SHARD_QUEUE: this process is one worker of a sharded crawl (`scrapy shard`)
+        # and takes its pages from the shared work queue (ebook_scraper/workqueue.py)
+        if crawler.settings.get('EBOOK_SHARD_QUEUE'):
+            queue_class = load_object(crawler.settings.get('EBOOK_SHARD_QUEUE_CLASS',
+                                                           'ebook_scraper.workqueue.SQLiteWorkQueue'))
+            spider.work_queue = queue_class.from_settings(crawler.settings)
+            spider.worker = crawler.settings.get('EBOOK_SHARD_WORKER') or str(os.getpid())
+            spider.claimed = 0
+            spider.poll_call = None
+            # Per task: the items still on their way through the pipelines, and
+            # the tasks whose callback is through
+            spider.task_items = {}
+            spider.callbacks_done = set()
+            # The worker's shard, written as the items come out of the pipelines
+            spider.shard = ShardWriter()
+            crawler.signals.connect(spider.shard.write, signal=signals.item_scraped)
+            for signal in (signals.item_scraped, signals.item_dropped, signals.item_error):
+                crawler.signals.connect(spider.task_item_done, signal=signal)
+            crawler.signals.connect(spider.shard_idle, signal=signals.spider_idle)
+            crawler.signals.connect(spider.shard_closed, signal=signals.spider_closed)
+        return spider
+
     # This is where we manually define the initial URLs
     def start_requests(self):
-        # Start with the first page of the website
-        url = "https://books.toscrape.com/catalogue/page-1.html"
-            
+        # A shard worker starts with whatever the queue hands it
+        if hasattr(self, 'work_queue'):
+            yield from self.claim_requests()
+            return
+
         # Send an initial request to the first page
-        yield scrapy.Request(url=url, callback=self.parse)
-    
+        yield scrapy.Request(url=self.start_url, callback=self.page_callback, meta={'page': 1})
+
+    @property
+    def enrich(self):
+        # EBOOK_ENRICH_DETAILS: visit every book's detail page for UPC, description, category and stock count
+        return self.settings.getbool('EBOOK_ENRICH_DETAILS')
+
+    @property
+    def page_callback(self):
+        # The callback for catalogue pages: parse() or, with a process pool, parse_in_pool()
+        return self.parse_in_pool if hasattr(self, 'parse_pool') else self.parse
+
     # This is the main callback method that will process the response from the start URLs
     def parse(self, response):
+        try:
+            # Pages flagged by IncrementalDownloaderMiddleware have not changed since the
+            # last run, so only their pagination is needed
+            if response.meta.get('page_unchanged'):
+                ebooks = []
+            else:
+                # Each book is inside an article container with class = "product_pod".
+                # extract_books_from_response() reads all of them in one pass and returns
+                # plain records, e.g. {'title': ..., 'rating': 'Three', 'price': '£51.77', ...,
+                # 'url': ...} with the link to the book's detail page
+                ebooks = extract_books_from_response(response, links=True)
 
-        # Each book is inside an article container with class = "product_pod"
-        ebooks = response.css('article.product_pod')
+            yield from self.handle_page(response, ebooks)
+        except Exception:
+            # Scrapy still logs the error, but in fan-out mode the pages after
+            # this one must not wait for it
+            yield from self.release_failed_page(response.meta.get('page'))
+            raise
 
-        # 'ebooks' is assumed to be a list of HTML nodes, each representing an individual ebook.
-        for ebook in ebooks:
-            # Create an ItemLoader instance for each ebook
-            loader = ItemLoader(item=EbookItem(), selector=ebook)
+    async def parse_in_pool(self, response):
+        # Same as parse(), but the CPU-heavy extraction runs in a worker process
+        # while the reactor thread keeps downloading
+        try:
+            ebooks = []
+            if not response.meta.get('page_unchanged'):
+                ebooks, drift = await self.parse_pool.extract(response.text, links=True)
+                note_drift(response, drift)
 
-            # You don’t need to define processors here, just specify the fields
-            loader.add_css('title', 'h3>a::attr(title)')
-            loader.add_css('rating', 'p.star-rating::attr(class)')
-            loader.add_css('price', 'div.product_price>p.price_color::text')
+            for result in self.handle_page(response, ebooks):
+                yield result
+        except Exception:
+            for result in self.release_failed_page(response.meta.get('page')):
+                yield result
+            raise
 
-            # Handling stock_status
-            check_stock = ebook.css('p.instock.availability>i::attr(class)').get()
+    def handle_page(self, response, ebooks):
+        # Turns the extracted records of a page into items and requests more pages
 
-            if check_stock != "icon-ok":
-                loader.add_value('stock_status', "Not In Stock")
-            else:
-                stock_status = ebook.css('p.instock.availability::text').getall()
-                loader.add_value('stock_status', stock_status)
+        # The detail page URL is the book's key (incremental.book_key), and the
+        # same page is linked as "../../x/index.html" or "x/index.html"
+        for ebook in ebooks:
+            if ebook['url'] is not None:
+                ebook['url'] = response.urljoin(ebook['url'])
+
+        if hasattr(self, 'work_queue'):
+            yield from self.share_page(response, ebooks)
+            return
 
-            loader.default_output_processor = TakeFirst()
+        if self.enrich:
+            # The items are only complete once their detail page is in, so the
+            # page yields detail requests where it would otherwise yield items
+            items = (self.detail_request(response, ebook) for ebook in ebooks)
+        else:
+            items = (self.make_item(ebook) for ebook in ebooks)
 
-            # Yield the item (instead of a dictionary)
-            yield loader.load_item()
+        # EBOOK_PAGINATION = "fanout": read "Page 1 of N" from the first page and
+        # schedule every other page at once, instead of following "next" page by page
+        if self.settings.get('EBOOK_PAGINATION', 'next') == 'fanout':
+            page = response.meta.get('page')
+            if page == 1:
+                page_count = extract_page_count(response)
+                if page_count:
+                    yield from self.schedule_pages(response, page_count)
+                    yield from self.release_page(page, items)
+                    return
+            elif page is not None:
+                yield from self.release_page(page, items)
+                return
+            # Without a page count we fall back to following the "next" links
+
+        # Yield the items (instead of dictionaries)
+        yield from items
 
         # Handle pagination by finding the next page link
         next_url = response.css('li.next a::attr(href)').get()
@@ -58,7 +162,277 @@ class BookSpider(scrapy.Spider):
         if next_url:
             # Construct the full URL and make a new request
             next_page = response.urljoin(next_url)
-            yield scrapy.Request(next_page, callback=self.parse)
+            yield scrapy.Request(next_page, callback=self.page_callback)
+
+    def schedule_pages(self, response, page_count):
+        '''
+        Requests pages 2..page_count in one go.
+
+        Scrapy downloads them concurrently, bounded by CONCURRENT_REQUESTS and
+        CONCURRENT_REQUESTS_PER_DOMAIN. The priority makes lower page numbers
+        leave the scheduler first, so the pages that release_page() is waiting
+        for arrive early and little has to be held back.
+        '''
+        # Pages that finished out of order, held back until the pages before them are done
+        self.finished_pages = {}
+        self.next_page_to_release = 1
+
+        for page in range(2, page_count + 1):
+            yield scrapy.Request(
+                response.urljoin('page-%d.html' % page),
+                callback=self.page_callback,
+                errback=self.page_failed,
+                priority=-page,
+                meta={'page': page},
+            )
+
+    def release_page(self, page, ebooks):
+        # Items (or detail requests) leave the spider in page order no matter
+        # which download finished first
+        self.finished_pages[page] = list(ebooks)
+        while self.next_page_to_release in self.finished_pages:
+            yield from self.finished_pages.pop(self.next_page_to_release)
+            self.next_page_to_release += 1
+
+    def page_failed(self, failure):
+        # A page that could not be downloaded must not hold back the pages after it
+        self.logger.error('Failed to download %s: %r', failure.request.url, failure.value)
+        yield from self.release_failed_page(failure.request.meta['page'])
+
+    def release_failed_page(self, page):
+        # Releases a fan-out page without its items, unless it was released already
+        if page is None or not hasattr(self, 'finished_pages'):
+            return
+        if page < self.next_page_to_release or page in self.finished_pages:
+            return
+        yield from self.release_page(page, [])
+
+    def fanout_idle(self):
+        # Nothing left to crawl, yet pages are held back: the pages before them
+        # are not coming (e.g. dropped by a downloader middleware). A request
+        # that needs no download brings the held pages out through a callback,
+        # in page order, while the pipelines are still open
+        if not getattr(self, 'finished_pages', None):
+            return
+        self.crawler.engine.crawl(scrapy.Request('data:,', callback=self.release_held_pages, dont_filter=True))
+        raise DontCloseSpider
+
+    def release_held_pages(self, response):
+        missing = max(self.finished_pages) + 1 - self.next_page_to_release - len(self.finished_pages)
+        self.crawler.stats.inc_value('fanout/pages_missing', missing, spider=self)
+        self.logger.warning('Releasing %d held back pages, %d pages before them never arrived',
+                            len(self.finished_pages), missing)
+        for page in sorted(self.finished_pages):
+            yield from self.finished_pages.pop(page)
+            self.next_page_to_release = page + 1
+
+    def closed(self, reason):
+        # By now the pipelines are closed, so whatever is still held back (the
+        # crawl was stopped before it went idle, e.g. by CLOSESPIDER_ITEMCOUNT)
+        # can only be counted
+        held = sum(len(ebooks) for ebooks in getattr(self, 'finished_pages', {}).values())
+        if held:
+            self.crawler.stats.set_value('fanout/items_not_released', held, spider=self)
+            self.logger.warning('%d items of %d pages were still held back at the close (%s)',
+                                held, len(self.finished_pages), reason)
+
+    def detail_request(self, response, ebook):
+        '''
+        Requests the detail page of one book from the listing.
+
+        The listing fields travel in the request's meta, so with a JOBDIR they
+        wait in the on-disk request queue together with the request instead of
+        in a dictionary of half finished items. The higher priority lets detail
+        pages leave the scheduler before more catalogue pages, which keeps the
+        number of pending requests close to one page worth of books.
+        '''
+        return scrapy.Request(
+            ebook['url'],
+            callback=self.parse_detail,
+            errback=self.detail_failed,
+            priority=1,
+            meta={'listing': ebook},
+        )
+
+    def parse_detail(self, response):
+        # Merge the listing fields with the detail page into one item right away
+        ebook = dict(response.meta['listing'], **extract_book_details(response))
+        if 'task' not in response.meta:
+            yield self.make_item(ebook)
+            return
+
+        yield from self.task_output(response.meta['task'], [self.make_item(ebook)])
+        self.task_done(response.meta['task'])
+
+    def detail_failed(self, failure):
+        # A book whose detail page could not be downloaded still goes out with
+        # its listing fields, the detail fields left empty
+        self.logger.error('Failed to download %s: %r', failure.request.url, failure.value)
+        self.crawler.stats.inc_value('enrich/detail_failed', spider=self)
+        yield self.make_item(dict(failure.request.meta['listing'], upc=None, description=None,
+                                  category=None, stock_count=None))
+
+    # Sharded crawls: every worker process runs this spider with EBOOK_SHARD_QUEUE.
+    # Pages and detail pages are not requested directly but queued as tasks, so
+    # whichever worker has room fetches them next.
+
+    def claim_requests(self):
+        # Leases tasks from the queue, up to EBOOK_SHARD_CLAIM_SIZE in flight per worker
+        limit = self.settings.getint('EBOOK_SHARD_CLAIM_SIZE', 32) - self.claimed
+        if limit <= 0:
+            return
+        for task_id, task in self.work_queue.claim(self.worker, limit):
+            self.claimed += 1
+            meta = {'task': task_id}
+            if task['kind'] == 'detail':
+                meta['listing'] = task['listing']
+                callback = self.parse_detail
+            else:
+                meta['page'] = task.get('page')
+                callback = self.page_callback
+            # The queue already holds every URL once, and a task given back after a
+            # failure must be fetched again
+            yield scrapy.Request(task['url'], callback=callback, errback=self.task_failed,
+                                 meta=meta, dont_filter=True)
+
+    def share_page(self, response, ebooks):
+        task_id = response.meta['task']
+        tasks = []
+        if self.enrich:
+            tasks.extend({'url': ebook['url'], 'kind': 'detail', 'listing': ebook} for ebook in ebooks)
+        else:
+            yield from self.task_output(task_id, (self.make_item(ebook) for ebook in ebooks))
+
+        # Page 1 queues every other page, so all workers get busy at once. Without
+        # a page count the "next" page is queued instead
+        page_count = extract_page_count(response) if response.meta.get('page') == 1 else None
+        if page_count:
+            tasks.extend({'url': response.urljoin('page-%d.html' % page), 'kind': 'page', 'page': page}
+                         for page in range(2, page_count + 1))
+        elif not response.meta.get('page') or response.meta['page'] == 1:
+            next_url = response.css('li.next a::attr(href)').get()
+            if next_url:
+                tasks.append({'url': response.urljoin(next_url), 'kind': 'page', 'page': None})
+        if tasks:
+            self.work_queue.put(tasks)
+
+        self.task_done(task_id)
+
+    def task_output(self, task_id, items):
+        # Counts the items of a task before they go to the pipelines
+        for item in items:
+            self.task_items[task_id] = self.task_items.get(task_id, 0) + 1
+            yield item
+
+    def task_item_done(self, response):
+        # item_scraped, item_dropped or item_error: one item of a task is through
+        # the pipelines (and, when scraped, written to the shard)
+        task_id = response.meta.get('task') if response is not None else None
+        if task_id not in self.task_items:
+            return
+        self.task_items[task_id] -= 1
+        self.ack_if_done(task_id)
+
+    def task_done(self, task_id):
+        # The callback of the task is through, its items may still be in the pipelines
+        self.task_items.setdefault(task_id, 0)
+        self.callbacks_done.add(task_id)
+        self.ack_if_done(task_id)
+
+    def ack_if_done(self, task_id):
+        '''
+        Acks a task once its callback and all of its items are through.
+
+        The items are in the shard file by then, flushed to the operating
+        system, so they survive the worker being killed. A worker that dies
+        before the ack leaves the task to be leased again: its items may then
+        be in two shards, which merge_shards() dedupes.
+        '''
+        if self.task_items[task_id] or task_id not in self.callbacks_done:
+            return
+        del self.task_items[task_id]
+        self.callbacks_done.discard(task_id)
+        self.shard.flush()
+        self.work_queue.ack(task_id)
+        self.claimed -= 1
+        for request in self.claim_requests():
+            self.crawler.engine.crawl(request)
+
+    def task_failed(self, failure):
+        self.logger.error('Failed to download %s: %r', failure.request.url, failure.value)
+        self.work_queue.fail(failure.request.meta['task'])
+        self.claimed -= 1
+        yield from self.claim_requests()
+
+    def shard_idle(self):
+        # Nothing left in this worker. Until the whole queue is finished, other
+        # workers may still add tasks (page 1 queues the rest of the catalogue),
+        # so keep polling instead of closing
+        if self.work_queue.finished():
+            return
+        if self.poll_call is None:
+            self.poll_queue()
+        raise DontCloseSpider
+
+    def poll_queue(self):
+        from twisted.internet import reactor
+
+        self.poll_call = None
+        requests = list(self.claim_requests())
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if requests:
+            return
+        if self.work_queue.finished():
+            # Called while this worker is idle, so there is nothing left to wait for
+            self.crawler.engine.close_spider(self, 'finished')
+        else:
+            self.poll_call = reactor.callLater(self.settings.getfloat('EBOOK_SHARD_POLL_INTERVAL', 0.2),
+                                               self.poll_queue)
+
+    def shard_closed(self, spider):
+        if self.poll_call is not None and self.poll_call.active():
+            self.poll_call.cancel()
+        self.work_queue.close()
+        self.shard.close()
+
+    def make_item(self, ebook):
+        # With EBOOK_ITEM_FAST_PATH the records are cleaned by one plain function
+        # into slotted EbookRecord objects, without an ItemLoader per book
+        if self.settings.getbool('EBOOK_ITEM_FAST_PATH'):
+            return normalize_book(ebook)
+        return self.load_item(ebook)
+
+    def checkpoint_state(self):
+        # Saved by CheckpointMiddleware: the fan-out ordering, including the
+        # items of pages that are held back
+        if not hasattr(self, 'finished_pages'):
+            return None
+        return {'finished_pages': self.finished_pages, 'next_page_to_release': self.next_page_to_release}
+
+    def restore_checkpoint(self, state):
+        self.finished_pages = state['finished_pages']
+        self.next_page_to_release = state['next_page_to_release']
+
+    def load_item(self, ebook):
+        # Create an ItemLoader instance for each ebook, with the detail page
+        # fields only for books merged with their detail page
+        loader = ItemLoader(item=EbookDetailItem() if 'upc' in ebook else EbookItem())
+
+        # The input processors of EbookItem still clean up every value
+        loader.add_value('title', ebook['title'])
+        loader.add_value('rating', ebook['rating'])
+        loader.add_value('price', ebook['price'])
+        loader.add_value('stock_status', ebook['stock_status'])
+        loader.add_value('url', ebook.get('url'))
+
+        # Detail page fields in enrichment mode (None values are skipped)
+        for field in ('upc', 'description', 'category', 'stock_count'):
+            if field in ebook:
+                loader.add_value(field, ebook[field])
+
+        loader.default_output_processor = TakeFirst()
+        return loader.load_item()
 
 # # METHOD - 2
 # import scrapy
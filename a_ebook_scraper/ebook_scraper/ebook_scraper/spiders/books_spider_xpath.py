@@ -1,4 +1,29 @@
 import scrapy  # Importing the Scrapy framework for web scraping
+from lxml import etree
+from ebook_scraper.extractors import (CARD_FALLBACKS, PRODUCT_PODS, broken_card_fields, card_is_valid, note_drift,
+                                      repair)
+
+# The XPath version of the books spider: one expression per field, like before,
+# but compiled once here instead of being parsed again for every book. Each one
+# is run on the lxml element of a card and returns a plain string ('' when
+# nothing matches), so there is no Selector per field either.
+
+# The title and the detail page link are attributes of the <a> inside <h3>
+TITLE = etree.XPath('string(./h3/a/@title)')
+URL = etree.XPath('string(./h3/a/@href)')
+
+# The class attribute holds both 'star-rating' and the rating itself (e.g. 'star-rating Three')
+RATING_CLASS = etree.XPath('string(./p[contains(concat(" ", @class, " "), " star-rating ")]/@class)')
+
+# The price text (e.g. '£45.17') of the <p class="price_color"> below <div class="product_price">
+PRICE = etree.XPath('string(./div[@class="product_price"]/p[@class="price_color"]/text())')
+
+# The availability <p> sits inside <div class="product_price"> as well. The
+# <i class="icon-ok"> marker tells us the book is in stock; normalize-space()
+# joins and strips the text around it (e.g. 'In stock')
+IN_STOCK = etree.XPath('boolean(./div[@class="product_price"]/p[contains(@class, "instock")]/i[@class="icon-ok"])')
+STOCK_TEXT = etree.XPath('normalize-space(./div[@class="product_price"]/p[contains(@class, "instock")])')
+
 
 # Define a new spider class that inherits from scrapy.Spider
 class BookSpider(scrapy.Spider):
@@ -10,48 +35,41 @@ class BookSpider(scrapy.Spider):
 
     # This is the main callback method that will process the response from the start URLs
     def parse(self, response):
-        # Print a message to indicate that the response object has been received
-        print("[PARSE]")
-        
-        # Each book is inside an article container with class = "product_pod"
-        # Selects all article elements with the class "product_pod" which represent individual ebooks
-        ebooks = response.xpath('//article[@class="product_pod"]')
-        
-        # 'ebooks' is assumed to be a list of HTML nodes, each representing an individual ebook.
-        for ebook in ebooks:
-            
-            # Extract the title attribute from the <a> tag that is a direct child of the <h3> tag.
-            # @title is used to select the 'title' attribute.
-            title = ebook.xpath('./h3/a/@title').get()
-            
-            # Extract the class attribute from the <p> tag with class "star-rating".
-            # The class attribute contains both 'star-rating' and the rating itself (e.g., 'Three').
-            # Split the class attribute by space and get the second part, which is the actual rating (e.g., 'Three').
-            rating = ebook.xpath('./p[contains(@class, "star-rating")]/@class').get().split(' ')[1]
-            
-            # Extract the text content inside the <p> tag with class "price_color" for the ebook price.
-            # This selects the price text (e.g., '£45.17').
-            price = ebook.xpath('./div[@class="product_price"]/p[@class="price_color"]/text()').get()
-            
-            # Check the class of the <i> tag within the <p> tag to determine stock availability.
-            # The class 'icon-ok' indicates that the item is in stock.
-            check_stock = ebook.xpath('./p[@class="instock availability"]/i/@class').get()
-            
-            # If the class is not 'icon-ok', set stock_status to "Not In Stock".
-            if check_stock != "icon-ok":
-                stock_status = "Not In Stock"
-            else:
-                # Extract the stock status from the <p> tag with classes 'instock availability'.
-                # getall() retrieves all the text content inside this tag, which might be split by line breaks or spaces.
-                # ''.join(stock_status) merges the list into a single string, and strip() removes any leading/trailing whitespace.
-                stock_status = ebook.xpath('./p[@class="instock availability"]/text()').getall()
-                stock_status = ''.join(stock_status).strip()
-            
-            # Yield a dictionary containing the extracted title, rating, price, and stock status.
-            # 'yield' will return this dictionary to the calling function while keeping the state of the loop.
-            yield {
-                'title': title,           # Title of the ebook
-                'rating': rating,         # Star rating of the ebook (e.g., 'Three', 'Four', etc.)
-                'price': price,           # Price of the ebook (e.g., '£45.17')
-                'stock_status': stock_status  # Stock availability (e.g., 'In stock' or 'Not In Stock')
+        # Pages flagged by IncrementalDownloaderMiddleware have not changed since the last run
+        if response.meta.get('page_unchanged'):
+            return
+
+        drift = {}
+        books = 0
+        # Each book is inside an article container with class = "product_pod".
+        # response.selector.root is the lxml tree parsel has already built, so the
+        # compiled expressions run on it directly
+        for ebook in PRODUCT_PODS(response.selector.root):
+            rating = RATING_CLASS(ebook).split()
+
+            # Stock status is "Not In Stock" unless the icon-ok marker is there
+            stock_status = STOCK_TEXT(ebook) if IN_STOCK(ebook) else "Not In Stock"
+
+            book = {
+                'title': TITLE(ebook) or None,                       # Title of the ebook
+                'rating': rating[1] if len(rating) > 1 else None,    # Star rating (e.g., 'Three')
+                'price': PRICE(ebook) or None,                       # Price of the ebook (e.g., '£45.17')
+                'stock_status': stock_status,                        # 'In stock' or 'Not In Stock'
             }
+            # When the markup has changed, the fallback selectors of the extractors
+            # try to recover the fields (counted for DriftMiddleware)
+            if not card_is_valid(book):
+                book = repair(ebook, book, broken_card_fields(book), CARD_FALLBACKS, drift)
+
+            # The link to the book's detail page tells two books with the same title apart
+            url = URL(ebook)
+            book['url'] = response.urljoin(url) if url else None
+
+            books += 1
+            # 'yield' will return this dictionary to the calling function while keeping the state of the loop.
+            yield book
+
+        # A page without a single card is a sign of changed markup too
+        if not books:
+            drift['no_books'] = 1
+        note_drift(response, drift)
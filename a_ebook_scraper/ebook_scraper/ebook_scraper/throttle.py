@@ -0,0 +1,233 @@
+# Adaptive per-domain concurrency, as a replacement for tuning
+# CONCURRENT_REQUESTS_PER_DOMAIN / DOWNLOAD_DELAY / AutoThrottle by hand.
+#
+# Every downloader slot (one per domain) gets a SlotController that runs an
+# AIMD loop, the same idea TCP uses for its congestion window:
+#   - after every "round" (as many responses as the current concurrency) the
+#     concurrency grows, doubling while in slow start and by one afterwards
+#   - when the p90 latency of the recent responses jumps well above the
+#     long-term average, requests are queueing up at the server, so the
+#     concurrency is trimmed a little
+#   - a 429 or 5xx halves it, and a Retry-After header pauses the slot. The
+#     concurrency it happened at becomes a ceiling that is only probed again
+#     after a while, so the crawl settles just below the limit instead of
+#     running into it (and its Retry-After pauses) over and over
+# AutoThrottle only ever changes the delay between requests; this changes how
+# many requests are in flight, which is what a rate limit usually counts.
+#
+# Enable with EXTENSIONS = {"ebook_scraper.throttle.AdaptiveThrottle": 500}
+# and ADAPTIVE_THROTTLE_ENABLED = True (and leave AUTOTHROTTLE_ENABLED off).
+
+import collections
+import email.utils
+import logging
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    value = value.decode('latin-1') if isinstance(value, bytes) else value
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SlotController:
+    '''
+    The concurrency decisions for one downloader slot.
+
+    observe() is fed every response and returns what it decided: None, or one
+    of 'increase', 'decrease/latency', 'decrease/status_<code>'.
+    '''
+
+    def __init__(self, start=2, minimum=1, maximum=64, backoff=0.5,
+                 tolerance=2.0, latency_floor=0.05, probe_interval=30.0, window=100):
+        self.concurrency = float(start)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.latency_floor = latency_floor
+        self.probe_interval = probe_interval
+        # The concurrency the server last rejected requests at, and until when to stay below it
+        self.ceiling = None
+        self.ceiling_until = float('-inf')
+        self.latencies = collections.deque(maxlen=window)
+        self.slow_start = True
+        self.baseline = None
+        self.responses = 0
+        self.last_decrease = float('-inf')
+        self.p50 = self.p90 = None
+
+    def observe(self, latency, status, now=None):
+        now = time.monotonic() if now is None else now
+        if status == 429 or status >= 500:
+            # One burst of errors comes from requests that were all sent at the
+            # old concurrency, so back off at most once per round trip
+            if now - self.last_decrease < (self.p90 or 1.0):
+                return None
+            self.ceiling = self.concurrency
+            self.ceiling_until = now + self.probe_interval
+            return self._decrease(self.backoff, 'decrease/status_%d' % status, now)
+
+        self.latencies.append(latency)
+        self.responses += 1
+        if self.responses < self.concurrency:
+            return None
+        self.responses = 0
+
+        ordered = sorted(self.latencies)
+        self.p50 = ordered[len(ordered) // 2]
+        self.p90 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+        # A slow moving average, so the latency may drift up a bit as the
+        # concurrency grows but a sudden jump stands out
+        if self.baseline is None:
+            self.baseline = self.p50
+        else:
+            self.baseline += 0.1 * (self.p50 - self.baseline)
+
+        if self.p90 > self.tolerance * max(self.baseline, self.latency_floor):
+            return self._decrease(0.9, 'decrease/latency', now)
+
+        limit = self.maximum
+        if now < self.ceiling_until:
+            limit = max(self.minimum, min(limit, self.ceiling - 1))
+        if self.concurrency >= limit:
+            return None
+        if self.slow_start:
+            self.concurrency = min(limit, self.concurrency * 2)
+        else:
+            self.concurrency = min(limit, self.concurrency + 1)
+        return 'increase'
+
+    def _decrease(self, factor, decision, now):
+        self.slow_start = False
+        self.last_decrease = now
+        self.responses = 0
+        self.concurrency = max(self.minimum, self.concurrency * factor)
+        # Requests sent before the backoff would otherwise count as congestion
+        self.latencies.clear()
+        return decision
+
+
+class AdaptiveThrottle:
+    '''
+    Applies the decisions of a SlotController to every downloader slot.
+
+    The decisions are counted in the stats (adaptive_throttle/increase,
+    adaptive_throttle/decrease/latency, ...), and the current and highest
+    concurrency and the recent latency percentiles of every slot are kept
+    under adaptive_throttle/<slot>/.
+    '''
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        if settings.getbool('AUTOTHROTTLE_ENABLED'):
+            logger.warning('AdaptiveThrottle sets the concurrency of every download slot and AutoThrottle '
+                           'their delay, so the two work against each other: disable AUTOTHROTTLE_ENABLED')
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.options = {
+            'start': settings.getint('ADAPTIVE_THROTTLE_START_CONCURRENCY', 2),
+            'minimum': 1,
+            'maximum': settings.getint('ADAPTIVE_THROTTLE_MAX_CONCURRENCY', 64),
+            'backoff': settings.getfloat('ADAPTIVE_THROTTLE_BACKOFF', 0.5),
+            'tolerance': settings.getfloat('ADAPTIVE_THROTTLE_LATENCY_TOLERANCE', 2.0),
+            'latency_floor': settings.getfloat('ADAPTIVE_THROTTLE_LATENCY_FLOOR', 0.05),
+            'probe_interval': settings.getfloat('ADAPTIVE_THROTTLE_PROBE_INTERVAL', 30.0),
+        }
+        self.max_pause = settings.getfloat('ADAPTIVE_THROTTLE_MAX_PAUSE', 60.0)
+        self.controllers = {}
+        # Slots paused by Retry-After: key -> (call that ends the pause, (delay, randomize_delay)
+        # to restore, monotonic time the pause started)
+        self.paused = {}
+
+        crawler.signals.connect(self.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def response_downloaded(self, response, request, spider):
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        latency = request.meta.get('download_latency')
+        if slot is None or latency is None:
+            return
+
+        controller = self.controllers.get(key)
+        if controller is None:
+            controller = self.controllers[key] = SlotController(**self.options)
+
+        now = time.monotonic()
+        decision = controller.observe(latency, response.status, now)
+        self.apply_retry_after(key, slot, response, now, latency)
+
+        slot.concurrency = max(1, int(controller.concurrency))
+        if decision is None:
+            return
+
+        self.stats.inc_value('adaptive_throttle/%s' % decision, spider=spider)
+        prefix = 'adaptive_throttle/%s/' % key
+        self.stats.set_value(prefix + 'concurrency', slot.concurrency, spider=spider)
+        self.stats.max_value(prefix + 'max_concurrency', slot.concurrency, spider=spider)
+        if controller.p50 is not None:
+            self.stats.set_value(prefix + 'latency_p50_ms', round(controller.p50 * 1000, 1), spider=spider)
+            self.stats.set_value(prefix + 'latency_p90_ms', round(controller.p90 * 1000, 1), spider=spider)
+        logger.debug('%s: %s to concurrency %d (p50 %s, p90 %s)', key, decision, slot.concurrency,
+                     controller.p50, controller.p90, extra={'spider': spider})
+
+    def apply_retry_after(self, key, slot, response, now, latency):
+        from twisted.internet import reactor
+
+        # The slot sends one request per Retry-After seconds until the pause is over
+        if response.status not in (429, 503):
+            return
+        paused = self.paused.get(key)
+        if paused is not None and now - latency < paused[2]:
+            # Sent before the pause, with the rest of the burst that caused it:
+            # starting the pause over for each of them would stall the slot for
+            # as many Retry-After periods as requests were in flight
+            return
+        pause = parse_retry_after(response.headers.get('Retry-After'))
+        if not pause:
+            return
+        pause = min(pause, self.max_pause)
+        if paused is None:
+            restore = (slot.delay, slot.randomize_delay)
+        else:
+            paused[0].cancel()
+            restore = paused[1]
+        # Not randomized, which could send the next request after half the pause
+        slot.delay = max(restore[0], pause)
+        slot.randomize_delay = False
+        self.paused[key] = (reactor.callLater(pause, self.resume, key, slot), restore, now)
+        self.stats.inc_value('adaptive_throttle/retry_after')
+        self.stats.max_value('adaptive_throttle/%s/max_pause' % key, pause)
+
+    def resume(self, key, slot):
+        _, (slot.delay, slot.randomize_delay), _ = self.paused.pop(key)
+        # The downloader already planned the slot's next request a whole pause
+        # after its last one; bring that forward to now
+        if slot.latercall is not None and slot.latercall.active():
+            slot.latercall.reset(0)
+
+    def spider_closed(self, spider):
+        for call, _, _ in self.paused.values():
+            if call.active():
+                call.cancel()
+        self.paused.clear()
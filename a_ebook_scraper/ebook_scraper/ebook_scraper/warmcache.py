@@ -0,0 +1,240 @@
+# Warm start for frequent small crawls: robots.txt rules and DNS answers are
+# kept in one SQLite file between runs, and the connection pool is sized to the
+# crawl's concurrency.
+#
+# Every run used to fetch robots.txt before its first real request (which waits
+# for it), resolve the host again and, with more requests in flight per host
+# than the pool keeps idle connections for, open and close connections over and
+# over. The components here (see settings.py for how to enable them):
+#   - CachedRobotsTxtMiddleware (in place of Scrapy's RobotsTxtMiddleware)
+#     reuses a robots.txt fetched less than WARM_CACHE_ROBOTS_TTL seconds ago
+#   - PersistentCachingResolver (DNS_RESOLVER) reuses addresses resolved less
+#     than WARM_CACHE_DNS_TTL seconds ago
+#   - TunedHTTP11DownloadHandler (DOWNLOAD_HANDLERS) keeps as many idle
+#     connections per host as requests can be in flight to it, for
+#     HTTP_KEEPALIVE_TIMEOUT seconds
+#   - WarmCacheStats (EXTENSIONS) puts the hits, misses, connections opened and
+#     the time the cache saved into the stats (warm_cache/...)
+# The time saved is what the cached robots.txt download or DNS lookup took
+# when it was made.
+
+import os
+import sqlite3
+import time
+
+from scrapy import signals
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.downloadermiddlewares.robotstxt import RobotsTxtMiddleware
+from scrapy.exceptions import NotConfigured
+from scrapy.resolver import CachingThreadedResolver, dnscache
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.project import data_path
+from twisted.internet import defer
+
+
+def cache_path(settings):
+    path = settings.get('WARM_CACHE_FILE') or str(data_path('warmcache.sqlite', createdir=True))
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return path
+
+
+class WarmCacheStore:
+    '''
+    Values with the time they were stored and what it cost to get them.
+    '''
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, timeout=10.0, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB,
+                stored REAL NOT NULL,
+                cost REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            )
+        ''')
+
+    def get(self, kind, key, ttl):
+        # (value, cost) if stored less than ttl seconds ago, else None
+        row = self.connection.execute(
+            'SELECT value, cost FROM entries WHERE kind = ? AND key = ? AND stored > ?',
+            (kind, key, time.time() - ttl),
+        ).fetchone()
+        return row
+
+    def put(self, kind, key, value, cost):
+        self.connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                                (kind, key, value, time.time(), cost))
+
+    def close(self):
+        self.connection.close()
+
+
+class CachedRobotsTxtMiddleware(RobotsTxtMiddleware):
+    '''
+    RobotsTxtMiddleware that reuses robots.txt files fetched by earlier runs.
+    '''
+
+    def __init__(self, crawler):
+        super().__init__(crawler)
+        # Without WARM_CACHE_ENABLED this is just Scrapy's middleware, which it replaces
+        self.store = None
+        if crawler.settings.getbool('WARM_CACHE_ENABLED'):
+            self.ttl = crawler.settings.getfloat('WARM_CACHE_ROBOTS_TTL', 86400.0)
+            self.store = WarmCacheStore(cache_path(crawler.settings))
+            crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    def robot_parser(self, request, spider):
+        url = urlparse_cached(request)
+        if self.store is not None and url.netloc not in self._parsers:
+            cached = self.store.get('robots', '%s://%s' % (url.scheme, url.netloc), self.ttl)
+            if cached is not None:
+                body, cost = cached
+                self._parsers[url.netloc] = self._parserimpl.from_crawler(self.crawler, body)
+                self.crawler.stats.inc_value('warm_cache/robots/hits')
+                self.crawler.stats.inc_value('warm_cache/robots/seconds_saved', cost)
+            else:
+                self.crawler.stats.inc_value('warm_cache/robots/misses')
+        return super().robot_parser(request, spider)
+
+    def _parse_robots(self, response, netloc, spider):
+        # A missing robots.txt (404) allows everything and is worth caching as
+        # well; server errors are not, the next run should ask again
+        if self.store is not None and response.status < 500:
+            url = urlparse_cached(response)
+            self.store.put('robots', '%s://%s' % (url.scheme, url.netloc), response.body,
+                           response.meta.get('download_latency', 0.0))
+        return super()._parse_robots(response, netloc, spider)
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+
+class PersistentCachingResolver(CachingThreadedResolver):
+    '''
+    Scrapy's caching resolver, backed by the warm cache file between runs.
+
+    Installed once per process (by CrawlerProcess, which it gets as "crawler"),
+    so it keeps its own counters, which WarmCacheStats copies into the stats.
+    '''
+
+    def __init__(self, reactor, cache_size, timeout, store=None, ttl=300.0):
+        super().__init__(reactor, cache_size, timeout)
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler, reactor):
+        settings = crawler.settings
+        cache_size = settings.getint('DNSCACHE_SIZE') if settings.getbool('DNSCACHE_ENABLED') else 0
+        store = None
+        if cache_size and settings.getbool('WARM_CACHE_ENABLED'):
+            store = WarmCacheStore(cache_path(settings))
+        return cls(reactor, cache_size, settings.getfloat('DNS_TIMEOUT'), store,
+                   settings.getfloat('WARM_CACHE_DNS_TTL', 300.0))
+
+    def getHostByName(self, name, timeout=None):
+        if self.store is None or name in dnscache:
+            return super().getHostByName(name, timeout)
+
+        cached = self.store.get('dns', name, self.ttl)
+        if cached is not None:
+            address, cost = cached
+            dnscache[name] = address
+            self.hits += 1
+            self.seconds_saved += cost
+            return defer.succeed(address)
+
+        self.misses += 1
+        started = time.monotonic()
+        d = super().getHostByName(name, timeout)
+        d.addCallback(self._store_result, name, started)
+        return d
+
+    def _store_result(self, address, name, started):
+        self.store.put('dns', name, address, time.monotonic() - started)
+        return address
+
+
+class TunedHTTP11DownloadHandler(HTTP11DownloadHandler):
+    '''
+    The HTTP/1.1 download handler with a connection pool sized to the crawl.
+
+    Scrapy keeps CONCURRENT_REQUESTS_PER_DOMAIN idle connections per host. When
+    more requests than that are in flight to one host (CONCURRENT_REQUESTS_PER_IP,
+    or AdaptiveThrottle raising a slot's concurrency), every response beyond it
+    closes its connection and the next request opens a new one.
+    '''
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        per_host = max(settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'),
+                       settings.getint('CONCURRENT_REQUESTS_PER_IP'))
+        if settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            per_host = max(per_host, settings.getint('ADAPTIVE_THROTTLE_MAX_CONCURRENCY', 64))
+        self._pool.maxPersistentPerHost = min(per_host, settings.getint('CONCURRENT_REQUESTS'))
+        # Idle connections are closed after this long (Twisted's default is 240 seconds)
+        self._pool.cachedConnectionTimeout = settings.getfloat('HTTP_KEEPALIVE_TIMEOUT', 240.0)
+
+        if crawler is not None:
+            new_connection = self._pool._newConnection
+
+            def counting_new_connection(key, endpoint):
+                crawler.stats.inc_value('warm_cache/connections/opened')
+                return new_connection(key, endpoint)
+
+            self._pool._newConnection = counting_new_connection
+
+
+class WarmCacheStats:
+    '''
+    Adds the DNS counters and the total time saved by the warm cache to the stats.
+    '''
+
+    def __init__(self, crawler):
+        if not crawler.settings.getbool('WARM_CACHE_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def resolver(self):
+        from twisted.internet import reactor
+
+        resolver = getattr(reactor, 'resolver', None)
+        return resolver if isinstance(resolver, PersistentCachingResolver) else None
+
+    def spider_opened(self, spider):
+        # The resolver lives as long as the process, so only count this crawl.
+        # `scrapy crawl` opens the spider before CrawlerProcess.start() installs
+        # the resolver, which then has not counted anything yet
+        resolver = self.resolver()
+        self.start = (resolver.hits, resolver.misses, resolver.seconds_saved) if resolver else (0, 0, 0.0)
+
+    def spider_closed(self, spider):
+        stats = self.crawler.stats
+        resolver = self.resolver()
+        if resolver is not None:
+            hits, misses, seconds_saved = self.start
+            stats.set_value('warm_cache/dns/hits', resolver.hits - hits)
+            stats.set_value('warm_cache/dns/misses', resolver.misses - misses)
+            stats.set_value('warm_cache/dns/seconds_saved', round(resolver.seconds_saved - seconds_saved, 6))
+
+        opened = stats.get_value('warm_cache/connections/opened')
+        if opened is not None:
+            stats.set_value('warm_cache/connections/reused',
+                            max(0, stats.get_value('downloader/request_count', 0) - opened))
+        saved = stats.get_value('warm_cache/robots/seconds_saved', 0) + stats.get_value('warm_cache/dns/seconds_saved', 0)
+        stats.set_value('warm_cache/seconds_saved', round(saved, 6))
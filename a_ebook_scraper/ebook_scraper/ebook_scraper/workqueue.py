@@ -0,0 +1,129 @@
+# A shared work queue for sharded crawls (`scrapy shard`, commands/shard.py).
+#
+# Several `scrapy crawl` processes take their catalogue pages and detail pages
+# from one queue instead of from their own scheduler. A task is claimed with a
+# lease: it stays invisible to the other workers until it is acked, and goes
+# back to the queue if the lease runs out first (the worker crashed or hung).
+# That is how SQS, Pub/Sub or a Redis stream with consumer groups behave, so
+# the SQLite file here is a stand-in that a real broker can replace: anything
+# with the same methods can be plugged in with EBOOK_SHARD_QUEUE_CLASS.
+#
+# Tasks are dicts that can be stored as JSON, e.g.
+#   {'url': '.../page-7.html', 'kind': 'page', 'page': 7}
+#   {'url': '.../a-book_42/index.html', 'kind': 'detail', 'listing': {...}}
+# A URL is only ever queued once, so two workers that find the same detail
+# page do not both fetch it.
+
+import json
+import sqlite3
+import time
+
+
+class SQLiteWorkQueue:
+    '''
+    A work queue in one SQLite file, shared by processes on one machine.
+
+    The interface a broker-backed queue has to provide:
+        put(tasks)               queue tasks, ignoring URLs queued before
+        claim(worker, limit)     lease up to limit tasks -> [(task_id, task)]
+        ack(task_id)             the task is done
+        fail(task_id)            give the task back, or give up on it after max_attempts
+        finished()               nothing is pending or leased any more
+        counts()                 {'pending': n, 'leased': n, 'done': n, 'failed': n}
+        purge()                  drop every task (before a new crawl)
+        close()
+    '''
+
+    def __init__(self, path, lease_seconds=60.0, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Autocommit, transactions are started explicitly where they matter
+        self.connection = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, id)')
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get('EBOOK_SHARD_QUEUE'),
+            lease_seconds=settings.getfloat('EBOOK_SHARD_LEASE_SECONDS', 60.0),
+            max_attempts=settings.getint('EBOOK_SHARD_MAX_ATTEMPTS', 3),
+        )
+
+    def put(self, tasks):
+        # One transaction for the whole batch, e.g. every page of the catalogue
+        rows = [(task['url'], json.dumps(task)) for task in tasks]
+        with self.transaction():
+            self.connection.executemany('INSERT OR IGNORE INTO tasks (url, payload) VALUES (?, ?)', rows)
+        return len(rows)
+
+    def claim(self, worker, limit):
+        # Pending tasks and tasks whose lease ran out, lowest id (oldest) first
+        now = time.time()
+        with self.transaction():
+            rows = self.connection.execute('''
+                UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM tasks
+                    WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?)
+                    ORDER BY id LIMIT ?
+                )
+                RETURNING id, payload
+            ''', (str(worker), now + self.lease_seconds, now, limit)).fetchall()
+        return sorted((task_id, json.loads(payload)) for task_id, payload in rows)
+
+    def ack(self, task_id):
+        self.connection.execute("UPDATE tasks SET state = 'done', lease_until = NULL WHERE id = ?", (task_id,))
+
+    def fail(self, task_id):
+        self.connection.execute('''
+            UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                             lease_until = NULL
+            WHERE id = ?
+        ''', (self.max_attempts, task_id))
+
+    def finished(self):
+        return self.connection.execute(
+            "SELECT NOT EXISTS (SELECT 1 FROM tasks WHERE state IN ('pending', 'leased'))"
+        ).fetchone()[0] == 1
+
+    def counts(self):
+        counts = dict.fromkeys(('pending', 'leased', 'done', 'failed'), 0)
+        counts.update(self.connection.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state'))
+        return counts
+
+    def close(self):
+        self.connection.close()
+
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers claiming
+        # at the same time wait for each other instead of failing with "locked"
+        return _Transaction(self.connection)
+
+    def purge(self):
+        # Empties the queue before a new sharded crawl
+        self.connection.execute('DELETE FROM tasks')
+
+
+class _Transaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
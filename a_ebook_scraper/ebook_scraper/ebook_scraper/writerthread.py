@@ -0,0 +1,188 @@
+# Runs a slow item sink (Excel, SQLite, Parquet, ...) on a writer thread of its
+# own, so appending rows and saving files no longer blocks the reactor thread.
+#
+# The reactor thread only collects items into batches and hands each full batch
+# over through a bounded queue. When the writer falls behind and the queue is
+# full, process_item() returns a Deferred that fires once there is room again.
+# Scrapy waits for those Deferreds before it lets more items through, so a slow
+# sink slows the crawl down instead of piling up items in memory.
+#
+# Existing pipelines adopt it by naming it as their sink, see e.g.
+# ThreadedExcelAppendPipeline in pipelines.py. Other methods of the sink, such
+# as the checkpoint() of CheckpointMiddleware, go through call_sink(), which
+# runs them on the writer thread in order with the items.
+
+import collections
+import logging
+import queue
+import threading
+
+from scrapy.exceptions import DropItem
+from twisted.internet import defer, task
+from twisted.python import failure
+
+logger = logging.getLogger(__name__)
+
+
+class WriterThreadPipeline:
+    '''
+    Feeds the items to sink_class on a dedicated thread.
+
+    Every method of the sink (open_spider, process_item and close_spider) runs
+    on the writer thread, so sinks holding thread-bound objects such as a
+    sqlite3 connection work unchanged. The sink has to be synchronous, and it
+    is the end of the line: items are passed on to the next pipeline right
+    away, and whatever the sink returns (or a DropItem it raises) is ignored.
+    Other errors are logged and counted in the stats, writer_thread/<sink>/errors.
+
+    Settings: WRITER_THREAD_BATCH_SIZE items per hand-off,
+    WRITER_THREAD_QUEUE_SIZE batches waiting for the writer, and
+    WRITER_THREAD_FLUSH_INTERVAL seconds after which a partial batch is
+    handed over anyway.
+    '''
+
+    # The pipeline to run on the writer thread (set by subclasses)
+    sink_class = None
+
+    def __init__(self, sink, stats, batch_size=500, queue_size=8, flush_interval=1.0):
+        self.sink = sink
+        self.stats = stats
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.prefix = 'writer_thread/%s' % type(sink).__name__
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # The sink is built the way Scrapy would build it as a pipeline of its own
+        if hasattr(cls.sink_class, 'from_crawler'):
+            sink = cls.sink_class.from_crawler(crawler)
+        else:
+            sink = cls.sink_class()
+        settings = crawler.settings
+        return cls(
+            sink,
+            crawler.stats,
+            batch_size=settings.getint('WRITER_THREAD_BATCH_SIZE', 500),
+            queue_size=settings.getint('WRITER_THREAD_QUEUE_SIZE', 8),
+            flush_interval=settings.getfloat('WRITER_THREAD_FLUSH_INTERVAL', 1.0),
+        )
+
+    def open_spider(self, spider):
+        from twisted.internet import reactor
+
+        self.reactor = reactor
+        self.spider = spider
+        self.batch = []
+        # Batches (and the closing None) that did not fit into the queue, with their Deferreds
+        self.waiting = collections.deque()
+        self.closed = defer.Deferred()
+        # Set once the writer thread has closed the sink
+        self.done = False
+        self.thread = threading.Thread(target=self._run, name=self.prefix, daemon=True)
+        self.thread.start()
+
+        # A slow crawl should not leave its last items sitting in a partial batch
+        self.flusher = task.LoopingCall(self._flush)
+        self.flusher.start(self.flush_interval, now=False)
+
+    def process_item(self, item, spider):
+        self.batch.append(item)
+        if len(self.batch) >= self.batch_size:
+            waiting = self._flush()
+            if waiting is not None:
+                # Hold this item (and with it the response it came from) until
+                # the writer has taken a batch off the queue
+                return waiting.addCallback(lambda _: item)
+        return item
+
+    def close_spider(self, spider):
+        # Hand over the rest, then wait until the sink has written and closed everything
+        if self.flusher.running:
+            self.flusher.stop()
+        self._flush()
+        self._hand_off(None)
+        return self.closed
+
+    def call_sink(self, name, *args):
+        '''
+        Runs a method of the sink on the writer thread, after every item handed over before.
+
+        Returns a Deferred with its result. Once the writer is done the method
+        is called right away.
+        '''
+        if self.done:
+            return defer.maybeDeferred(getattr(self.sink, name), *args)
+        self._flush()
+        result = defer.Deferred()
+        self._hand_off((name, args, result))
+        return result
+
+    def _flush(self):
+        # Hands the current batch to the writer; returns a Deferred if it has to wait
+        if not self.batch:
+            return None
+        batch, self.batch = self.batch, []
+        return self._hand_off(batch)
+
+    def _hand_off(self, batch):
+        if not self.waiting:
+            try:
+                self.queue.put_nowait(batch)
+                return None
+            except queue.Full:
+                pass
+        self.stats.inc_value(self.prefix + '/backpressure', spider=self.spider)
+        waiting = defer.Deferred()
+        self.waiting.append((batch, waiting))
+        return waiting
+
+    def _release(self):
+        # Called on the reactor thread every time the writer takes a batch off the queue
+        while self.waiting and not self.queue.full():
+            batch, waiting = self.waiting.popleft()
+            self.queue.put_nowait(batch)
+            waiting.callback(None)
+
+    def _run(self):
+        # The writer thread: open the sink, write batches until None arrives, close it
+        spider = self.spider
+        self._call(getattr(self.sink, 'open_spider', None), spider)
+        while True:
+            batch = self.queue.get()
+            self.reactor.callFromThread(self._release)
+            if batch is None:
+                break
+            if isinstance(batch, tuple):
+                self._call_for(*batch)
+                continue
+            for item in batch:
+                self._call(self.sink.process_item, item, spider)
+            self.reactor.callFromThread(self.stats.inc_value, self.prefix + '/items', len(batch), spider=spider)
+        self._call(getattr(self.sink, 'close_spider', None), spider)
+        self.reactor.callFromThread(self._done)
+
+    def _done(self):
+        self.done = True
+        self.closed.callback(None)
+
+    def _call_for(self, name, args, result):
+        # A call_sink() on the writer thread, its outcome goes back to the reactor thread
+        try:
+            value = getattr(self.sink, name)(*args)
+        except Exception:
+            self.reactor.callFromThread(result.errback, failure.Failure())
+        else:
+            self.reactor.callFromThread(result.callback, value)
+
+    def _call(self, method, *args):
+        if method is None:
+            return
+        try:
+            method(*args)
+        except DropItem:
+            pass
+        except Exception:
+            logger.exception('Error in %s.%s', type(self.sink).__name__, method.__name__,
+                             extra={'spider': self.spider})
+            self.reactor.callFromThread(self.stats.inc_value, self.prefix + '/errors', spider=self.spider)
@@ -0,0 +1,57 @@
+'''
+AdaptiveThrottle against the rate limited CatalogueServer of benchmarks/server.py.
+
+The server serves MAX_IN_FLIGHT requests at a time and answers any request
+beyond that with 429 and a Retry-After header. The crawl starts with a
+CONCURRENT_REQUESTS_PER_DOMAIN far above the limit, which is not told to the
+throttle, and runs in a process of its own like the benchmarks do
+(benchmarks.bench_crawl.run_scenario).
+'''
+from benchmarks.bench_crawl import run_scenario
+from benchmarks.server import CatalogueServer
+from ebook_scraper.throttle import SlotController
+
+BOOKS = 2000
+MAX_IN_FLIGHT = 4
+
+ADAPTIVE = {
+    'ITEM_PIPELINES': {},
+    'EBOOK_PAGINATION': 'fanout',
+    'CONCURRENT_REQUESTS': 64,
+    'CONCURRENT_REQUESTS_PER_DOMAIN': 32,
+    'ADAPTIVE_THROTTLE_ENABLED': True,
+    'EXTENSIONS': {'ebook_scraper.throttle.AdaptiveThrottle': 500},
+}
+
+
+def test_slot_controller_halves_on_429_and_stays_below_it():
+    controller = SlotController(start=8, probe_interval=30.0)
+    assert controller.observe(0.05, 429, now=100.0) == 'decrease/status_429'
+    assert controller.concurrency == 4
+    # More 429s of the same burst do not back off again
+    assert controller.observe(0.05, 429, now=100.1) is None
+    assert controller.concurrency == 4
+    # Growing again stops one below the concurrency that was rejected
+    for step in range(200):
+        controller.observe(0.05, 200, now=101.0 + step * 0.01)
+    assert controller.concurrency == 7
+
+
+def test_adaptive_throttle_backs_off_without_losing_books():
+    server = CatalogueServer(books=BOOKS, latency=0.02, max_in_flight=MAX_IN_FLIGHT, retry_after=1).start()
+    try:
+        result = run_scenario('adaptive', 'books_items', ADAPTIVE, server.base_url, BOOKS,
+                              stats=['adaptive_throttle/', 'retry/', 'downloader/response_status_count/'])
+    finally:
+        server.shutdown()
+
+    assert 'error' not in result, result
+    stats = result['stats']
+    # The server did push back, and the throttle halved the concurrency for it
+    assert server.rejected > 0
+    assert stats.get('adaptive_throttle/decrease/status_429', 0) >= 1
+    concurrency = {key: value for key, value in stats.items() if key.endswith('/concurrency')}
+    assert concurrency and all(value < ADAPTIVE['CONCURRENT_REQUESTS_PER_DOMAIN'] for value in concurrency.values())
+    # Every 429 was retried successfully: no request ran out of retries, no book is missing
+    assert 'retry/max_reached' not in stats
+    assert result['items'] == BOOKS